@@ -0,0 +1,138 @@
+"""
+Analyse a directory of financial filings from the command line.
+
+    python batch.py filings/2024Q4 --output results.jsonl --concurrency 4
+
+Every PDF found under the given paths is run through the same pipeline as the API
+(income statement extraction, then the financial story) and one JSON object per file
+is appended to the output file as soon as it finishes. The output doubles as the
+checkpoint: re-running the same command skips files that already completed, so an
+interrupted run picks up where it stopped. Failed files are retried on the next run.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+from services.executors import warm_up_executors, shutdown_executors
+from services.logging_config import configure_logging, bind_task_id
+from services.model_runner import close_async_client
+from services.pipeline import analyze_document
+from services.uploads import UPLOAD_CHUNK_SIZE
+
+def find_pdfs(paths, recursive: bool = True):
+    """Return the PDF files under `paths` (files or directories) in a stable order."""
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        if recursive:
+            for root, _, names in os.walk(path):
+                found.extend(os.path.join(root, name) for name in names if name.lower().endswith(".pdf"))
+        else:
+            found.extend(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(".pdf") and os.path.isfile(os.path.join(path, name))
+            )
+    return sorted(set(found))
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_checkpoint(output_path: str) -> set:
+    """Content hashes of the files that already completed in a previous run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a partial last line
+                continue
+            if record.get("status") == "completed":
+                done.add(record.get("sha256"))
+    return done
+
+async def run_batch(pdf_paths, output_path: str, concurrency: int = 4, include_story: bool = True) -> dict:
+    """
+    Analyse `pdf_paths` with at most `concurrency` documents in flight and append the results to `output_path`.
+    Parsing happens in the parse pool while other documents wait on the model, so both stay busy.
+    """
+    loop = asyncio.get_event_loop()
+    done = load_checkpoint(output_path)
+    queue = asyncio.Queue()
+    for path in pdf_paths:
+        queue.put_nowait(path)
+    counts = {"completed": 0, "error": 0, "skipped": 0}
+    total = len(pdf_paths)
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        def write_record(record: dict) -> None:
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+        async def worker():
+            while not queue.empty():
+                path = queue.get_nowait()
+                sha256 = await loop.run_in_executor(None, file_sha256, path)
+                # Also skips duplicate copies of a file within this run
+                if sha256 in done:
+                    counts["skipped"] += 1
+                    continue
+                done.add(sha256)
+                try:
+                    with bind_task_id(os.path.basename(path)):
+                        result = await analyze_document(path, sha256, include_story=include_story)
+                    failed = "error" in result["income_statement"] or (result["story"] or "").startswith("Error:")
+                    record = {"file": path, "sha256": sha256, "status": "error" if failed else "completed", **result}
+                except Exception as e:
+                    record = {"file": path, "sha256": sha256, "status": "error", "error": str(e)}
+                counts[record["status"]] += 1
+                write_record(record)
+                finished = sum(counts.values())
+                print(f"[{finished}/{total}] {record['status']}: {path}")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    return counts
+
+async def _main(args) -> dict:
+    try:
+        return await run_batch(find_pdfs(args.paths, recursive=not args.no_recursive), args.output,
+                               concurrency=args.concurrency, include_story=not args.no_story)
+    finally:
+        await close_async_client()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Extract income statements and write financial stories for a directory of PDFs.")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories containing PDFs")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSON Lines output, also used as the resume checkpoint")
+    parser.add_argument("-c", "--concurrency", type=int, default=int(os.environ.get("BATCH_CONCURRENCY", 4)),
+                        help="documents processed at once")
+    parser.add_argument("--no-story", action="store_true", help="only extract the income statements")
+    parser.add_argument("--no-recursive", action="store_true", help="don't descend into subdirectories")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    start_time = time.time()
+    warm_up_executors()
+    try:
+        counts = asyncio.run(_main(args))
+    finally:
+        shutdown_executors()
+    print(f"Done in {time.time() - start_time:.2f} seconds: {counts['completed']} completed, "
+          f"{counts['error']} failed, {counts['skipped']} already done")
+    return 1 if counts["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
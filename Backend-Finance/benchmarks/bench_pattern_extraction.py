@@ -0,0 +1,162 @@
+"""
+Micro-benchmark for extract_financial_values_with_patterns.
+
+Compares the single-pass compiled matcher against the previous implementation,
+which ran one re.findall per pattern over the full text.
+
+Usage (from Backend-Finance/):
+    python benchmarks/bench_pattern_extraction.py [--pages 300] [--repeat 5]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.parse_pdf import extract_financial_values_with_patterns, normalize_number  # noqa: E402
+
+# Patterns exactly as the previous implementation used them
+LEGACY_PATTERNS = {
+    'Revenue': [
+        r'(?:Total\s+)?Revenue[s]?[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'(?:Total\s+)?Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Revenue[s]?[:\s]*[\$]?([\d,]+(?:\.\d+)?)',
+        r'Total\s+operating\s+revenues?[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'(?:Total\s+)?Net\s+Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'(?:Automotive\s+)?Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Net\s+Revenue[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Net\s+Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Net\s+Operating\s+Revenue[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+    ],
+    'Cost_of_Revenue': [
+        r'Cost\s+of\s+(?:Revenue|Sales)[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Cost\s+of\s+goods\s+sold[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'COGS[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Cost\s+of\s+products\s+sold[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Direct\s+costs?[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
+    ],
+    'Gross_Profit': [
+        r'Gross\s+Profit[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Gross\s+Margin[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Gross\s+Income[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
+    ],
+    'Operating_Expenses': [
+        r'(?:Total\s+)?Operating\s+Expenses[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'(?:Total\s+)?OpEx[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'(?:Total\s+)?Operating\s+Costs(?:\s+and\s+Expenses)?[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Selling,\s+General\s+and\s+Administrative\s+Expenses[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'SG&A\s+Expenses[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
+    ],
+    'Operating_Income': [
+        r'Operating\s+(?:Income|Profit)[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Income\s+[Ff]rom\s+[Oo]perations[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Operating\s+Earnings[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'EBIT[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
+    ],
+    'Net_Income': [
+        r'Net\s+(?:Income|Profit|Earnings)[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Profit\s+for\s+the\s+(?:year|period)[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Net\s+Earnings[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'(?:Net\s+)?Profit[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Bottom\s+Line[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
+    ],
+    'Research_Development': [
+        r'Research\s+(?:and|\&)?\s*Development[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'R\s*(?:\&|and)\s*D[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
+    ],
+    'Sales_Marketing': [
+        r'Sales\s+(?:and|\&)?\s*Marketing[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'Marketing\s+(?:and|\&)?\s*Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
+    ],
+    'General_Administrative': [
+        r'General\s+(?:and|\&)?\s*Administrative[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
+        r'G\s*(?:\&|and)\s*A[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
+    ]
+}
+
+def legacy_extract_financial_values(text):
+    """The previous implementation: one uncompiled findall per pattern, plus the parenthesised variants."""
+    results = {}
+    for field, patterns in LEGACY_PATTERNS.items():
+        for pattern in patterns:
+            matches = re.findall(pattern, text, re.IGNORECASE)
+            if matches:
+                value = normalize_number(matches[0])
+                if value is not None:
+                    results[field] = value
+                    break
+    for field in LEGACY_PATTERNS:
+        if field in results:
+            continue
+        for pattern in LEGACY_PATTERNS[field]:
+            paren_pattern = pattern.replace(r'([\d,]+(?:\.\d+)?)', r'\(([\d,]+(?:\.\d+)?)\)')
+            matches = re.findall(paren_pattern, text, re.IGNORECASE)
+            if matches:
+                value = normalize_number(matches[0])
+                if value is not None:
+                    results[field] = -value
+                    break
+    return results
+
+FILLER_WORDS = (
+    "the company operates in a competitive market and its results of operations depend on demand "
+    "for products customers suppliers regulation liquidity capital resources risk factors during the "
+    "fiscal year management believes that cash flows will be sufficient to fund operations total "
+    "assets liabilities equity segment information goodwill intangible lease obligations"
+).split()
+
+STATEMENT_ROWS = [
+    "Total revenues", "Cost of revenue", "Gross profit", "Research and development",
+    "Sales and marketing", "General and administrative", "Total operating expenses",
+    "Operating income", "Net income",
+]
+
+def make_synthetic_filing(pages: int, seed: int = 7) -> str:
+    """Build cleaned, whitespace-collapsed text resembling a long annual report."""
+    rng = random.Random(seed)
+    chunks = []
+    statement_page = pages * 2 // 3
+    for page in range(pages):
+        if page == statement_page:
+            for label in STATEMENT_ROWS:
+                chunks.append(f"{label} {rng.randint(100, 99999):,} {rng.randint(100, 99999):,}")
+        else:
+            chunks.append(" ".join(rng.choice(FILLER_WORDS) for _ in range(450)))
+    return " ".join(chunks)
+
+def time_call(func, text, repeat):
+    """Return the best wall-clock time of `repeat` runs, with stdout silenced."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func(text)
+            best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300, help="Number of synthetic pages")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per implementation (best is reported)")
+    args = parser.parse_args()
+
+    text = make_synthetic_filing(args.pages)
+    print(f"Synthetic filing: {args.pages} pages, {len(text) / 1e6:.2f} MB of text")
+
+    legacy_time, legacy_result = time_call(legacy_extract_financial_values, text, args.repeat)
+    new_time, new_result = time_call(extract_financial_values_with_patterns, text, args.repeat)
+
+    print(f"legacy (per-pattern findall): {legacy_time * 1000:9.1f} ms")
+    print(f"compiled single pass:         {new_time * 1000:9.1f} ms")
+    print(f"speedup:                      {legacy_time / new_time:9.1f}x")
+    if legacy_result != new_result:
+        print(f"WARNING: results differ\n  legacy: {legacy_result}\n  new:    {new_result}")
+
+if __name__ == "__main__":
+    main()
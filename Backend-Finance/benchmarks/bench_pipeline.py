@@ -0,0 +1,290 @@
+"""
+Benchmark for the parse-to-story pipeline, stage by stage and end to end.
+
+Runs every synthetic filing (see synthetic_pdfs.py) through:
+  extract_text        extract_text_from_pdf on the whole document
+  detect_scale        detect_scale_notation on the whole document text
+  clean_text          clean_text_for_extraction on the whole document text
+  pattern_extraction  extract_financial_values_with_patterns on the cleaned text
+  parse               parse_income_statement, the CPU stage as the API runs it
+  e2e                 POST /api/process and the progress stream until the result is in
+and times the model calls (llm_extraction, llm_story, and llm_mixed with both models
+at once) against the mock Ollama server (mock_ollama.py), so no GPU or model download
+is needed. The mock charges --swap-latency whenever it has to switch models.
+
+Reports p50/p95/p99 latency, throughput and peak RSS. Results can be saved as a
+baseline and later runs compared against it; the exit code is 1 when any p50
+regressed by more than --threshold.
+
+Usage (from Backend-Finance/):
+    python benchmarks/bench_pipeline.py [--sizes 5 50 500] [--repeat 3] [--baseline benchmarks/baseline.json]
+    python benchmarks/bench_pipeline.py --save-baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from mock_ollama import MockOllamaServer  # noqa: E402
+from synthetic_pdfs import SIZES, SCALES, corpus  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CPU_STAGES = ["extract_text", "detect_scale", "clean_text", "pattern_extraction", "parse"]
+ALL_STAGES = CPU_STAGES + ["llm", "e2e"]
+
+def percentile(samples, pct: float) -> float:
+    """Percentile with linear interpolation between the closest ranks."""
+    ordered = sorted(samples)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(samples, pages: int = None, wall: float = None) -> dict:
+    """Latency percentiles in milliseconds and throughput for one stage."""
+    elapsed = wall if wall is not None else sum(samples)
+    summary = {
+        "runs": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "throughput_per_s": len(samples) / elapsed if elapsed else 0.0,
+    }
+    if pages:
+        summary["pages_per_s"] = pages * len(samples) / elapsed if elapsed else 0.0
+    return {key: round(value, 3) for key, value in summary.items()}
+
+def peak_rss_mb() -> dict:
+    """Peak resident set size of this process and of its (parse pool) children."""
+    if resource is None:
+        return {}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit,
+    }
+
+def time_repeated(func, arg, repeat: int):
+    """Run func(arg) `repeat` times with stdout silenced; return the durations and the last result."""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func(arg)
+            samples.append(time.perf_counter() - start)
+    return samples, result
+
+def count_correct(pattern_results: dict, expected: dict) -> int:
+    return sum(1 for field, value in expected.items()
+               if field in pattern_results and abs(abs(pattern_results[field]) - abs(value)) < 0.5)
+
+def bench_cpu_stages(documents, repeat: int, stages, results: dict, accuracy: dict) -> None:
+    from services.parse_pdf import (
+        extract_text_from_pdf, detect_scale_notation, clean_text_for_extraction,
+        extract_financial_values_with_patterns, parse_income_statement
+    )
+    for name, pages, _, pdf_bytes, expected in documents:
+        with contextlib.redirect_stdout(io.StringIO()):
+            text = extract_text_from_pdf(pdf_bytes)
+            cleaned = clean_text_for_extraction(text)
+        runs = {
+            "extract_text": (extract_text_from_pdf, pdf_bytes),
+            "detect_scale": (detect_scale_notation, text),
+            "clean_text": (clean_text_for_extraction, text),
+            "pattern_extraction": (extract_financial_values_with_patterns, cleaned),
+            "parse": (parse_income_statement, pdf_bytes),
+        }
+        for stage in CPU_STAGES:
+            if stage not in stages:
+                continue
+            func, arg = runs[stage]
+            samples, result = time_repeated(func, arg, repeat)
+            results[f"{stage}/{name}"] = summarize(samples, pages)
+            if stage == "parse":
+                accuracy[name] = f"{count_correct(result['pattern_results'], expected)}/{len(expected)}"
+
+async def bench_llm(calls: int, concurrency: int, mock: MockOllamaServer, results: dict) -> None:
+    from services.parse_pdf import async_extract_llm_financial_data
+    from services.generate_story import async_generate_story_from_json
+    from services.model_runner import close_async_client
+
+    semaphore = asyncio.Semaphore(concurrency)
+    text = "Total revenues 52,461 Cost of revenue 31,000 Net income 7,200 " * 50
+    data = {"Revenue": "52,461", "Cost_of_Revenue": "31,000", "Gross_Profit": "21,461", "Net_Income": "7,200"}
+
+    async def timed(coro_func, arg, samples):
+        async with semaphore:
+            start = time.perf_counter()
+            await coro_func(arg)
+            samples.append(time.perf_counter() - start)
+
+    try:
+        for stage, coro_func, arg in (("llm_extraction", async_extract_llm_financial_data, text),
+                                      ("llm_story", async_generate_story_from_json, data)):
+            samples = []
+            tokens_before = mock.tokens
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                await asyncio.gather(*(timed(coro_func, arg, samples) for _ in range(calls)))
+            wall = time.perf_counter() - start
+            results[stage] = summarize(samples, wall=wall)
+            results[stage]["tokens_per_s"] = round((mock.tokens - tokens_before) / wall, 3)
+
+        # Both models at once, as when one document's story overlaps the next one's extraction
+        samples = []
+        tokens_before, swaps_before = mock.tokens, mock.swaps
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.gather(*(timed(coro_func, arg, samples) for _ in range(calls)
+                                   for coro_func, arg in ((async_extract_llm_financial_data, text),
+                                                          (async_generate_story_from_json, data))))
+        wall = time.perf_counter() - start
+        results["llm_mixed"] = summarize(samples, wall=wall)
+        results["llm_mixed"]["tokens_per_s"] = round((mock.tokens - tokens_before) / wall, 3)
+        results["llm_mixed"]["model_swaps"] = mock.swaps - swaps_before
+    finally:
+        await close_async_client()
+
+def bench_e2e(documents, repeat: int, results: dict) -> None:
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        for name, pages, _, pdf_bytes, _ in documents:
+            samples = []
+            for _ in range(repeat):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    response = client.post("/api/process", files={"file": (f"{name}.pdf", pdf_bytes, "application/pdf")})
+                    response.raise_for_status()
+                    task_id = response.json()["task_id"]
+                    status = None
+                    with client.stream("GET", f"/api/progress/{task_id}") as stream:
+                        for line in stream.iter_lines():
+                            if line.startswith("data:"):
+                                status = json.loads(line[5:]).get("status")
+                                if status in ("completed", "error"):
+                                    break
+                    samples.append(time.perf_counter() - start)
+                if status != "completed":
+                    print(f"WARNING: {name} finished with status {status}")
+            results[f"e2e/{name}"] = summarize(samples, pages)
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """Print p50 changes against the baseline and return the keys that regressed."""
+    regressions = []
+    print(f"\n{'stage':<36} {'baseline p50':>13} {'current p50':>13} {'change':>8}")
+    for key, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(key)
+        if previous is None or not previous["p50_ms"]:
+            continue
+        change = (current["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"]
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{key:<36} {previous['p50_ms']:>11.1f}ms {current['p50_ms']:>11.1f}ms {change:>+7.0%}{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+def print_results(results: dict) -> None:
+    print(f"\n{'stage':<36} {'p50':>9} {'p95':>9} {'p99':>9} {'ops/s':>8} {'pages/s':>9}")
+    for key, stats in results["stages"].items():
+        pages = f"{stats['pages_per_s']:>9.0f}" if "pages_per_s" in stats else f"{'':>9}"
+        print(f"{key:<36} {stats['p50_ms']:>7.1f}ms {stats['p95_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms "
+              f"{stats['throughput_per_s']:>8.2f} {pages}")
+        if "tokens_per_s" in stats:
+            swaps = f", {stats['model_swaps']} model swaps" if "model_swaps" in stats else ""
+            print(f"{'':<36} {stats['tokens_per_s']:.0f} tokens/s{swaps}")
+    if results["accuracy"]:
+        print("\npattern extraction accuracy: " + ", ".join(f"{k} {v}" for k, v in results["accuracy"].items()))
+    if results["peak_rss_mb"]:
+        rss = results["peak_rss_mb"]
+        print(f"peak RSS: {rss['self']:.0f} MB (parse workers {rss['children']:.0f} MB)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="Page counts of the synthetic filings")
+    parser.add_argument("--scales", nargs="+", default=list(SCALES), choices=SCALES)
+    parser.add_argument("--stages", nargs="+", default=ALL_STAGES, choices=ALL_STAGES)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per document and stage")
+    parser.add_argument("--llm-calls", type=int, default=12, help="Model calls per LLM stage")
+    parser.add_argument("--llm-concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.1, help="Mock Ollama time to first token (seconds)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Mock Ollama tokens per second")
+    parser.add_argument("--swap-latency", type=float, default=0.5, help="Mock Ollama time to switch models (seconds)")
+    parser.add_argument("--baseline", help="Compare against this results file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="p50 slowdown counted as a regression")
+    parser.add_argument("--save-baseline", help="Write the results to this file")
+    args = parser.parse_args()
+
+    mock = MockOllamaServer(latency=args.latency, token_rate=args.token_rate, swap_latency=args.swap_latency).start()
+    # Must be set before the services read their configuration at import time
+    os.environ["OLLAMA_URL"] = mock.url
+    os.environ["RESULT_CACHE_ENABLED"] = "0"
+    # Every benchmarked call has the same prompt; time the model calls rather than their coalescing
+    os.environ["OLLAMA_COALESCE"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    print(f"Generating synthetic filings: sizes {args.sizes}, scales {args.scales}")
+    documents = list(corpus(args.sizes, args.scales))
+
+    stages = {}
+    accuracy = {}
+    bench_cpu_stages(documents, args.repeat, args.stages, stages, accuracy)
+    if "llm" in args.stages:
+        asyncio.run(bench_llm(args.llm_calls, args.llm_concurrency, mock, stages))
+    if "e2e" in args.stages:
+        bench_e2e(documents, args.repeat, stages)
+    mock.stop()
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "mock_latency_s": args.latency,
+            "mock_token_rate": args.token_rate,
+            "mock_swap_latency_s": args.swap_latency,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": stages,
+        "accuracy": accuracy,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) more than {args.threshold:.0%} slower than the baseline")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Local stand-in for the Ollama HTTP API, for benchmarks and offline development.
+
+Answers /api/generate (streaming and non-streaming) and /api/tags. Each request waits
+`latency` seconds before the first token, then produces tokens at `token_rate` per second,
+so model-bound stages can be timed reproducibly without a GPU. Extraction prompts get a
+JSON income statement back, fenced and followed by a note unless the request sets `format`;
+anything else gets `story_tokens` words of prose. A stream stops when the client disconnects.
+
+With `swap_latency` set, the mock holds one model in memory at a time, like a host that
+can't fit both: a request for another model waits until the loaded model is idle, then
+pays `swap_latency` seconds to load its own.
+
+Usage (from Backend-Finance/):
+    python benchmarks/mock_ollama.py [--port 11434] [--latency 0.2] [--token-rate 50] [--swap-latency 2]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EXTRACTION_FIELDS = {
+    "Revenue": 52461, "Cost_of_Revenue": 31000, "Gross_Profit": 21461,
+    "Operating_Expenses": 12000, "Operating_Income": 9461, "Net_Income": 7200,
+    "Research_Development": 4200, "Sales_Marketing": 5100, "General_Administrative": 2700,
+}
+# What a model tends to wrap the object in when nothing constrains its output
+EXTRACTION_PREAMBLE = "Here is the income statement data extracted from the document:\n\n```json\n"
+EXTRACTION_NOTE = "\n```\n\nNote: values are as printed in the document, without the scale factor applied."
+# Characters per token of the JSON answers
+JSON_TOKEN_CHARS = 4
+
+STORY_WORDS = (
+    "Revenue grew steadily over the year while cost discipline kept gross margin healthy and "
+    "operating leverage lifted income as investment in research continued"
+).split()
+
+class MockOllamaServer:
+    """A threaded HTTP server that mimics Ollama's latency and token rate."""
+
+    def __init__(self, port: int = 0, latency: float = 0.1, token_rate: float = 100.0,
+                 story_tokens: int = 120, host: str = "127.0.0.1", swap_latency: float = 0.0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.story_tokens = story_tokens
+        self.swap_latency = swap_latency
+        self.requests = 0
+        self.tokens = 0
+        self.swaps = 0
+        self.loaded_model = None
+        self._active = 0
+        self._lock = threading.Lock()
+        self._model_ready = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def response_tokens(self, prompt: str, structured: bool = False):
+        """Tokens (roughly words) the mock model answers `prompt` with; `structured` when `format` is set."""
+        if "json" in prompt.lower():
+            if structured:
+                text = json.dumps(EXTRACTION_FIELDS)
+            else:
+                text = EXTRACTION_PREAMBLE + json.dumps(EXTRACTION_FIELDS, indent=2) + EXTRACTION_NOTE
+            return [text[i:i + JSON_TOKEN_CHARS] for i in range(0, len(text), JSON_TOKEN_CHARS)]
+        return [STORY_WORDS[i % len(STORY_WORDS)] + " " for i in range(self.story_tokens)]
+
+    def _record(self, tokens: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.tokens += tokens
+
+    def acquire_model(self, model: str) -> None:
+        """Wait until `model` is loaded, loading it once the other model is idle."""
+        if not self.swap_latency:
+            return
+        with self._model_ready:
+            while self.loaded_model not in (None, model) and self._active:
+                self._model_ready.wait()
+            if self.loaded_model != model:
+                # Held under the lock: nothing else is served while a model loads
+                time.sleep(self.swap_latency)
+                self.swaps += self.loaded_model is not None
+                self.loaded_model = model
+            self._active += 1
+
+    def release_model(self) -> None:
+        if not self.swap_latency:
+            return
+        with self._model_ready:
+            self._active -= 1
+            self._model_ready.notify_all()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, body: dict) -> None:
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path != "/api/tags":
+                    self.send_error(404)
+                    return
+                self._send_json({"models": [{"name": "granite3.2-vision:latest"}, {"name": "granite3.3:8b"}]})
+
+            def do_POST(self):
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                prompt = request.get("prompt", "")
+                tokens = mock.response_tokens(prompt, bool(request.get("format")))[:request.get("options", {}).get("num_predict") or None]
+                mock.acquire_model(request.get("model"))
+                try:
+                    self._generate(request, prompt, tokens)
+                finally:
+                    mock.release_model()
+
+            def _generate(self, request: dict, prompt: str, tokens) -> None:
+                start = time.perf_counter()
+                time.sleep(mock.latency)
+                stats = {
+                    "done": True,
+                    "prompt_eval_count": len(prompt.split()),
+                    "eval_count": len(tokens),
+                    "prompt_eval_duration": int(mock.latency * 1e9),
+                    "eval_duration": int(len(tokens) / mock.token_rate * 1e9),
+                }
+
+                if not request.get("stream", True):
+                    mock._record(len(tokens))
+                    time.sleep(len(tokens) / mock.token_rate)
+                    stats["total_duration"] = int((time.perf_counter() - start) * 1e9)
+                    self._send_json({"model": request.get("model"), "response": "".join(tokens).strip(), **stats})
+                    return
+
+                # NDJSON stream, one token per line, sent with chunked transfer encoding
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                sent = 0
+                try:
+                    for token in tokens:
+                        time.sleep(1 / mock.token_rate)
+                        self._write_chunk({"model": request.get("model"), "response": token, "done": False})
+                        sent += 1
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client hung up; like Ollama, stop generating
+                    self.close_connection = True
+                    return
+                finally:
+                    mock._record(sent)
+                stats["total_duration"] = int((time.perf_counter() - start) * 1e9)
+                self._write_chunk({"model": request.get("model"), "response": "", **stats})
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _write_chunk(self, body: dict) -> None:
+                line = (json.dumps(body) + "\n").encode()
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Tokens generated per second")
+    parser.add_argument("--story-tokens", type=int, default=120, help="Length of non-extraction answers")
+    parser.add_argument("--swap-latency", type=float, default=0.0, help="Seconds to switch models; 0 keeps all loaded")
+    args = parser.parse_args()
+
+    server = MockOllamaServer(args.port, args.latency, args.token_rate, args.story_tokens, host=args.host,
+                              swap_latency=args.swap_latency)
+    print(f"Mock Ollama listening on {server.url} (latency {args.latency}s, {args.token_rate} tokens/s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
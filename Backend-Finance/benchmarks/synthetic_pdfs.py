@@ -0,0 +1,158 @@
+"""
+Deterministic synthetic annual reports for benchmarking.
+
+Each document has a table of contents, narrative filler pages, a few note pages with
+numeric tables (which compete with the real statement for the page locator) and one
+consolidated statement of operations stated in millions, thousands or billions.
+
+Usage (from Backend-Finance/):
+    python benchmarks/synthetic_pdfs.py out_dir [--sizes 5 50 500] [--scales millions thousands billions]
+"""
+import argparse
+import os
+import random
+
+import fitz
+
+SIZES = (5, 50, 500)
+SCALES = ("millions", "thousands", "billions")
+
+# Revenue range for each scale, so the statements look like the same kind of company
+REVENUE_RANGE = {
+    "thousands": (5_000_000, 90_000_000),
+    "millions": (5_000, 90_000),
+    "billions": (5, 90),
+}
+
+FILLER_WORDS = (
+    "the company operates in a competitive market and its results of operations depend on demand "
+    "for products customers suppliers regulation liquidity capital resources risk factors during the "
+    "fiscal year management believes that cash flows will be sufficient to fund operations total "
+    "assets liabilities equity segment information goodwill intangible lease obligations"
+).split()
+
+NOTE_ROWS = ["Land", "Buildings", "Machinery and equipment", "Leasehold improvements",
+             "Construction in progress", "Accumulated depreciation"]
+
+def _statement_values(rng, scale: str) -> dict:
+    """Internally consistent income statement line items for three fiscal years (newest first)."""
+    low, high = REVENUE_RANGE[scale]
+    years = []
+    revenue = rng.randint(low, high)
+    for _ in range(3):
+        cost = int(revenue * rng.uniform(0.45, 0.7))
+        rnd = int(revenue * rng.uniform(0.05, 0.15))
+        sales = int(revenue * rng.uniform(0.05, 0.12))
+        admin = int(revenue * rng.uniform(0.03, 0.08))
+        opex = rnd + sales + admin
+        gross = revenue - cost
+        operating = gross - opex
+        net = int(operating * rng.uniform(0.7, 0.85))
+        years.append({
+            "Revenue": revenue,
+            "Cost_of_Revenue": cost,
+            "Gross_Profit": gross,
+            "Research_Development": rnd,
+            "Sales_Marketing": sales,
+            "General_Administrative": admin,
+            "Operating_Expenses": opex,
+            "Operating_Income": operating,
+            "Net_Income": net,
+        })
+        revenue = max(1, int(revenue / rng.uniform(1.02, 1.2)))
+    return years
+
+STATEMENT_LABELS = [
+    ("Total revenues", "Revenue"),
+    ("Cost of revenue", "Cost_of_Revenue"),
+    ("Gross profit", "Gross_Profit"),
+    ("Research and development", "Research_Development"),
+    ("Sales and marketing", "Sales_Marketing"),
+    ("General and administrative", "General_Administrative"),
+    ("Total operating expenses", "Operating_Expenses"),
+    ("Operating income", "Operating_Income"),
+    ("Net income", "Net_Income"),
+]
+
+def _format_amount(value: int) -> str:
+    return f"({-value:,})" if value < 0 else f"{value:,}"
+
+def _filler_page(rng, lines: int = 48) -> str:
+    return "\n".join(" ".join(rng.choice(FILLER_WORDS) for _ in range(14)) for _ in range(lines))
+
+def _insert_row(page, y: float, label: str, cells, fontsize: float = 9) -> None:
+    page.insert_text((50, y), label, fontsize=fontsize)
+    for column, cell in enumerate(cells):
+        page.insert_text((330 + column * 80, y), cell, fontsize=fontsize)
+
+def make_financial_pdf(pages: int, scale: str = "millions", seed: int = 7):
+    """
+    Build a synthetic filing of `pages` pages with its income statement in `scale`.
+
+    Returns (pdf_bytes, expected) where `expected` holds the most recent year's line
+    items as printed in the statement, before the scale is applied.
+    """
+    if scale not in REVENUE_RANGE:
+        raise ValueError(f"Unknown scale '{scale}', expected one of {', '.join(REVENUE_RANGE)}")
+    rng = random.Random(f"{seed}-{pages}-{scale}")
+    years = _statement_values(rng, scale)
+    statement_page = max(1, pages * 2 // 3) if pages > 1 else 0
+    note_pages = {page for page in range(2, pages, 7) if page != statement_page}
+
+    doc = fitz.open()
+    for index in range(pages):
+        page = doc.new_page()
+        if index == statement_page:
+            page.insert_text((50, 60), "ACME HOLDINGS, INC.", fontsize=11)
+            page.insert_text((50, 76), "CONSOLIDATED STATEMENTS OF OPERATIONS", fontsize=11)
+            page.insert_text((50, 92), f"(in {scale}, except per share data)", fontsize=9)
+            _insert_row(page, 120, "Year ended December 31,", ["2024", "2023", "2022"])
+            y = 140
+            for label, field in STATEMENT_LABELS:
+                _insert_row(page, y, label, [_format_amount(year[field]) for year in years])
+                y += 16
+        elif index == 0:
+            page.insert_text((50, 60), "TABLE OF CONTENTS", fontsize=11)
+            toc = ["Business", "Risk Factors", "Selected Financial Data", "Consolidated Statements of Operations",
+                   "Consolidated Balance Sheets", "Notes to Consolidated Financial Statements"]
+            page.insert_text((50, 90), "\n".join(f"{title} .......... {rng.randint(3, max(4, pages))}" for title in toc),
+                             fontsize=10)
+        elif index in note_pages:
+            page.insert_text((50, 60), f"NOTE {index} - PROPERTY AND EQUIPMENT", fontsize=11)
+            _insert_row(page, 90, "", ["2024", "2023"])
+            y = 110
+            for label in NOTE_ROWS:
+                _insert_row(page, y, label, [f"{rng.randint(100, 99999):,}", f"{rng.randint(100, 99999):,}"])
+                y += 16
+            page.insert_text((50, y + 20), _filler_page(rng, 20), fontsize=9)
+        else:
+            page.insert_text((50, 60), _filler_page(rng), fontsize=9)
+
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes, dict(years[0])
+
+def corpus(sizes=SIZES, scales=SCALES, seed: int = 7):
+    """Yield (name, pages, scale, pdf_bytes, expected) for every size and scale combination."""
+    for pages in sizes:
+        for scale in scales:
+            pdf_bytes, expected = make_financial_pdf(pages, scale, seed)
+            yield f"{pages}p-{scale}", pages, scale, pdf_bytes, expected
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", help="Directory to write the PDFs to")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--scales", nargs="+", default=list(SCALES), choices=SCALES)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for name, _, _, pdf_bytes, _ in corpus(args.sizes, args.scales, args.seed):
+        path = os.path.join(args.out_dir, f"{name}.pdf")
+        with open(path, "wb") as f:
+            f.write(pdf_bytes)
+        print(f"{path}: {len(pdf_bytes) / 1024:.0f} KB")
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,29 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Response
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from services.parse_pdf import extract_income_statement
-from services.generate_story import generate_story_from_json
+from services.model_runner import close_async_client
+from services.pipeline import analyze_document
+from services.uploads import (
+    StoredUpload, UploadSizeLimit, receive_pdf_upload, store_pdf_upload, store_zip_upload, is_zip_upload,
+    extract_pdfs_from_zip, MAX_UPLOAD_BYTES, MAX_BATCH_FILES
+)
+from services.task_store import create_task_store
+from services.executors import get_llm_executor, warm_up_executors, shutdown_executors
+from services.job_queue import JobQueue, QueueFull, InflightDocuments, client_key
+from services.metrics import REGISTRY, render_metrics
+from services.logging_config import configure_logging, bind_task_id
 from sse_starlette.sse import EventSourceResponse
 import os
 import logging
-from typing import Dict, Any
 import time
 import asyncio
 import uuid
-from concurrent.futures import ThreadPoolExecutor
 import json
+import zipfile
+from typing import List
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+# Set up logging (queued, with the task ID on every record; see LOG_LEVEL, LOG_LEVELS and LOG_FORMAT)
+configure_logging()
 logger = logging.getLogger("financial-analyzer-api")
 
 app = FastAPI(
@@ -29,7 +36,27 @@ app = FastAPI(
 PORT = int(os.environ.get("PORT", 8000))
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:5173")
 
-# Enable CORS
+# Reject uploads over the size limit, declared or not, before the body has been read
+app.add_middleware(UploadSizeLimit)
+
+@app.middleware("http")
+async def reject_when_queue_full(request: Request, call_next):
+    """Turn uploads away while the job queue is full, before the body is read."""
+    if request.method == "POST" and request.url.path in ("/api/process", "/api/batch"):
+        try:
+            if request.url.path == "/api/batch":
+                job_queue.check_batch(1)
+            else:
+                job_queue.check(client_key(request))
+        except QueueFull as e:
+            return queue_full_response(e)
+    return await call_next(request)
+
+def queue_full_response(e: QueueFull) -> JSONResponse:
+    return JSONResponse(status_code=e.status_code, content={"detail": e.detail},
+                        headers={"Retry-After": str(e.retry_after)})
+
+# Enable CORS (added after the other middleware so it wraps their responses too)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[FRONTEND_URL, "http://localhost:3000", "http://localhost:5173", "*"],
@@ -38,29 +65,76 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-async def validate_file(file: UploadFile = File(...)) -> bytes:
-    """Validate that the uploaded file is a PDF and return its contents."""
-    # Check file size (10MB limit)
-    content = await file.read()
-    if len(content) > 10 * 1024 * 1024:  # 10MB
-        raise HTTPException(status_code=400, detail="File too large (max 10MB)")
-    
-    # Check file type
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are accepted")
-    
-    return content
+async def validate_file(request: Request) -> StoredUpload:
+    """Validate that the uploaded file is a PDF and stream it to a temporary file as it arrives."""
+    return await receive_pdf_upload(request)
+
+# validate_file reads the body itself, so the form is described for the API docs here
+PDF_UPLOAD_OPENAPI = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}
+}}}}}
+
+# Task progress and results, with TTL and LRU eviction (memory by default, SQLite optional)
+task_store = create_task_store()
+
+# Documents being analysed, so a second upload of one follows the first instead of redoing the work
+inflight_documents = InflightDocuments()
+
+def update_task(task_id: str, fields: dict) -> None:
+    """Merge fields into a task and into every upload of the same document following it."""
+    for tid in inflight_documents.tasks(task_id):
+        task_store.update(tid, fields)
+
+def set_task(task_id: str, value: dict) -> None:
+    """Replace the state of a task and of every upload of the same document following it."""
+    for tid in inflight_documents.tasks(task_id):
+        task_store.set(tid, value)
+
+def report_queue_position(task_id: str, position: int) -> None:
+    """Show a waiting upload its place in the queue; position 0 means a worker has picked it up."""
+    if position:
+        update_task(task_id, {"queue_position": position, "message": f"Waiting in queue (position {position})"})
+    else:
+        update_task(task_id, {"queue_position": 0, "message": "Starting process..."})
+
+# Uploads from /api/process and /api/batch, analysed by JOB_WORKERS workers with per-client round-robin
+job_queue = JobQueue(on_position=report_queue_position)
+REGISTRY.gauge("job_queue_depth", "Uploads waiting for a job worker.",
+               collect=lambda: {(): job_queue.stats()["queued"]})
+REGISTRY.gauge("job_queue_running", "Uploads being analysed by a job worker.",
+               collect=lambda: {(): job_queue.stats()["running"]})
+
+# Batch job of each batch file not yet finished; the job is counted on when the file's document is done
+batch_file_jobs = {}
+
+REGISTRY.gauge("task_store_entries", "Tasks held in the task store.",
+               collect=lambda: {(): task_store.stats()["entries"]})
+REGISTRY.gauge("task_store_bytes", "Approximate size of the tasks held in the task store.",
+               collect=lambda: {(): task_store.stats()["bytes"]})
+REGISTRY.gauge("progress_subscribers", "Clients listening on a progress stream.",
+               collect=lambda: {(): task_store.stats()["subscribers"]})
+# Keep-alive comment sent on idle progress streams so proxies don't close them
+PROGRESS_HEARTBEAT = int(os.environ.get("PROGRESS_HEARTBEAT", 15))  # seconds
 
-# Add a simple in-memory storage for task results
-task_results: Dict[str, Any] = {}
+@app.on_event("startup")
+async def start_executors():
+    """Spin up the parse workers before the first upload arrives."""
+    await asyncio.get_event_loop().run_in_executor(None, warm_up_executors)
+    job_queue.start()
 
-executor = ThreadPoolExecutor()
+@app.on_event("shutdown")
+async def stop_executors():
+    await job_queue.stop()
+    shutdown_executors()
+    await close_async_client()
 
 @app.get("/api/progress/{task_id}")
 async def progress(task_id: str):
     """Stream progress updates for a file processing task."""
     async def event_generator():
-        if task_id not in task_results:
+        # Length of the story text this client has already been sent
+        sent_story_length = 0
+        if task_id not in task_store:
             yield {
                 "data": json.dumps({
                     "status": "error",
@@ -69,111 +143,285 @@ async def progress(task_id: str):
             }
             return
 
-        while True:
-            result = task_results[task_id]
-            data = {
-                "status": result.get("status", "processing"),
-                "progress": result.get("progress", 0),
-                "message": result.get("message", "Processing..."),
-            }
+        # Woken by task_store writes; the subscription is removed when the client disconnects
+        with task_store.subscribe(task_id) as subscription:
+            while True:
+                result = task_store.get(task_id)
+                if result is None:
+                    # Expired or evicted while the client was listening
+                    yield {
+                        "data": json.dumps({
+                            "status": "error",
+                            "error": "Task expired"
+                        })
+                    }
+                    break
+                data = {
+                    "status": result.get("status", "processing"),
+                    "progress": result.get("progress", 0),
+                    "message": result.get("message", "Processing..."),
+                    "cache": result.get("cache", {}),
+                    "queue_position": result.get("queue_position", 0),
+                }
+                
+                # Send any story text generated since the last update, with where it starts in the story,
+                # so a client that reconnects (and is sent the story again from 0) replaces rather than appends
+                story_partial = result.get("story_partial")
+                if story_partial and len(story_partial) > sent_story_length:
+                    data["story_chunk"] = story_partial[sent_story_length:]
+                    data["story_offset"] = sent_story_length
+                    sent_story_length = len(story_partial)
+                
+                # Include the complete data when status is "completed"
+                if result.get("status") == "completed":
+                    data.update({
+                        "income_statement": result.get("income_statement"),
+                        "story": result.get("story"),
+                        "processing_time": result.get("processing_time"),
+                        "stages": result.get("stages"),
+                        "tokens": result.get("tokens")
+                    })
+                
+                yield {
+                    "data": json.dumps(data)
+                }
             
-            # Include the complete data when status is "completed"
-            if result.get("status") == "completed":
-                data.update({
-                    "income_statement": result.get("income_statement"),
-                    "story": result.get("story"),
-                    "processing_time": result.get("processing_time")
-                })
+                if result.get("status") in ["completed", "error"]:
+                    break
             
-            yield {
-                "data": json.dumps(data)
-            }
+                # Sleep until the task changes (or the fallback poll for shared stores)
+                await subscription.wait(task_store.poll_interval)
             
-            if result.get("status") in ["completed", "error"]:
-                break
-                
-            await asyncio.sleep(1)
+    return EventSourceResponse(event_generator(), ping=PROGRESS_HEARTBEAT)
 
-    return EventSourceResponse(event_generator())
-
-@app.post("/api/process")
-async def process_pdf(file_content: bytes = Depends(validate_file)):
-    """Process a PDF file to extract income statement and generate a story."""
+@app.post("/api/process", openapi_extra=PDF_UPLOAD_OPENAPI)
+async def process_pdf(request: Request, upload: StoredUpload = Depends(validate_file)):
+    """
+    Process a PDF file to extract income statement and generate a story.
+    The upload is queued for a job worker; 429 or 503 with Retry-After when the queue is full.
+    An upload of a document that is already being analysed follows that task instead of queueing.
+    """
     try:
         task_id = str(uuid.uuid4())
         # Initialize task in results
-        task_results[task_id] = {
+        task_store.set(task_id, {
             "status": "processing",
             "progress": 0,
-            "message": "Starting process..."
-        }
+            "message": "Waiting in queue"
+        })
+        
+        leader = inflight_documents.attach(upload.sha256, task_id)
+        if leader is not None:
+            # Same document already in progress: share its progress and result
+            upload.cleanup()
+            state = task_store.get(leader) or {}
+            task_store.set(task_id, state)
+            logger.info("Upload %s follows task %s for the same document", task_id, leader)
+            return {"task_id": task_id, "queue_position": state.get("queue_position", 0)}
         
-        # Start background task
-        asyncio.create_task(process_file_background(task_id, file_content))
+        # Queue the background task
+        try:
+            position = job_queue.submit(client_key(request), task_id,
+                                        lambda: process_file_background(task_id, upload), discard=upload.cleanup)
+        except QueueFull as e:
+            # Filled up while this upload was being read
+            inflight_documents.finish(upload.sha256, task_id)
+            task_store.pop(task_id)
+            upload.cleanup()
+            return queue_full_response(e)
         
-        return {"task_id": task_id}
+        return {"task_id": task_id, "queue_position": position}
         
     except Exception as e:
-        logger.error(f"Error processing PDF: {str(e)}")
+        upload.cleanup()
+        logger.error("Error processing PDF: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
-async def process_file_background(task_id: str, file_content: bytes):
+async def process_file_background(task_id: str, upload: StoredUpload):
     """Process file in background and update progress."""
+    with bind_task_id(task_id):
+        await _process_file(task_id, upload)
+
+async def _process_file(task_id: str, upload: StoredUpload):
     try:
-        start_time = time.time()
-        
-        # Update progress for text extraction
-        task_results[task_id].update({
-            "progress": 30,
-            "message": "Extracting text from PDF"
-        })
-        # Extract structured data
-        json_data = await asyncio.get_event_loop().run_in_executor(
-            executor, extract_income_statement, file_content
+        result = await analyze_document(
+            upload.path, upload.sha256,
+            report=lambda fields: update_task(task_id, fields)
         )
         
-        # Update progress for story generation
-        task_results[task_id].update({
-            "progress": 70,
-            "message": "Generating financial story"
-        })
-        # Generate story
-        story = await asyncio.get_event_loop().run_in_executor(
-            executor, generate_story_from_json, json_data
-        )
-        
-        processing_time = f"{time.time() - start_time:.2f} seconds"
-        
         # Store final results
-        task_results[task_id] = {
+        set_task(task_id, {
             "status": "completed",
-            "income_statement": json_data,
-            "story": story,
-            "processing_time": processing_time,
+            **result,
             "progress": 100,
             "message": "Analysis complete"
-        }
+        })
         
     except Exception as e:
-        logger.error(f"Background task error: {str(e)}")
-        task_results[task_id] = {
+        logger.exception("Background task error: %s", e)
+        set_task(task_id, {
             "status": "error",
             "error": str(e),
             "progress": 0,
             "message": f"Error: {str(e)}"
-        }
+        })
+    finally:
+        finish_batch_files(task_id)
+        inflight_documents.finish(upload.sha256, task_id)
+        upload.cleanup()
+
+def finish_batch_files(task_id: str) -> None:
+    """Count the task, and every upload following it, as finished on the batch jobs they belong to."""
+    for tid in inflight_documents.tasks(task_id):
+        job_id = batch_file_jobs.pop(tid, None)
+        job = task_store.get(job_id) if job_id is not None else None
+        if job is not None:
+            finished = job.get("finished", 0) + 1
+            task_store.update(job_id, {
+                "finished": finished,
+                "status": "completed" if finished >= job.get("queued", 0) else "processing"
+            })
+
+async def store_batch_uploads(files: List[UploadFile]):
+    """Spool every uploaded PDF, and every PDF inside uploaded ZIP archives, to disk."""
+    entries = []
+    try:
+        for file in files:
+            remaining = MAX_BATCH_FILES - len(entries)
+            if remaining <= 0:
+                raise HTTPException(status_code=413, detail=f"Too many files in batch (max {MAX_BATCH_FILES})")
+            if not is_zip_upload(file):
+                try:
+                    entries.append((file.filename, await store_pdf_upload(file)))
+                except HTTPException as e:
+                    entries.append((file.filename, e.detail))
+                continue
+            archive = await store_zip_upload(file)
+            try:
+                members = await asyncio.get_event_loop().run_in_executor(
+                    get_llm_executor(), extract_pdfs_from_zip, archive.path, MAX_UPLOAD_BYTES, remaining
+                )
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{file.filename} is not a valid ZIP archive")
+            finally:
+                archive.cleanup()
+            entries.extend((f"{file.filename}/{name}", stored) for name, stored in members)
+    except BaseException:
+        for _, stored in entries:
+            if isinstance(stored, StoredUpload):
+                stored.cleanup()
+        raise
+    return entries
+
+@app.post("/api/batch")
+async def process_batch(request: Request, files: List[UploadFile] = File(...)):
+    """
+    Process many PDFs, or ZIP archives of PDFs, as one job.
+    Every PDF becomes its own task; files that fail validation are reported in the job instead of failing it.
+    The files share the job queue with single uploads and are admitted as a whole (503 when they don't fit).
+    Copies of a document already in the batch or in progress follow that task instead of being analysed again.
+    """
+    entries = await store_batch_uploads(files)
+    if not entries:
+        raise HTTPException(status_code=400, detail="No PDF files found in the upload")
+    
+    try:
+        job_queue.check_batch(sum(1 for _, stored in entries if isinstance(stored, StoredUpload)))
+    except QueueFull as e:
+        for _, stored in entries:
+            if isinstance(stored, StoredUpload):
+                stored.cleanup()
+        return queue_full_response(e)
+    
+    job_id = str(uuid.uuid4())
+    job_files = []
+    jobs = []
+    for file_name, stored in entries:
+        if not isinstance(stored, StoredUpload):
+            job_files.append({"file_name": file_name, "task_id": None, "error": stored})
+            continue
+        task_id = str(uuid.uuid4())
+        task_store.set(task_id, {
+            "status": "processing",
+            "progress": 0,
+            "message": "Waiting in batch queue",
+            "job_id": job_id
+        })
+        job_files.append({"file_name": file_name, "task_id": task_id})
+        batch_file_jobs[task_id] = job_id
+        
+        leader = inflight_documents.attach(stored.sha256, task_id)
+        if leader is not None:
+            # Same document earlier in this batch or already in progress: share its progress and result
+            stored.cleanup()
+            task_store.set(task_id, {**(task_store.get(leader) or {}), "job_id": job_id})
+            continue
+        jobs.append((task_id, lambda task_id=task_id, upload=stored: process_file_background(task_id, upload),
+                     stored.cleanup))
+    
+    queued = sum(1 for entry in job_files if entry["task_id"] is not None)
+    # Set before the files are queued, so a file finishing right away is counted on the job
+    task_store.set(job_id, {
+        "status": "processing" if queued else "completed",
+        "type": "batch",
+        "files": job_files,
+        "queued": queued,
+        "finished": 0,
+        "created_at": time.time()
+    })
+    job_queue.submit_batch(client_key(request), jobs)
+    
+    return {"job_id": job_id, "files": job_files}
+
+@app.get("/api/batch/{job_id}")
+async def get_batch(job_id: str):
+    """Progress of every file in a batch job. Results are collected per file from /api/result/{task_id}."""
+    job = task_store.get(job_id)
+    if job is None or job.get("type") != "batch":
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    
+    files = []
+    for entry in job["files"]:
+        if entry["task_id"] is None:
+            files.append({**entry, "status": "error", "progress": 0, "message": entry["error"]})
+            continue
+        task = task_store.get(entry["task_id"])
+        if task is None and entry["task_id"] in batch_file_jobs:
+            # Waited in the queue for longer than TASK_TTL
+            task = {"status": "processing", "progress": 0, "message": "Waiting in batch queue"}
+        if task is None:
+            # Already collected through /api/result, or expired
+            files.append({**entry, "status": "unavailable", "progress": 100, "message": "Result no longer stored"})
+            continue
+        files.append({
+            **entry,
+            "status": task.get("status", "processing"),
+            "progress": task.get("progress", 0),
+            "message": task.get("message", "Processing..."),
+        })
+    
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "total": len(files),
+        "finished": job["finished"] + sum(1 for entry in job["files"] if entry["task_id"] is None),
+        "files": files
+    }
 
 @app.get("/api/result/{task_id}")
 async def get_result(task_id: str):
     """Get the results for a specific task ID."""
-    if task_id not in task_results:
+    # Remove the result from storage after retrieving
+    result = task_store.pop(task_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    
-    result = task_results[task_id]
-    # Optionally remove the result from storage after retrieving
-    del task_results[task_id]
     return result
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage timings, queue depth, executor load, cache hit rates and Ollama tokens."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
@@ -201,7 +449,9 @@ async def health_check():
                 "timestamp": time.time(),
                 "models_available": True,
                 "granite_models_available": False,
-                "message": f"Ollama is running but some Granite models are not installed. Run 'ollama pull {' and '.join(missing_models)}'"
+                "message": f"Ollama is running but some Granite models are not installed. Run 'ollama pull {' and '.join(missing_models)}'",
+                "task_store": task_store.stats(),
+                "job_queue": job_queue.stats()
             }
         
         return {
@@ -210,7 +460,9 @@ async def health_check():
             "models_available": response.status_code == 200,
             "granite_vision_available": granite_vision_available,
             "granite_8b_available": granite_8b_available,
-            "available_models": available_models
+            "available_models": available_models,
+            "task_store": task_store.stats(),
+            "job_queue": job_queue.stats()
         }
     except Exception as e:
         return {
@@ -233,5 +485,5 @@ async def root():
     
 if __name__ == "__main__":
     import uvicorn
-    logger.info(f"Starting server on port {PORT}")
+    logger.info("Starting server on port %d", PORT)
     uvicorn.run(app, host="0.0.0.0", port=PORT)
\ No newline at end of file
@@ -2,6 +2,7 @@
 from fastapi import APIRouter, UploadFile, File
 from services.parse_pdf import extract_income_statement
 from services.generate_story import generate_story_from_json
+from services.uploads import store_pdf_upload
 
 
 router = APIRouter()
@@ -9,9 +10,12 @@ router = APIRouter()
 
 @router.post("/process")
 async def process_file(file: UploadFile = File(...)):
-    text = await file.read()
-    # Extract structured data
-    json_data = extract_income_statement(text)
+    upload = await store_pdf_upload(file)
+    try:
+        # Extract structured data
+        json_data = extract_income_statement(upload.path)
+    finally:
+        upload.cleanup()
     # Generate story
     story = generate_story_from_json(json_data)
     return {"income_statement": json_data, "story": story}
\ No newline at end of file
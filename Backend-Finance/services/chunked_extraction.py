@@ -0,0 +1,149 @@
+import logging
+import math
+import os
+import re
+from collections import defaultdict
+
+from services.page_locator import STATEMENT_HEADING, LINE_ITEM_KEYWORDS, NUMBER_TOKEN, SCALE_NOTE
+
+logger = logging.getLogger(__name__)
+
+# Configuration with fallbacks
+# "chunked" splits long text into windows that are extracted concurrently; "single" sends only the first window
+LLM_EXTRACTION_MODE = os.environ.get("LLM_EXTRACTION_MODE", "chunked").lower()
+LLM_CHUNK_TOKENS = int(os.environ.get("LLM_CHUNK_TOKENS", 3000))
+LLM_CHUNK_OVERLAP_TOKENS = int(os.environ.get("LLM_CHUNK_OVERLAP_TOKENS", 200))
+# Windows sent at once; the per-model limit in model_runner still applies on top of this
+LLM_CHUNK_PARALLELISM = int(os.environ.get("LLM_CHUNK_PARALLELISM", 4))
+# Upper bound on model calls per document; the most statement-like windows are kept
+LLM_MAX_CHUNKS = int(os.environ.get("LLM_MAX_CHUNKS", 8))
+
+# Rough size of a token for English financial text
+CHARS_PER_TOKEN = 4
+WINDOW_CHARS = LLM_CHUNK_TOKENS * CHARS_PER_TOKEN
+
+# Relative difference under which two reported values count as the same value
+VALUE_TOLERANCE = 0.005
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def split_into_windows(text: str, window_tokens: int = LLM_CHUNK_TOKENS,
+                       overlap_tokens: int = LLM_CHUNK_OVERLAP_TOKENS):
+    """
+    Split text into windows of about `window_tokens` tokens, each overlapping the previous
+    one by `overlap_tokens` so a line item cut at a boundary is whole in one of them.
+    Windows end on whitespace so numbers are never split.
+    """
+    size = window_tokens * CHARS_PER_TOKEN
+    overlap = min(overlap_tokens * CHARS_PER_TOKEN, size // 2)
+    if len(text) <= size:
+        return [text]
+
+    windows = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # Back up to the last space in the final tenth of the window
+            cut = text.rfind(" ", end - size // 10, end)
+            if cut > start:
+                end = cut
+        windows.append(text[start:end])
+        if end >= len(text):
+            break
+        next_start = end - overlap
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return windows
+
+def score_window(text: str) -> float:
+    """How much a window looks like income statement content: headings, line items and numeric cells."""
+    score = 5.0 * len(STATEMENT_HEADING.findall(text))
+    score += 2.0 * len(SCALE_NOTE.findall(text))
+    score += len(LINE_ITEM_KEYWORDS.findall(text))
+    score += 0.25 * len(NUMBER_TOKEN.findall(text))
+    return score
+
+def plan_windows(text: str, mode: str = LLM_EXTRACTION_MODE, max_chunks: int = LLM_MAX_CHUNKS):
+    """
+    Return the windows to send to the model, in document order.
+    In "single" mode this is just the start of the text, as a single prompt has always seen it.
+    """
+    if mode != "chunked":
+        return [text[:WINDOW_CHARS]]
+    windows = split_into_windows(text)
+    if len(windows) > max_chunks:
+        scores = [score_window(window) for window in windows]
+        keep = sorted(sorted(range(len(windows)), key=lambda i: scores[i], reverse=True)[:max_chunks])
+        logger.info("Text split into %d windows, extracting the %d most statement-like", len(windows), len(keep))
+        windows = [windows[i] for i in keep]
+    elif len(windows) > 1:
+        logger.info("Text split into %d windows of about %d tokens", len(windows), LLM_CHUNK_TOKENS)
+    return windows
+
+def _to_number(value):
+    """Coerce a model-reported value to a float, or None for "Unknown" and anything unreadable."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        cleaned = value.strip().replace(",", "").replace("$", "")
+        negative = cleaned.startswith("(") and cleaned.endswith(")")
+        try:
+            number = float(cleaned.strip("()"))
+        except ValueError:
+            return None
+        return -number if negative else number
+    return None
+
+def _appears_in(value: float, text: str) -> bool:
+    """True when the number is printed in the window, i.e. the model didn't make it up."""
+    magnitude = abs(value)
+    forms = {f"{magnitude:,.0f}", f"{magnitude:.0f}"} if magnitude.is_integer() else {f"{magnitude:,}", f"{magnitude}"}
+    return any(re.search(r'(?<![\d.,])' + re.escape(form) + r'(?![\d]|[.,]\d)', text) for form in forms)
+
+def _canonical_field(key: str, known_fields) -> str:
+    lookup = {field.lower().replace("_", ""): field for field in known_fields}
+    return lookup.get(key.lower().replace("_", "").replace(" ", ""), key)
+
+def merge_fragments(windows, fragments, known_fields=()):
+    """
+    Merge the JSON objects extracted from each window into one.
+
+    Every reported value is a vote weighted by its confidence: one point for the vote,
+    one more if the number is actually printed in the window it came from, and up to
+    one more for how statement-like that window is. Votes for the same value (within
+    VALUE_TOLERANCE) add up, and the value with the highest total wins. Fields only
+    ever reported as "Unknown" stay "Unknown".
+    """
+    scores = [score_window(window) for window in windows]
+    best_score = max(scores) if scores and max(scores) > 0 else 1.0
+
+    votes = defaultdict(list)  # field -> [[value, confidence], ...]
+    unknown = set()
+    for window, score, fragment in zip(windows, scores, fragments):
+        for key, raw_value in fragment.items():
+            field = _canonical_field(key, known_fields)
+            value = _to_number(raw_value)
+            if value is None:
+                unknown.add(field)
+                continue
+            confidence = 1.0 + (1.0 if _appears_in(value, window) else 0.0) + score / best_score
+            for candidate in votes[field]:
+                if abs(candidate[0] - value) <= VALUE_TOLERANCE * max(abs(candidate[0]), abs(value), 1.0):
+                    candidate[1] += confidence
+                    break
+            else:
+                votes[field].append([value, confidence])
+
+    merged = {}
+    for field, candidates in votes.items():
+        value, confidence = max(candidates, key=lambda candidate: candidate[1])
+        if len(candidates) > 1:
+            logger.debug("Conflicting values for %s: %s, chose %s", field, candidates, value)
+        merged[field] = value
+    for field in unknown:
+        merged.setdefault(field, "Unknown")
+    return merged
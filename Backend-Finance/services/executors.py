@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from services.metrics import REGISTRY
+
+# Configuration with fallbacks
+# PARSE_POOL is "process" (default) to spread PDF parsing over all cores, or "thread" to keep it in-process
+PARSE_POOL = os.environ.get("PARSE_POOL", "process").lower()
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", os.cpu_count() or 1))
+# LLM calls spend their time waiting on Ollama, so this pool can be much larger than the core count
+LLM_WORKERS = int(os.environ.get("LLM_WORKERS", 16))
+
+_parse_executor = None
+_llm_executor = None
+
+class _LoadTracking:
+    """Counts work submitted but not yet finished, so pool utilisation and queue depth can be reported."""
+
+    def _init_tracking(self, max_workers: int) -> None:
+        self._tracked_workers = max_workers
+        self._outstanding = 0
+        self._tracking_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._tracking_lock:
+            self._outstanding += 1
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._task_done(None)
+            raise
+        future.add_done_callback(self._task_done)
+        return future
+
+    def _task_done(self, future) -> None:
+        with self._tracking_lock:
+            self._outstanding -= 1
+
+    def load(self) -> dict:
+        """Workers, busy workers, queued tasks and the busy fraction of the pool."""
+        with self._tracking_lock:
+            outstanding = self._outstanding
+        busy = min(outstanding, self._tracked_workers)
+        return {
+            "workers": self._tracked_workers,
+            "busy": busy,
+            "queued": outstanding - busy,
+            "utilisation": busy / self._tracked_workers,
+        }
+
+class TrackedProcessPoolExecutor(_LoadTracking, ProcessPoolExecutor):
+    def __init__(self, max_workers: int, **kwargs):
+        super().__init__(max_workers=max_workers, **kwargs)
+        self._init_tracking(max_workers)
+
+class TrackedThreadPoolExecutor(_LoadTracking, ThreadPoolExecutor):
+    def __init__(self, max_workers: int, **kwargs):
+        super().__init__(max_workers=max_workers, **kwargs)
+        self._init_tracking(max_workers)
+
+def _warm_up_worker():
+    """Set up logging, import PyMuPDF and compile the extraction patterns once per worker process."""
+    from services.logging_config import configure_logging
+    configure_logging()
+    import fitz  # noqa: F401
+    import services.parse_pdf  # noqa: F401
+
+def _noop():
+    return os.getpid()
+
+def get_parse_executor():
+    """Return the shared executor for CPU-bound parsing (PyMuPDF and regex extraction)."""
+    global _parse_executor
+    if _parse_executor is None:
+        if PARSE_POOL == "process":
+            # "spawn" avoids forking a process that already runs an event loop and threads
+            _parse_executor = TrackedProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up_worker,
+            )
+        else:
+            _parse_executor = TrackedThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+    return _parse_executor
+
+def get_llm_executor():
+    """Return the shared thread pool for network-bound work (Ollama calls, cache I/O)."""
+    global _llm_executor
+    if _llm_executor is None:
+        _llm_executor = TrackedThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+    return _llm_executor
+
+def warm_up_executors():
+    """Start every parse worker up front so the first uploads don't pay the spawn and import cost."""
+    executor = get_parse_executor()
+    get_llm_executor()
+    futures = [executor.submit(_noop) for _ in range(PARSE_WORKERS)]
+    for future in futures:
+        future.result()
+
+def shutdown_executors():
+    """Shut down both pools, cancelling anything still queued."""
+    global _parse_executor, _llm_executor
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=False, cancel_futures=True)
+        _parse_executor = None
+    if _llm_executor is not None:
+        _llm_executor.shutdown(wait=False, cancel_futures=True)
+        _llm_executor = None
+
+def executor_stats() -> dict:
+    """Load of each pool that has been started, keyed by pool name."""
+    pools = {"parse": _parse_executor, "llm": _llm_executor}
+    return {name: pool.load() for name, pool in pools.items() if pool is not None}
+
+def _collect(field: str):
+    return lambda: {(name,): load[field] for name, load in executor_stats().items()}
+
+REGISTRY.gauge("executor_workers", "Worker count of each executor pool.", ["pool"], collect=_collect("workers"))
+REGISTRY.gauge("executor_busy_workers", "Workers currently running a task.", ["pool"], collect=_collect("busy"))
+REGISTRY.gauge("executor_queued_tasks", "Tasks waiting for a free worker.", ["pool"], collect=_collect("queued"))
+REGISTRY.gauge("executor_utilisation", "Fraction of the pool's workers that are busy.", ["pool"],
+               collect=_collect("utilisation"))
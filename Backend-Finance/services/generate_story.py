@@ -1,16 +1,34 @@
-from services.model_runner import query_model
+import os
 
-def generate_story_from_json(data):
+from services.model_runner import query_model, async_query_model, async_stream_model, PRIORITY_STORY
+
+# Model and prompt version used for narrative generation.
+# Bump STORY_PROMPT_VERSION whenever the story prompts change so cached stories are regenerated.
+STORY_MODEL = "granite3.3:8B"
+STORY_PROMPT_VERSION = "3"
+
+# Configuration with fallbacks
+# Completion tokens allowed for a story; the prompt asks for a length that fits in them
+STORY_MAX_TOKENS = int(os.environ.get("STORY_MAX_TOKENS", 2048))
+# Words asked for: about 0.75 words per token, with a margin so the story isn't cut off mid-sentence
+STORY_TARGET_WORDS = int(STORY_MAX_TOKENS * 0.75 * 0.8) // 50 * 50
+
+LIMITED_DATA_NOTE = "\n\n*Note: This analysis is based on limited financial data extracted from the document. For a more comprehensive analysis, please ensure the document contains detailed income statement information.*"
+
+def build_story_prompt(data):
     """
-    Generate a financial narrative based on income statement data.
-    The story aims to be more insightful and contextual. 
-    Write enough to cover the key points and around ten pages of text. 
-    Please format it so it's easy to read and understand.
+    Build the story prompt for the given income statement data.
+    Returns (prompt, model, limited_data) where limited_data is True when fewer than
+    three metrics were available.
     """
     # Create a more tailored prompt based on available data
     financial_metrics = []
     unknown_metrics = []
     
+    # Nested values such as visualization_data are for the charts and stay out of the prompt
+    data = {key: value for key, value in data.items()
+            if value is not None and not isinstance(value, (dict, list, tuple))}
+    
     # Categorize which metrics are available vs unknown
     for key, value in data.items():
         if value != "Unknown" and not isinstance(value, str):
@@ -40,7 +58,7 @@ def generate_story_from_json(data):
         Write in a way that is interesting to both financial professionals and laypersons. Captivating with a story-like approach.
         Without losing the essence of financial analysis, ensure that the content is structured and easy to follow.
         Use bullet points or sections where appropriate to enhance readability.
-        I would prefer you write up to ten pages of text, but please ensure the content is concise and relevant.
+        Write no more than about {STORY_TARGET_WORDS} words, and keep the content concise and relevant.
         Avoid unnecessary jargon and keep the language accessible.
 
         The story should have these elements:
@@ -50,7 +68,7 @@ def generate_story_from_json(data):
         4. Information should be memorable and easy to digest, even for those not familiar with finance.
         """
         
-        model = "granite3.3:8B"  # Use Granite 3.3:8B model for narrative generation
+        model = STORY_MODEL  # Use Granite 3.3:8B model for narrative generation
     else:
         # Limited data scenario - focus on general financial principles
         available = ", ".join(key.replace('_', ' ') for key, value in data.items() if value != "Unknown")
@@ -66,16 +84,49 @@ def generate_story_from_json(data):
         Write approximately 200-250 words in a professional but accessible style.
         """
         
-        model = "granite3.3:8B" 
+        model = STORY_MODEL
     
-    # Get the narrative from the AI model
-    story = query_model(prompt, model=model)
+    return prompt, model, len(financial_metrics) < 3
     
+def finalize_story(story, limited_data):
+    """Clean up the model output and add the limited-data disclaimer when needed."""
     # Clean up the response
     story = story.strip()
     
     # Add a disclaimer if we had limited data
-    if len(financial_metrics) < 3:
-        story += "\n\n*Note: This analysis is based on limited financial data extracted from the document. For a more comprehensive analysis, please ensure the document contains detailed income statement information.*"
+    if limited_data:
+        story += LIMITED_DATA_NOTE
+    
+    return story
+
+def generate_story_from_json(data):
+    """
+    Generate a financial narrative based on income statement data.
+    The story aims to be more insightful and contextual. 
+    Write enough to cover the key points, in about STORY_TARGET_WORDS words. 
+    Please format it so it's easy to read and understand.
+    """
+    prompt, model, limited_data = build_story_prompt(data)
     
-    return story
\ No newline at end of file
+    # Get the narrative from the AI model
+    story = query_model(prompt, model=model, max_tokens=STORY_MAX_TOKENS)
+    
+    return finalize_story(story, limited_data)
+
+async def async_generate_story_from_json(data):
+    """Async version of generate_story_from_json that awaits the model call directly."""
+    prompt, model, limited_data = build_story_prompt(data)
+    story = await async_query_model(prompt, model=model, max_tokens=STORY_MAX_TOKENS, priority=PRIORITY_STORY)
+    return finalize_story(story, limited_data)
+
+async def async_stream_story_from_json(data):
+    """
+    Stream the story as the model writes it, yielding text chunks.
+    Joining the chunks and stripping the result gives the finished story;
+    the limited-data note, when needed, is yielded as the last chunk.
+    """
+    prompt, model, limited_data = build_story_prompt(data)
+    async for chunk in async_stream_model(prompt, model=model, max_tokens=STORY_MAX_TOKENS, priority=PRIORITY_STORY):
+        yield chunk
+    if limited_data:
+        yield LIMITED_DATA_NOTE
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Configuration with fallbacks
+# Documents analysed at once; further uploads wait in the queue
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+# Jobs allowed to wait for a worker; uploads beyond this are turned away with 503
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 32))
+# Jobs one client may have waiting; its uploads beyond this are turned away with 429
+JOB_QUEUE_PER_CLIENT = int(os.environ.get("JOB_QUEUE_PER_CLIENT", 8))
+# Batch files allowed to wait for a worker, over all batch jobs; a batch that doesn't fit is turned away with 503
+JOB_QUEUE_BATCH_SIZE = int(os.environ.get("JOB_QUEUE_BATCH_SIZE", 1000))
+# Request header naming the client (e.g. set by a gateway); the peer address is used when unset
+JOB_CLIENT_HEADER = os.environ.get("JOB_CLIENT_HEADER", "")
+# Assumed seconds per job until real ones have been measured, for Retry-After
+JOB_INITIAL_SECONDS = float(os.environ.get("JOB_INITIAL_SECONDS", 30))
+
+# Weight of the latest job in the moving average of job durations
+DURATION_SMOOTHING = 0.2
+
+JOBS_REJECTED = REGISTRY.counter("job_queue_rejected_total", "Uploads turned away because the queue was full.",
+                                 ["reason"])
+JOB_WAIT_SECONDS = REGISTRY.histogram("job_queue_wait_seconds", "Time jobs spent queued before a worker took them.")
+
+class QueueFull(Exception):
+    """Raised when a job can't be admitted; carries the HTTP status and a Retry-After estimate."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+class JobQueue:
+    """
+    Bounded queue of analysis jobs run by a fixed number of workers.
+
+    Jobs are kept per client and taken round-robin, one from each client in turn, so a
+    client uploading many documents can't starve the others. A client's batch files are
+    queued apart from its single uploads and take their own turn, and are admitted as a
+    whole against `max_batch_queued`. `on_position` is called with (task_id, position)
+    whenever a waiting single upload moves up, and with position 0 when a worker takes
+    any job.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_SIZE,
+                 max_per_client: int = JOB_QUEUE_PER_CLIENT, max_batch_queued: int = JOB_QUEUE_BATCH_SIZE,
+                 on_position=None):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_per_client = max_per_client
+        self.max_batch_queued = max_batch_queued
+        self.on_position = on_position
+        # client -> deque of (task_id, job, queued_at, discard); the dict order is the round-robin order
+        self._clients = OrderedDict()
+        self._queued = 0
+        self._batch_tasks = set()  # task IDs of the queued batch files
+        self._running = 0
+        self._average_seconds = JOB_INITIAL_SECONDS
+        self._ready = asyncio.Event()
+        self._tasks = []
+
+    def start(self) -> None:
+        """Start the workers; must be called from the event loop."""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Cancel the workers, then drop the jobs still queued, calling their `discard` callbacks."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        dropped = 0
+        for jobs in self._clients.values():
+            for task_id, _, _, discard in jobs:
+                dropped += 1
+                if discard is None:
+                    continue
+                try:
+                    discard()
+                except Exception:
+                    logger.exception("Discarding job %s failed", task_id)
+        self._clients.clear()
+        self._queued = 0
+        self._batch_tasks.clear()
+        if dropped:
+            logger.info("Dropped %d queued jobs", dropped)
+
+    def retry_after(self) -> int:
+        """Seconds until a worker is likely to be free for one more job."""
+        waiting = self._queued + max(0, self._running - self.workers + 1)
+        return max(1, math.ceil(self._average_seconds * waiting / self.workers))
+
+    def check(self, client: str) -> None:
+        """Raise QueueFull if a job from `client` would not be admitted right now."""
+        if self._queued - len(self._batch_tasks) >= self.max_queued:
+            JOBS_REJECTED.inc(reason="queue_full")
+            raise QueueFull(503, "Server is busy, try again later", self.retry_after())
+        if len(self._clients.get(client, ())) >= self.max_per_client:
+            JOBS_REJECTED.inc(reason="client_limit")
+            raise QueueFull(429, f"Too many documents queued (max {self.max_per_client} per client)",
+                            self.retry_after())
+
+    def submit(self, client: str, task_id: str, job, discard=None) -> int:
+        """
+        Queue `job`, a coroutine function taking no arguments, and return its queue position.
+        `discard` is called instead if the queue is stopped before the job runs, to free what it holds.
+        Raises QueueFull when the queue or the client's share of it is full.
+        """
+        self.check(client)
+        self._clients.setdefault(client, deque()).append((task_id, job, time.monotonic(), discard))
+        self._queued += 1
+        self._ready.set()
+        positions = self.positions()
+        self._report(positions)
+        return positions[task_id]
+
+    def check_batch(self, files: int) -> None:
+        """Raise QueueFull if a batch of `files` files would not be admitted right now."""
+        if len(self._batch_tasks) + files > self.max_batch_queued:
+            JOBS_REJECTED.inc(reason="batch_full")
+            raise QueueFull(503, f"Server is busy with other batches, try again later "
+                                 f"(room for {max(0, self.max_batch_queued - len(self._batch_tasks))} files)",
+                            self.retry_after())
+
+    def submit_batch(self, client: str, jobs) -> None:
+        """
+        Queue the files of a batch, given as (task_id, job, discard) like `submit`, behind the client's
+        earlier batch files. Raises QueueFull when they don't all fit.
+        """
+        self.check_batch(len(jobs))
+        queue = self._clients.setdefault(f"{client} (batch)", deque())
+        now = time.monotonic()
+        for task_id, job, discard in jobs:
+            queue.append((task_id, job, now, discard))
+            self._batch_tasks.add(task_id)
+        if not queue:
+            del self._clients[f"{client} (batch)"]
+        self._queued += len(jobs)
+        self._ready.set()
+        self._report(self.positions())
+
+    def positions(self) -> dict:
+        """{task_id: position} of every waiting job, 1 being the next one a worker takes."""
+        positions = {}
+        queues = list(self._clients.values())
+        depth = 0
+        while len(positions) < self._queued:
+            for jobs in queues:
+                if depth < len(jobs):
+                    positions[jobs[depth][0]] = len(positions) + 1
+            depth += 1
+        return positions
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "queued": self._queued,
+            "batch_queued": len(self._batch_tasks),
+            "clients": len(self._clients),
+            "average_seconds": round(self._average_seconds, 2),
+        }
+
+    def _report(self, positions: dict) -> None:
+        if self.on_position is None:
+            return
+        for task_id, position in positions.items():
+            # Batch files are followed through their job, not one by one
+            if task_id not in self._batch_tasks:
+                self.on_position(task_id, position)
+
+    def _take(self):
+        # The client at the front gets one job run, then moves to the back of the rotation
+        client, jobs = self._clients.popitem(last=False)
+        entry = jobs.popleft()
+        if jobs:
+            self._clients[client] = jobs
+        self._queued -= 1
+        self._batch_tasks.discard(entry[0])
+        return entry
+
+    async def _work(self) -> None:
+        while True:
+            while not self._queued:
+                self._ready.clear()
+                await self._ready.wait()
+            task_id, job, queued_at, _ = self._take()
+            JOB_WAIT_SECONDS.observe(time.monotonic() - queued_at)
+            if self.on_position is not None:
+                self.on_position(task_id, 0)
+            self._report(self.positions())
+
+            self._running += 1
+            started = time.monotonic()
+            try:
+                await job()
+            except Exception:
+                logger.exception("Job %s failed", task_id)
+            finally:
+                self._running -= 1
+                elapsed = time.monotonic() - started
+                self._average_seconds += DURATION_SMOOTHING * (elapsed - self._average_seconds)
+
+class InflightDocuments:
+    """
+    Single-flight table of documents being analysed, keyed by content hash.
+    The first upload of a document runs; uploads of the same document while it runs
+    follow its task and are sent the same progress and result under their own task IDs.
+    """
+
+    def __init__(self):
+        self._leaders = {}  # doc_hash -> task_id of the upload doing the work
+        self._followers = {}  # leader task_id -> [follower task_ids]
+
+    def attach(self, doc_hash: str, task_id: str):
+        """Register an upload. Returns the task it should follow, or None if it has to do the work itself."""
+        leader = self._leaders.get(doc_hash)
+        if leader is None:
+            self._leaders[doc_hash] = task_id
+            self._followers[task_id] = []
+            return None
+        self._followers[leader].append(task_id)
+        return leader
+
+    def tasks(self, task_id: str):
+        """The task and every task following it."""
+        return [task_id] + self._followers.get(task_id, [])
+
+    def finish(self, doc_hash: str, task_id: str) -> None:
+        """Forget the document; the next upload of it starts fresh (and will usually hit the result cache)."""
+        if self._leaders.get(doc_hash) == task_id:
+            del self._leaders[doc_hash]
+            self._followers.pop(task_id, None)
+
+    def __len__(self) -> int:
+        return len(self._leaders)
+
+def client_key(request) -> str:
+    """Identify the client of a request for fair scheduling."""
+    if JOB_CLIENT_HEADER and request.headers.get(JOB_CLIENT_HEADER):
+        return request.headers[JOB_CLIENT_HEADER]
+    return request.client.host if request.client else "unknown"
@@ -0,0 +1,68 @@
+import json
+
+class JSONObjectStream:
+    """
+    Incremental parser for a JSON object arriving in pieces, such as a streamed model answer.
+
+    Each top-level member is decoded as soon as the comma or closing brace after it
+    arrives, so a caller can act on complete fields before the object is finished.
+    Text before the opening brace (a code fence, a preamble) is skipped, and a member
+    that isn't valid JSON is dropped without affecting the others.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.complete = False
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return self._text
+
+    def feed(self, chunk: str) -> None:
+        self._text += chunk
+        text = self._text
+        while self._pos < len(text) and not self.complete:
+            char = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._member_start = self._pos + 1
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._take_member(text[self._member_start:self._pos])
+                    self.complete = True
+            elif char == "," and self._depth == 1:
+                self._take_member(text[self._member_start:self._pos])
+                self._member_start = self._pos + 1
+            self._pos += 1
+
+    def has(self, keys) -> bool:
+        """True when every one of `keys` has been decoded."""
+        return all(key in self.fields for key in keys)
+
+    def _take_member(self, member: str) -> None:
+        if not member.strip():
+            return
+        try:
+            self.fields.update(json.loads("{" + member + "}"))
+        except ValueError:
+            pass
@@ -0,0 +1,106 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from contextlib import contextmanager
+
+# Configuration with fallbacks
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Per-module overrides, e.g. "services.parse_pdf=DEBUG,services.model_runner=WARNING"
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "httpx=WARNING")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()  # "text" or "json"
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(task_id)s] %(message)s"
+
+# Task being processed by the current coroutine or thread; "-" outside of any task
+task_id_var = contextvars.ContextVar("task_id", default="-")
+
+_listener = None
+
+class TaskIdFilter(logging.Filter):
+    """Stamp every record with the current task ID. Runs on the logging thread, before the record is queued."""
+
+    def filter(self, record):
+        if not hasattr(record, "task_id"):
+            record.task_id = task_id_var.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "task_id": getattr(record, "task_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def parse_log_levels(spec: str) -> dict:
+    """Parse "logger=LEVEL,logger=LEVEL" into a dict of logger name to level name."""
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.rsplit("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def configure_logging(level: str = LOG_LEVEL, levels: str = LOG_LEVELS, fmt: str = LOG_FORMAT) -> None:
+    """
+    Send all log records through an in-memory queue to a background thread that
+    formats and writes them, so processing threads never block on stderr.
+    Safe to call more than once; only the first call has an effect.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(TaskIdFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+    for name, module_level in parse_log_levels(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging() -> None:
+    """Flush the queued records and stop the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+@contextmanager
+def bind_task_id(task_id: str):
+    """Tag every record logged inside the block (and in tasks started from it) with `task_id`."""
+    token = task_id_var.set(task_id)
+    try:
+        yield
+    finally:
+        task_id_var.reset(token)
+
+def run_with_task_id(task_id: str, func, *args):
+    """
+    Call func(*args) with the task ID bound. Executors don't carry context variables over,
+    so work submitted to a thread or process pool is wrapped in this.
+    """
+    with bind_task_id(task_id):
+        return func(*args)
@@ -0,0 +1,210 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from a fast regex pass up to a long story generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type_name}"
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield from self._render_sample(key, value)
+
+    def _render_sample(self, key, value):
+        yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Counter(_Metric):
+    """Monotonically increasing value, e.g. requests served."""
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        if not self.labelnames:
+            # Unlabelled series are exported from the start, not only after the first increment
+            self._values[()] = 0
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(_Metric):
+    """Value that goes up and down. `collect` can supply the values lazily at scrape time."""
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), collect=None):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+        if not self.labelnames and collect is None:
+            self._values[()] = 0
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.collect is not None:
+            # collect() returns {label values tuple: value}
+            for key, value in self.collect().items():
+                self.set(value, **dict(zip(self.labelnames, key)))
+        yield from super().render()
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, plus their sum and count."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def _render_sample(self, key, series):
+        cumulative = 0
+        for bound, count in zip(self.buckets, series["buckets"]):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        labels = _format_labels(self.labelnames, key)
+        yield f"{self.name}_sum{labels} {_format_value(series['sum'])}"
+        yield f"{self.name}_count{labels} {series['count']}"
+
+class MetricsRegistry:
+    """The process-wide set of metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames=(), collect=None) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames, collect))
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "pipeline_stage_seconds", "Time spent in each processing stage of a document.", ["stage"])
+DOCUMENTS_TOTAL = REGISTRY.counter(
+    "pipeline_documents_total", "Documents processed, by outcome.", ["status"])
+DOCUMENTS_IN_PROGRESS = REGISTRY.gauge(
+    "pipeline_documents_in_progress", "Documents currently being processed.")
+CACHE_LOOKUPS = REGISTRY.counter(
+    "result_cache_lookups_total", "Result cache lookups, by namespace and hit or miss.", ["namespace", "result"])
+OLLAMA_REQUESTS = REGISTRY.counter(
+    "ollama_requests_total", "Requests sent to Ollama, by model and outcome.", ["model", "status"])
+OLLAMA_COALESCED = REGISTRY.counter(
+    "ollama_coalesced_requests_total", "Calls answered by an identical request already in flight.", ["model"])
+OLLAMA_REQUEST_SECONDS = REGISTRY.histogram(
+    "ollama_request_seconds", "Wall-clock time of Ollama requests, including queueing in Ollama.", ["model"])
+OLLAMA_TOKENS = REGISTRY.counter(
+    "ollama_tokens_total", "Tokens processed by Ollama, by model and kind (prompt or completion).", ["model", "kind"])
+OLLAMA_EVAL_SECONDS = REGISTRY.counter(
+    "ollama_eval_seconds_total", "Time Ollama spent generating completion tokens.", ["model"])
+OLLAMA_PROMPT_EVAL_SECONDS = REGISTRY.counter(
+    "ollama_prompt_eval_seconds_total", "Time Ollama spent reading prompt tokens.", ["model"])
+OLLAMA_LOAD_SECONDS = REGISTRY.counter(
+    "ollama_load_seconds_total", "Time Ollama spent loading models into memory.", ["model"])
+OLLAMA_PROMPT_TOKENS = REGISTRY.histogram(
+    "ollama_prompt_tokens", "Prompt tokens per Ollama call.", ["model"],
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768))
+OLLAMA_BUDGETED = REGISTRY.counter(
+    "ollama_budgeted_calls_total", "Calls whose prompt was trimmed or that were not sent for lack of tokens.",
+    ["model", "outcome"])
+
+@contextmanager
+def stage_timer(timings: dict, stage: str):
+    """Add the time spent in the block to timings[stage] (seconds). Plain dicts survive the process pool."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+def observe_stages(timings: dict) -> None:
+    """Record a document's stage timings in the stage histogram."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+def record_ollama_response(model_name: str, body: dict, elapsed: float) -> None:
+    """Count a successful Ollama call and the token statistics from its final response object."""
+    OLLAMA_REQUESTS.inc(model=model_name, status="ok")
+    OLLAMA_REQUEST_SECONDS.observe(elapsed, model=model_name)
+    OLLAMA_TOKENS.inc(body.get("prompt_eval_count", 0), model=model_name, kind="prompt")
+    OLLAMA_TOKENS.inc(body.get("eval_count", 0), model=model_name, kind="completion")
+    OLLAMA_PROMPT_TOKENS.observe(body.get("prompt_eval_count", 0), model=model_name)
+    # Ollama reports durations in nanoseconds
+    for field, counter in (("eval_duration", OLLAMA_EVAL_SECONDS), ("prompt_eval_duration", OLLAMA_PROMPT_EVAL_SECONDS),
+                           ("load_duration", OLLAMA_LOAD_SECONDS)):
+        if body.get(field):
+            counter.inc(body[field] / 1e9, model=model_name)
+
+def render_metrics() -> str:
+    return REGISTRY.render()
@@ -1,74 +1,643 @@
 import requests
+import httpx
+import asyncio
+import hashlib
+import heapq
+import itertools
 import json
+import logging
+import threading
 import time
 import os
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, aclosing
+from services.metrics import REGISTRY, OLLAMA_REQUESTS, OLLAMA_COALESCED, OLLAMA_BUDGETED, record_ollama_response
+from services.token_usage import ESTIMATOR, OLLAMA_CONTEXT_TOKENS, MIN_COMPLETION_TOKENS, current_usage
+from services.json_stream import JSONObjectStream
+
+logger = logging.getLogger(__name__)
 
 # Configuration with fallbacks
 OLLAMA_BASE_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
 REQUEST_TIMEOUT = int(os.environ.get("OLLAMA_TIMEOUT", 60))  # seconds
 MAX_RETRIES = int(os.environ.get("OLLAMA_MAX_RETRIES", 2))
+# Connection pool size for the shared HTTP clients
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", 16))
+# Concurrent requests allowed per model, e.g. "granite3.2-vision=2,granite3.3:8b=1"
+OLLAMA_DEFAULT_CONCURRENCY = int(os.environ.get("OLLAMA_DEFAULT_CONCURRENCY", 2))
+OLLAMA_MODEL_CONCURRENCY = os.environ.get("OLLAMA_MODEL_CONCURRENCY", "")
+# Models the Ollama host can keep loaded at once; calls for other models wait until one is idle,
+# so calls are grouped by model instead of swapping models in and out of memory
+OLLAMA_MAX_LOADED_MODELS = int(os.environ.get("OLLAMA_MAX_LOADED_MODELS", 1))
+# Calls granted to a loaded model in a row while another model waits, before it has to make way
+OLLAMA_MODEL_BURST = int(os.environ.get("OLLAMA_MODEL_BURST", 8))
+# Identical requests in flight at the same time share one Ollama call
+OLLAMA_COALESCE = os.environ.get("OLLAMA_COALESCE", "1").lower() not in ("0", "false", "no")
 
-def query_model(prompt: str, model: str = "granite3.2-vision", temperature: float = 0.2, max_tokens: int = 2048) -> str:
-    """
-    Query the Ollama API with Granite models.
-    
-    Args:
-        prompt: The text prompt to send to the model
-        model: Model name ("granite3.2-vision", "granite3.3:8B", etc.)
-        temperature: Controls randomness (0.0-1.0)
-        max_tokens: Maximum number of tokens to generate
-        
-    Returns:
-        Generated text response from the model
-    """
-    url = f"{OLLAMA_BASE_URL}/api/generate"
-    
-    # Ensure the model name is valid and use proper Ollama naming conventions
+# Scheduling priorities, most urgent first: short extraction calls go ahead of long story generation
+PRIORITY_EXTRACTION = 0
+PRIORITY_STORY = 1
+
+JSON_SYSTEM_PROMPT = "You are a helpful assistant that provides accurate, structured information. When asked to extract or format data as JSON, you will ONLY output valid JSON without any additional text, explanations, or formatting."
+
+# Keep-alive session shared by every synchronous call
+_session = requests.Session()
+_session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=OLLAMA_MAX_CONNECTIONS))
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=OLLAMA_MAX_CONNECTIONS))
+
+def parse_model_concurrency(spec: str) -> dict:
+    """Parse "model=limit,model=limit" into a dict keyed by lowercase model name."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, limit = item.rsplit("=", 1)
+        try:
+            limits[name.strip().lower()] = max(1, int(limit))
+        except ValueError:
+            logger.warning("Ignoring invalid concurrency limit '%s'", item)
+    return limits
+
+MODEL_CONCURRENCY = parse_model_concurrency(OLLAMA_MODEL_CONCURRENCY)
+
+def resolve_model_name(model: str) -> str:
+    """Ensure the model name is valid and use proper Ollama naming conventions."""
     model_name = model.lower()
     if not any(name in model_name for name in ["granite"]):
-        print(f"Warning: Unknown model '{model}', defaulting to granite3.2-vision")
+        logger.warning("Unknown model '%s', defaulting to granite3.2-vision", model)
         model_name = "granite3.2-vision"
-    
+    return model_name
+
+def build_payload(prompt: str, model_name: str, temperature: float, max_tokens: int, stream: bool = False,
+                  images=None, response_format=None) -> dict:
+    """
+    Build the /api/generate request body shared by the sync and async clients.
+    `images` is a list of base64-encoded images for vision models.
+    `response_format` is Ollama's `format`: "json", or a JSON schema the output must follow.
+    """
     payload = {
         "model": model_name,
         "prompt": prompt,
-        "stream": False,
+        "stream": stream,
         "options": {
             "temperature": temperature,
-            "num_predict": max_tokens
+            "num_predict": max_tokens,
+            "num_ctx": OLLAMA_CONTEXT_TOKENS
         }
     }
+    if images:
+        payload["images"] = list(images)
+    if response_format:
+        payload["format"] = response_format
     
     # Add system prompt to improve consistency for structured outputs
+    system = system_prompt_for(prompt)
+    if system:
+        payload["system"] = system
+    
+    return payload
+
+def system_prompt_for(prompt: str) -> str:
+    """The system prompt build_payload sends with `prompt`, or an empty string."""
     if "json" in prompt.lower() or "extract" in prompt.lower():
-        payload["system"] = "You are a helpful assistant that provides accurate, structured information. When asked to extract or format data as JSON, you will ONLY output valid JSON without any additional text, explanations, or formatting."
+        return JSON_SYSTEM_PROMPT
+    return ""
+
+def _prompt_chars(payload: dict) -> int:
+    return len(payload["prompt"]) + len(payload.get("system", ""))
+
+def estimate_payload_tokens(payload: dict) -> int:
+    """Estimated prompt tokens of a request: its text, system prompt and images."""
+    text = payload["prompt"] + payload.get("system", "")
+    return ESTIMATOR.estimate(text, payload["model"], len(payload.get("images", ())))
+
+def fit_prompt(build_prompt, content: str, model: str, max_tokens: int = 2048) -> str:
+    """
+    Return build_prompt(content), with `content` cut short if the prompt would not leave
+    `max_tokens` of completion room in the context window. Content is cut at a space,
+    keeping its beginning; the instructions around it are always kept whole.
+    """
+    model_name = resolve_model_name(model)
+    prompt = build_prompt(content)
+    limit = OLLAMA_CONTEXT_TOKENS - max_tokens
+    system = system_prompt_for(prompt)
+    if ESTIMATOR.estimate(prompt + system, model_name) <= limit:
+        return prompt
     
+    overhead = ESTIMATOR.estimate(build_prompt("") + system, model_name)
+    keep = int((limit - overhead) * ESTIMATOR.chars_per_token(model_name))
+    if keep <= 0:
+        return prompt
+    cut = content.rfind(" ", 0, keep)
+    trimmed = content[:cut if cut > 0 else keep]
+    logger.warning("Trimmed %s prompt content from %d to %d characters to fit %d context tokens",
+                   model_name, len(content), len(trimmed), OLLAMA_CONTEXT_TOKENS)
+    OLLAMA_BUDGETED.inc(model=model_name, outcome="trimmed")
+    usage = current_usage()
+    if usage is not None:
+        usage.count("trimmed")
+    return build_prompt(trimmed)
+
+def apply_token_budget(payload: dict):
+    """
+    Fit a request into the context window and what is left of the task's token budget,
+    lowering num_predict when the completion would not fit.
+    Returns an error message when there isn't room for a useful completion, else None.
+    """
+    model_name = payload["model"]
+    options = payload["options"]
+    prompt_tokens = estimate_payload_tokens(payload)
+    room = options.get("num_ctx", OLLAMA_CONTEXT_TOKENS) - prompt_tokens
+    reason = "context window"
+    usage = current_usage()
+    remaining = usage.remaining() if usage is not None else None
+    if remaining is not None and remaining - prompt_tokens < room:
+        room = remaining - prompt_tokens
+        reason = "task token budget"
+    
+    if room < MIN_COMPLETION_TOKENS:
+        OLLAMA_BUDGETED.inc(model=model_name, outcome="refused")
+        if usage is not None:
+            usage.count("refused")
+        message = (f"Error: Prompt of about {prompt_tokens} tokens leaves no room for a completion "
+                   f"within the {reason}")
+        logger.warning("%s request not sent: %s", model_name, message[len("Error: "):])
+        return message
+    if options["num_predict"] > room:
+        logger.info("Limiting %s completion to %d tokens by the %s", model_name, room, reason)
+        options["num_predict"] = room
+    return None
+
+def record_model_usage(payload: dict, body: dict, elapsed: float, estimated: bool = False) -> None:
+    """
+    Record the token counts and durations of a response in the metrics and in the current task's usage.
+    `estimated` marks counts made up locally (for a stream cut short), which must not refine the estimator.
+    """
+    model_name = payload["model"]
+    record_ollama_response(model_name, body, elapsed)
+    if not payload.get("images") and not estimated:
+        # Image tokens aren't reported separately, so only text prompts refine the estimate
+        ESTIMATOR.observe(model_name, _prompt_chars(payload), body.get("prompt_eval_count", 0))
+    usage = current_usage()
+    if usage is not None:
+        usage.record(model_name, body)
+    logger.info("%s used %d prompt + %d completion tokens in %.2f seconds",
+                model_name, body.get("prompt_eval_count", 0), body.get("eval_count", 0), elapsed)
+
+def payload_key(payload: dict) -> str:
+    """Fingerprint of a request body; identical prompts, options and images give the same key."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def model_error_message(model_name: str, error) -> str:
+    error_msg = f"Failed to query model after {MAX_RETRIES} attempts: {error}"
+    logger.error(error_msg)
+    return f"Error: {error_msg}. Please check if the Ollama service is running correctly with the requested model ({model_name})."
+
+# Requests being sent by query_model, keyed by payload_key, so identical calls from other threads can wait on them
+_inflight_calls = {}
+_inflight_lock = threading.Lock()
+
+def query_model(prompt: str, model: str = "granite3.2-vision", temperature: float = 0.2, max_tokens: int = 2048,
+                images=None, response_format=None) -> str:
+    """
+    Query the Ollama API with Granite models.
+    Identical calls made at the same time from other threads share one request.
+    
+    Args:
+        prompt: The text prompt to send to the model
+        model: Model name ("granite3.2-vision", "granite3.3:8B", etc.)
+        temperature: Controls randomness (0.0-1.0)
+        max_tokens: Maximum number of tokens to generate
+        images: Optional base64-encoded images for vision models
+        response_format: Optional Ollama output format, "json" or a JSON schema
+        
+    Returns:
+        Generated text response from the model
+    """
+    model_name = resolve_model_name(model)
+    payload = build_payload(prompt, model_name, temperature, max_tokens, images=images,
+                            response_format=response_format)
+    refusal = apply_token_budget(payload)
+    if refusal:
+        return refusal
+    if not OLLAMA_COALESCE:
+        return _generate(model_name, payload)
+    
+    key = payload_key(payload)
+    with _inflight_lock:
+        future = _inflight_calls.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight_calls[key] = Future()
+    if not leader:
+        OLLAMA_COALESCED.inc(model=model_name)
+        logger.debug("Joining identical in-flight %s request", model_name)
+        return future.result()
+    
+    try:
+        result = _generate(model_name, payload)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight_calls[key]
+
+def _generate(model_name: str, payload: dict) -> str:
+    url = f"{OLLAMA_BASE_URL}/api/generate"
     retries = 0
     while retries <= MAX_RETRIES:
         try:
-            print(f"Querying {model_name} model...")
+            logger.debug("Querying %s model...", model_name)
             start_time = time.time()
             
-            response = requests.post(url, json=payload, timeout=REQUEST_TIMEOUT)
+            response = _session.post(url, json=payload, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
             
             elapsed = time.time() - start_time
-            print(f"Model response received in {elapsed:.2f} seconds")
+            body = response.json()
+            record_model_usage(payload, body, elapsed)
             
-            return response.json().get("response", "").strip()
+            return body.get("response", "").strip()
             
         except requests.RequestException as e:
+            OLLAMA_REQUESTS.inc(model=model_name, status="error")
             retries += 1
             wait_time = retries * 2  # Exponential backoff
             
             if retries <= MAX_RETRIES:
-                print(f"Error querying model (attempt {retries}/{MAX_RETRIES}): {e}")
-                print(f"Retrying in {wait_time} seconds...")
+                logger.warning("Error querying model (attempt %d/%d): %s. Retrying in %d seconds...",
+                               retries, MAX_RETRIES, e, wait_time)
                 time.sleep(wait_time)
             else:
-                error_msg = f"Failed to query model after {MAX_RETRIES} attempts: {e}"
-                print(error_msg)
-                return f"Error: {error_msg}. Please check if the Ollama service is running correctly with the requested model ({model_name})."
+                return model_error_message(model_name, e)
                 
     # This should not be reached due to the return in the exception handler
-    return "Error: Unknown error occurred while querying the model."
\ No newline at end of file
+    return "Error: Unknown error occurred while querying the model."
+
+MODEL_QUEUE_SECONDS = REGISTRY.histogram(
+    "ollama_queue_wait_seconds", "Time model calls waited in the scheduler before being sent.", ["model"])
+MODEL_SWITCHES = REGISTRY.counter(
+    "ollama_model_switches_total", "Times the scheduler let calls for a model in after another model's.", ["model"])
+
+class ModelScheduler:
+    """
+    Decides when each async model call may be sent to the Ollama host.
+
+    Calls wait in a queue per model, ordered by priority and then arrival. A model may
+    have up to its concurrency limit of calls in flight. At most `max_loaded` models
+    have calls in flight at once, so calls for the same model are sent together and
+    the host isn't made to swap models for every request. A loaded model makes way
+    for a waiting one once it has had `burst` calls in a row, or after one round of
+    its concurrency limit when the waiting model has more urgent calls; it then drains
+    and the other model takes over.
+    """
+
+    def __init__(self, limits: dict = None, default_limit: int = OLLAMA_DEFAULT_CONCURRENCY,
+                 max_loaded: int = OLLAMA_MAX_LOADED_MODELS, burst: int = OLLAMA_MODEL_BURST):
+        self.limits = MODEL_CONCURRENCY if limits is None else limits
+        self.default_limit = default_limit
+        self.max_loaded = max(1, max_loaded)
+        self.burst = max(1, burst)
+        self._waiting = defaultdict(list)  # model -> heap of (priority, seq, future)
+        self._running = defaultdict(int)
+        self._streak = defaultdict(int)  # calls granted since the model was loaded
+        self._yielding = set()  # loaded models draining to make way for another
+        self._yielded = None  # last model that made way; it doesn't get straight back in
+        self._last_loaded = None
+        self._seq = itertools.count()
+
+    def limit(self, model_name: str) -> int:
+        return self.limits.get(model_name, self.default_limit)
+
+    @asynccontextmanager
+    async def slot(self, model_name: str, priority: int = PRIORITY_EXTRACTION):
+        """Wait for this call's turn, and hold its place among the model's in-flight calls until the block exits."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting[model_name], (priority, next(self._seq), future))
+        queued_at = time.perf_counter()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller gave up
+                self._release(model_name)
+            else:
+                future.cancel()
+                self._dispatch()
+            raise
+        MODEL_QUEUE_SECONDS.observe(time.perf_counter() - queued_at, model=model_name)
+        try:
+            yield
+        finally:
+            self._release(model_name)
+
+    def stats(self) -> dict:
+        """Waiting and in-flight calls per model."""
+        models = set(self._running) | set(self._waiting)
+        return {
+            model: {
+                "waiting": sum(1 for _, _, future in self._waiting.get(model, ()) if not future.done()),
+                "running": self._running.get(model, 0),
+            }
+            for model in models
+        }
+
+    def _head(self, model_name: str):
+        heap = self._waiting[model_name]
+        # Callers that gave up leave cancelled entries behind
+        while heap and heap[0][2].done():
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def _release(self, model_name: str) -> None:
+        self._running[model_name] -= 1
+        if not self._running[model_name]:
+            del self._running[model_name]
+            if model_name in self._yielding:
+                self._yielding.discard(model_name)
+                self._yielded = model_name
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while True:
+            heads = {model: head for model in list(self._waiting) if (head := self._head(model)) is not None}
+            if not heads:
+                return
+            loaded = set(self._running)
+            full = len(loaded) >= self.max_loaded
+            blocked = [heads[model][0] for model in heads if model not in loaded and full]
+            candidates = []
+            for model, head in heads.items():
+                if self._running.get(model, 0) >= self.limit(model):
+                    continue
+                if model in loaded:
+                    streak = self._streak[model]
+                    if blocked and (streak >= self.burst or (min(blocked) < head[0] and streak >= self.limit(model))):
+                        self._yielding.add(model)
+                        continue
+                elif full:
+                    continue
+                candidates.append(model)
+            if len(candidates) > 1 and self._yielded in candidates:
+                candidates.remove(self._yielded)
+            if not candidates:
+                return
+
+            model = min(candidates, key=lambda name: heads[name][:2])
+            if model not in loaded:
+                self._streak[model] = 0
+                if self._last_loaded not in (None, model):
+                    MODEL_SWITCHES.inc(model=model)
+                    logger.debug("Switching model calls to %s", model)
+                self._last_loaded = model
+                if model != self._yielded:
+                    self._yielded = None
+            heapq.heappop(self._waiting[model])
+            self._running[model] += 1
+            self._streak[model] += 1
+            heads[model][2].set_result(None)
+
+# Async client state. httpx clients and asyncio futures belong to one event loop,
+# so both are recreated if they are used from a different loop (e.g. repeated asyncio.run calls).
+_async_client = None
+_async_loop = None
+_scheduler = None
+# Requests being sent by async_query_model, keyed by payload_key
+_inflight_tasks = {}
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the pooled keep-alive client for the running event loop."""
+    global _async_client, _async_loop, _scheduler, _inflight_tasks
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            base_url=OLLAMA_BASE_URL,
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=10),
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_CONNECTIONS
+            ),
+        )
+        _async_loop = loop
+        _scheduler = ModelScheduler()
+        _inflight_tasks = {}
+    return _async_client
+
+def get_scheduler() -> ModelScheduler:
+    """Return the model call scheduler for the running event loop."""
+    get_async_client()  # resets the scheduler if the loop changed
+    return _scheduler
+
+def scheduler_stats() -> dict:
+    return _scheduler.stats() if _scheduler is not None else {}
+
+REGISTRY.gauge("ollama_queued_calls", "Model calls waiting in the scheduler.", ["model"],
+               collect=lambda: {(model,): stats["waiting"] for model, stats in scheduler_stats().items()})
+REGISTRY.gauge("ollama_running_calls", "Model calls in flight to Ollama.", ["model"],
+               collect=lambda: {(model,): stats["running"] for model, stats in scheduler_stats().items()})
+
+async def close_async_client():
+    """Close the shared async client (call on application shutdown)."""
+    global _async_client, _async_loop
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+        _async_loop = None
+
+async def async_query_model(prompt: str, model: str = "granite3.2-vision", temperature: float = 0.2, max_tokens: int = 2048,
+                            images=None, priority: int = PRIORITY_EXTRACTION, response_format=None) -> str:
+    """
+    Async version of query_model.
+    Uses a pooled keep-alive connection, waits for its turn in the model scheduler
+    (see ModelScheduler; `priority` is PRIORITY_EXTRACTION or PRIORITY_STORY) and
+    backs off with asyncio.sleep so retries never hold a worker thread.
+    A call identical to one already in flight waits for that call's answer instead of sending its own.
+    """
+    model_name = resolve_model_name(model)
+    payload = build_payload(prompt, model_name, temperature, max_tokens, images=images,
+                            response_format=response_format)
+    refusal = apply_token_budget(payload)
+    if refusal:
+        return refusal
+    if not OLLAMA_COALESCE:
+        return await _async_generate(model_name, payload, priority)
+    return await _join_inflight(model_name, payload_key(payload),
+                                lambda: _async_generate(model_name, payload, priority))
+
+async def _join_inflight(model_name: str, key: str, start):
+    """
+    Await the in-flight call registered under `key`, or register and await the coroutine `start()` returns.
+    """
+    get_async_client()  # resets the in-flight table if the loop changed
+    task = _inflight_tasks.get(key)
+    if task is not None:
+        OLLAMA_COALESCED.inc(model=model_name)
+        logger.debug("Joining identical in-flight %s request", model_name)
+    else:
+        task = asyncio.ensure_future(start())
+        _inflight_tasks[key] = task
+        task.add_done_callback(lambda done: _forget_inflight_task(key, done))
+    # Shielded so one caller giving up doesn't cancel the answer the others are waiting for
+    return await asyncio.shield(task)
+
+def _forget_inflight_task(key: str, task) -> None:
+    if _inflight_tasks.get(key) is task:
+        del _inflight_tasks[key]
+
+async def _async_generate(model_name: str, payload: dict, priority: int) -> str:
+    client = get_async_client()
+    scheduler = get_scheduler()
+    
+    retries = 0
+    while retries <= MAX_RETRIES:
+        try:
+            async with scheduler.slot(model_name, priority):
+                logger.debug("Querying %s model...", model_name)
+                start_time = time.time()
+                
+                response = await client.post("/api/generate", json=payload)
+                response.raise_for_status()
+                
+                elapsed = time.time() - start_time
+            body = response.json()
+            record_model_usage(payload, body, elapsed)
+            
+            return body.get("response", "").strip()
+        
+        except httpx.HTTPError as e:
+            OLLAMA_REQUESTS.inc(model=model_name, status="error")
+            retries += 1
+            wait_time = retries * 2  # Exponential backoff
+            
+            if retries <= MAX_RETRIES:
+                logger.warning("Error querying model (attempt %d/%d): %s. Retrying in %d seconds...",
+                               retries, MAX_RETRIES, e, wait_time)
+                await asyncio.sleep(wait_time)
+            else:
+                return model_error_message(model_name, e)
+    
+    return "Error: Unknown error occurred while querying the model."
+
+async def async_stream_model(prompt: str, model: str = "granite3.2-vision", temperature: float = 0.2, max_tokens: int = 2048,
+                             priority: int = PRIORITY_STORY, images=None, response_format=None):
+    """
+    Stream a response from the Ollama API, yielding text chunks as the model produces them.
+    Connection errors are retried only until the first chunk has arrived; after that the
+    error is reported in-band, the same way query_model reports failures.
+    Closing the generator early drops the connection, which makes Ollama stop generating.
+    """
+    model_name = resolve_model_name(model)
+    payload = build_payload(prompt, model_name, temperature, max_tokens, stream=True, images=images,
+                            response_format=response_format)
+    refusal = apply_token_budget(payload)
+    if refusal:
+        yield refusal
+        return
+    client = get_async_client()
+    scheduler = get_scheduler()
+    
+    retries = 0
+    while retries <= MAX_RETRIES:
+        received_any = False
+        final_chunk = {}
+        chunks = 0
+        try:
+            async with scheduler.slot(model_name, priority):
+                logger.debug("Streaming from %s model...", model_name)
+                start_time = time.time()
+                
+                async with client.stream("POST", "/api/generate", json=payload) as response:
+                    response.raise_for_status()
+                    # Ollama streams one JSON object per line
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise httpx.HTTPError(chunk["error"])
+                        text = chunk.get("response", "")
+                        if text:
+                            if not received_any:
+                                logger.info("First token received in %.2f seconds", time.time() - start_time)
+                            received_any = True
+                            chunks += 1
+                            yield text
+                        if chunk.get("done"):
+                            # The last object carries the token counts and durations
+                            final_chunk = chunk
+                            break
+                
+                elapsed = time.time() - start_time
+            record_model_usage(payload, final_chunk, elapsed)
+            return
+        
+        except GeneratorExit:
+            # The caller stopped reading; Ollama sends no counts, so charge the estimated prompt
+            # and one token per chunk received (Ollama streams one token per chunk)
+            record_model_usage(payload, {"prompt_eval_count": estimate_payload_tokens(payload), "eval_count": chunks},
+                               time.time() - start_time, estimated=True)
+            raise
+        
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            OLLAMA_REQUESTS.inc(model=model_name, status="error")
+            if received_any:
+                # Part of the answer is already out; don't start over
+                yield f"\n\nError: Model stream interrupted: {e}"
+                return
+            
+            retries += 1
+            wait_time = retries * 2  # Exponential backoff
+            
+            if retries <= MAX_RETRIES:
+                logger.warning("Error querying model (attempt %d/%d): %s. Retrying in %d seconds...",
+                               retries, MAX_RETRIES, e, wait_time)
+                await asyncio.sleep(wait_time)
+            else:
+                yield model_error_message(model_name, e)
+                return
+
+async def async_query_json(prompt: str, model: str = "granite3.2-vision", response_format="json", required=(),
+                           temperature: float = 0.2, max_tokens: int = 2048, images=None,
+                           priority: int = PRIORITY_EXTRACTION) -> dict:
+    """
+    Ask for a JSON object and parse it while it streams in.
+    `response_format` is passed to Ollama as `format` ("json" or a JSON schema), so the answer
+    is a bare object with no fences or prose to strip. Generation is stopped as soon as every
+    key in `required` has a value, or when the object closes; callers that want every field
+    of a schema back pass all of its properties, not just the ones the schema requires.
+    Like async_query_model, an identical call already in flight is joined instead of sent again.
+    
+    Returns the fields decoded, or an empty dict when the model failed.
+    """
+    start = lambda: _stream_json(prompt, model, response_format, required, temperature, max_tokens, images, priority)
+    if not OLLAMA_COALESCE:
+        return await start()
+    model_name = resolve_model_name(model)
+    payload = build_payload(prompt, model_name, temperature, max_tokens, stream=True, images=images,
+                            response_format=response_format)
+    # Calls that stop at different fields can give different answers
+    payload["required"] = sorted(required)
+    fields = await _join_inflight(model_name, payload_key(payload), start)
+    return dict(fields)
+
+async def _stream_json(prompt, model, response_format, required, temperature, max_tokens, images, priority) -> dict:
+    parser = JSONObjectStream()
+    stream = async_stream_model(prompt, model, temperature, max_tokens, priority=priority, images=images,
+                                response_format=response_format)
+    async with aclosing(stream) as chunks:
+        async for chunk in chunks:
+            parser.feed(chunk)
+            if parser.complete:
+                break
+            if required and parser.has(required):
+                logger.debug("All %d requested fields received; stopping %s early", len(required), model)
+                break
+    
+    if not parser.fields and parser.text.strip():
+        logger.warning("No JSON fields in %s response: %s", model, parser.text[:200])
+    return parser.fields
@@ -0,0 +1,92 @@
+import os
+import re
+
+# Configuration with fallbacks
+MAX_STATEMENT_PAGES = int(os.environ.get("STATEMENT_MAX_PAGES", 3))
+MIN_PAGE_SCORE = float(os.environ.get("STATEMENT_MIN_PAGE_SCORE", 6.0))
+
+# Headings that usually open an income statement
+STATEMENT_HEADING = re.compile(
+    r'(?:consolidated\s+)?(?:statements?\s+of\s+(?:consolidated\s+)?(?:operations|income|earnings|comprehensive\s+income)'
+    r'|income\s+statements?|profit\s+and\s+loss)',
+    re.IGNORECASE
+)
+
+# Line items that show up on almost every income statement
+LINE_ITEM_KEYWORDS = re.compile(
+    r'\b(?:total\s+revenues?|net\s+revenues?|revenues?|net\s+sales|cost\s+of\s+(?:revenues?|sales|goods\s+sold)'
+    r'|gross\s+(?:profit|margin)|operating\s+expenses|research\s+and\s+development'
+    r'|selling,?\s+general\s+and\s+administrative|operating\s+income|income\s+from\s+operations'
+    r'|income\s+before\s+(?:income\s+)?taxes|provision\s+for\s+income\s+taxes|net\s+income|net\s+loss'
+    r'|earnings\s+per\s+share|diluted|basic)\b',
+    re.IGNORECASE
+)
+
+# Scale notes such as "(in millions, except per share data)"
+SCALE_NOTE = re.compile(r'\(?\s*in\s+(?:thousands|millions|billions)\b', re.IGNORECASE)
+
+# Numeric cells: 1,234 / (1,234) / 12.5 / $ 1,234
+NUMBER_TOKEN = re.compile(r'\(?\$?\s*\d{1,3}(?:,\d{3})+(?:\.\d+)?\)?|\(?\$?\s*\d+\.\d+\)?')
+
+# Tables of contents mention every statement but hold no data
+TOC_MARKER = re.compile(r'table\s+of\s+contents|^\s*index\s*$', re.IGNORECASE | re.MULTILINE)
+
+def score_page(text: str) -> float:
+    """
+    Score how likely a page is to hold the income statement.
+    Combines statement headings, line-item keyword density and how table-like the numbers are laid out.
+    """
+    if not text or not text.strip():
+        return 0.0
+
+    score = 0.0
+
+    # Headings are the strongest signal, but only count the first few
+    headings = len(STATEMENT_HEADING.findall(text))
+    score += min(headings, 2) * 5.0
+
+    # Distinct line items matter more than the same label repeated
+    keywords = {match.lower() for match in LINE_ITEM_KEYWORDS.findall(text)}
+    score += len(keywords) * 1.5
+
+    if SCALE_NOTE.search(text):
+        score += 2.0
+
+    # Table-like layout: many lines that carry one or more numeric cells
+    lines = [line for line in text.splitlines() if line.strip()]
+    if lines:
+        numeric_lines = sum(1 for line in lines if NUMBER_TOKEN.search(line))
+        numeric_ratio = numeric_lines / len(lines)
+        score += numeric_ratio * 6.0
+        # Statements with several periods have rows of 2+ numbers
+        multi_column_rows = sum(1 for line in lines if len(NUMBER_TOKEN.findall(line)) >= 2)
+        score += min(multi_column_rows, 10) * 0.3
+
+    if TOC_MARKER.search(text):
+        score -= 8.0
+
+    return score
+
+def locate_income_statement_pages(pages, max_pages: int = MAX_STATEMENT_PAGES, min_score: float = MIN_PAGE_SCORE):
+    """
+    Return the indices of the pages most likely to hold the income statement, in document order.
+    Returns an empty list if no page looks like a statement, so callers can fall back to the full text.
+    """
+    return select_statement_page_indices([score_page(text) for text in pages], max_pages, min_score)
+
+def select_statement_page_indices(scores, max_pages: int = MAX_STATEMENT_PAGES, min_score: float = MIN_PAGE_SCORE):
+    """locate_income_statement_pages for pages that were already scored, one score per page in order."""
+    candidates = [(score, index) for index, score in enumerate(scores) if score >= min_score]
+    if not candidates:
+        return []
+
+    candidates.sort(key=lambda item: (-item[0], item[1]))
+    selected = {index for _, index in candidates[:max_pages]}
+
+    # Statements often run onto the next page, so keep the follow-on page of the best match if it also scores
+    best_index = candidates[0][1]
+    if best_index + 1 < len(scores) and len(selected) < max_pages + 1:
+        if scores[best_index + 1] >= min_score / 2:
+            selected.add(best_index + 1)
+
+    return sorted(selected)
@@ -1,112 +1,62 @@
+import asyncio
 import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 import fitz  # PyMuPDF
+import numpy as np
 import re
-from services.model_runner import query_model
-
-def extract_text_from_pdf(pdf_bytes):
-    """Extract text from PDF bytes with improved formatting for financial statements."""
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    text = ""
-    for page in doc:
-        # Extract text with preservation of layout for better table detection
-        text += page.get_text("text") + "\n\n"
-    return text
-
-def detect_scale_notation(text):
-    """Enhanced scale detection with multiple methods for better accuracy."""
-    text = text.lower()
-    
-    # Method 1: Check for explicit scale indicators
-    # First check for explicit billion indicators
-    billion_patterns = [
-        r'\(in billions\)', r'\(billions\)', r'\(in bb\)', r'presented in billions',
-        r'amounts in billions', r'\$.*bb', r'\(bb\)', r'figures? in billions',
-        r'expressed in billions', r'reported in billions', r'USD in billions',
-        r'in billions of (dollars|usd|$)', r'billions of (dollars|usd|$)'
-    ]
-    
-    # Then check for million indicators
-    million_patterns = [
-        r'\(in millions\)', r'\(millions\)', r'\(in mm\)', r'presented in millions',
-        r'amounts in millions', r'\$.*mm', r'\(mm\)', r'figures? in millions',
-        r'expressed in millions', r'reported in millions', r'USD in millions',
-        r'in millions of (dollars|usd|$)', r'millions of (dollars|usd|$)'
-    ]
-    
-    # Check for thousand indicators
-    thousand_patterns = [
-        r'\(in thousands\)', r'\(thousands\)', r'\(in k\)', r'presented in thousands',
-        r'amounts in thousands', r'\$.*k', r'\(k\)', r'figures? in thousands',
-        r'expressed in thousands', r'reported in thousands', r'USD in thousands',
-        r'in thousands of (dollars|usd|$)', r'thousands of (dollars|usd|$)'
-    ]
-    
-    print("Checking for scale notation in text...")
-    
-    # Make a copy of the text with special focus on headers and footnotes
-    header_footer_text = text[:2000] + text[-2000:]
-    
-    # Check for billions first (to avoid misinterpreting "millions" in a document using billions)
-    for pattern in billion_patterns:
-        if re.search(pattern, header_footer_text, re.IGNORECASE):
-            print("Detected billions notation in header/footer")
-            return 1000000000
-    
-    # Then check millions
-    for pattern in million_patterns:
-        if re.search(pattern, header_footer_text, re.IGNORECASE):
-            print("Detected millions notation in header/footer")
-            return 1000000
-    
-    # Finally check thousands
-    for pattern in thousand_patterns:
-        if re.search(pattern, header_footer_text, re.IGNORECASE):
-            print("Detected thousands notation in header/footer")
-            return 1000
-    
-    # Method 2: Check common financial statement headers
-    header_check = text[:1000]  # Check first 1000 characters for headers
-    if re.search(r'(million|mm).*\$|^\$.*mm', header_check, re.IGNORECASE):
-        print("Detected millions notation from header")
-        return 1000000
-    elif re.search(r'(billion|bb).*\$|^\$.*bb', header_check, re.IGNORECASE):
-        print("Detected billions notation from header")
-        return 1000000000
-    
-    # Method 3: Analyze the actual values in the document
-    # Extract potential financial values (numbers with dollar signs or commas)
-    values = []
-    # Look for numbers that might be financial figures
-    for match in re.finditer(r'\$\s*([\d,]+(?:\.\d+)?)', text):
-        try:
-            value = float(match.group(1).replace(',', ''))
-            values.append(value)
-        except ValueError:
-            continue
-    
-    if values:
-        avg_value = sum(values) / len(values)
-        print(f"Average detected value: {avg_value}")
-        
-        # Use the average value to infer the scale
-        if avg_value > 100000000000:  # Numbers in trillions
-            print("Values appear to be raw (no scale factor needed)")
-            return 1
-        elif avg_value > 100000000:  # Numbers in hundreds of millions
-            print("Values appear to be raw (no scale factor needed)")
-            return 1
-        elif avg_value > 10000 and avg_value < 100000:  # Likely in thousands
-            print("Inferred values in thousands")
-            return 1000
-        elif avg_value > 10 and avg_value < 10000:  # Likely in millions
-            print("Inferred values in millions")
-            return 1000000
-        elif avg_value < 10:  # Likely in billions
-            print("Inferred values in billions")
-            return 1000000000
-    
-    print("Using default scale (raw values)")
-    return 1
+from services.model_runner import query_model, async_query_model, async_query_json, fit_prompt
+from services.page_locator import (
+    select_statement_page_indices, score_page, STATEMENT_HEADING, MIN_PAGE_SCORE
+)
+from services.metrics import stage_timer, observe_stages
+from services.chunked_extraction import plan_windows, merge_fragments, WINDOW_CHARS, LLM_CHUNK_PARALLELISM
+from services.logging_config import task_id_var, run_with_task_id
+from services.scale_detection import detect_scale_notation, detect_page_scales, statement_scale
+from services.table_layout import build_table, extract_tables, current_period_index, chronological_order
+from services.vision_extraction import (
+    select_vision_pages, render_statement_pages, VISION_EXTRACTION, VISION_MAX_PAGES
+)
+
+logger = logging.getLogger(__name__)
+
+# Model and prompt version used for LLM extraction.
+# Bump EXTRACTION_PROMPT_VERSION whenever the extraction logic or prompt changes
+# so previously cached results are not reused.
+EXTRACTION_MODEL = "granite3.2-vision"
+EXTRACTION_PROMPT_VERSION = "10"
+
+# Configuration with fallbacks
+# Stop decoding pages once a statement page's table holds every required field
+PARSE_EARLY_STOP = os.environ.get("PARSE_EARLY_STOP", "1").lower() not in ("0", "false", "no")
+# Output constraint for extraction calls: "schema" (the income statement fields), "json" (any object) or "off"
+LLM_OUTPUT_FORMAT = os.environ.get("LLM_OUTPUT_FORMAT", "schema").lower()
+
+def open_pdf(pdf_source):
+    """Open a PDF from raw bytes or from a path on disk."""
+    if isinstance(pdf_source, (str, os.PathLike)):
+        # Opening by path lets PyMuPDF read the file lazily instead of holding it all in memory
+        return fitz.open(pdf_source, filetype="pdf")
+    return fitz.open(stream=pdf_source, filetype="pdf")
+
+def iter_page_text(doc, timings=None):
+    """
+    Yield (page index, text) for an open document one page at a time. A page is only decoded
+    when the consumer asks for it, so a consumer that stops early never pays for the rest.
+    Time spent extracting the text is added to `timings` when given.
+    """
+    timings = {} if timings is None else timings
+    for index in range(doc.page_count):
+        with stage_timer(timings, "text_extraction"):
+            # Extract text with preservation of layout for better table detection
+            text = doc[index].get_text("text")
+        yield index, text
+
+def extract_text_from_pdf(pdf_source):
+    """Extract text from PDF bytes or a PDF file path with improved formatting for financial statements."""
+    with open_pdf(pdf_source) as doc:
+        return "".join(page_text + "\n\n" for _, page_text in iter_page_text(doc))
 
 def normalize_number(value_str):
     """Convert a string representation of a number to a float value."""
@@ -129,125 +79,331 @@ def normalize_number(value_str):
     except ValueError:
         return None
 
+# Value cell that follows a label: 1,234.5 or (1,234.5) for negatives.
+# The conditional group only accepts a closing parenthesis when an opening one was seen.
+VALUE_CAPTURE = r'(\()?([\d,]+(?:\.\d+)?)(?(1)\))'
+
+# Anchor keywords that every label pattern starts with (lowercase, matched at word starts).
+# The combined anchor regex is scanned once; label patterns are only tried where an anchor matched.
+# Keys are the anchor text with whitespace removed and "and" written as "&", see _anchor_key.
+PATTERN_ANCHORS = {
+    'total': r'total',
+    'revenue': r'revenue',
+    'sales': r'sales',
+    'net': r'net',
+    'cost': r'cost',
+    'cogs': r'cogs',
+    'direct': r'direct',
+    'gross': r'gross',
+    'operating': r'operating',
+    'opex': r'opex',
+    'selling': r'selling',
+    'sg&a': r'sg&a',
+    'income': r'income',
+    'ebit': r'ebit',
+    'profit': r'profit',
+    'bottom': r'bottom',
+    'research': r'research',
+    'r&d': r'r\s*(?:&|and)\s*d',
+    'marketing': r'marketing',
+    'general': r'general',
+    'g&a': r'g\s*(?:&|and)\s*a',
+}
+
+# Label patterns for key financial metrics, in priority order.
+# Format is: field name -> list of (anchor, label regex); the value capture is appended at compile time.
+FINANCIAL_PATTERNS = {
+    'Revenue': [
+        ('revenue', r'(?:Total\s+)?Revenue[s]?[:\s]+[\$]?'),
+        ('sales', r'(?:Total\s+)?Sales[:\s]+[\$]?'),
+        ('revenue', r'Revenue[s]?[:\s]*[\$]?'),
+        ('total', r'Total\s+operating\s+revenues?[:\s]+[\$]?'),
+        ('net', r'(?:Total\s+)?Net\s+Sales[:\s]+[\$]?'),
+        ('sales', r'(?:Automotive\s+)?Sales[:\s]+[\$]?'),
+        ('net', r'Net\s+Revenue[:\s]+[\$]?'),
+        ('net', r'Net\s+Sales[:\s]+[\$]?'),
+        ('net', r'Net\s+Operating\s+Revenue[:\s]+[\$]?'),
+    ],
+    'Cost_of_Revenue': [
+        ('cost', r'Cost\s+of\s+(?:Revenue|Sales)[:\s]+[\$]?'),
+        ('cost', r'Cost\s+of\s+goods\s+sold[:\s]+[\$]?'),
+        ('cogs', r'COGS[:\s]+[\$]?'),
+        ('cost', r'Cost\s+of\s+products\s+sold[:\s]+[\$]?'),
+        ('direct', r'Direct\s+costs?[:\s]+[\$]?'),
+    ],
+    'Gross_Profit': [
+        ('gross', r'Gross\s+Profit[:\s]+[\$]?'),
+        ('gross', r'Gross\s+Margin[:\s]+[\$]?'),
+        ('gross', r'Gross\s+Income[:\s]+[\$]?'),
+    ],
+    'Operating_Expenses': [
+        ('operating', r'(?:Total\s+)?Operating\s+Expenses[:\s]+[\$]?'),
+        ('opex', r'(?:Total\s+)?OpEx[:\s]+[\$]?'),
+        ('operating', r'(?:Total\s+)?Operating\s+Costs(?:\s+and\s+Expenses)?[:\s]+[\$]?'),
+        ('selling', r'Selling,\s+General\s+and\s+Administrative\s+Expenses[:\s]+[\$]?'),
+        ('sg&a', r'SG&A\s+Expenses[:\s]+[\$]?'),
+    ],
+    'Operating_Income': [
+        ('operating', r'Operating\s+(?:Income|Profit)[:\s]+[\$]?'),
+        ('income', r'Income\s+[Ff]rom\s+[Oo]perations[:\s]+[\$]?'),
+        ('operating', r'Operating\s+Earnings[:\s]+[\$]?'),
+        ('ebit', r'EBIT[:\s]+[\$]?'),
+    ],
+    'Net_Income': [
+        ('net', r'Net\s+(?:Income|Profit|Earnings)[:\s]+[\$]?'),
+        ('profit', r'Profit\s+for\s+the\s+(?:year|period)[:\s]+[\$]?'),
+        ('net', r'Net\s+Earnings[:\s]+[\$]?'),
+        ('profit', r'(?:Net\s+)?Profit[:\s]+[\$]?'),
+        ('bottom', r'Bottom\s+Line[:\s]+[\$]?'),
+    ],
+    'Research_Development': [
+        ('research', r'Research\s+(?:and|\&)?\s*Development[:\s]+[\$]?'),
+        ('r&d', r'R\s*(?:\&|and)\s*D[:\s]+[\$]?'),
+    ],
+    'Sales_Marketing': [
+        ('sales', r'Sales\s+(?:and|\&)?\s*Marketing[:\s]+[\$]?'),
+        ('marketing', r'Marketing\s+(?:and|\&)?\s*Sales[:\s]+[\$]?'),
+    ],
+    'General_Administrative': [
+        ('general', r'General\s+(?:and|\&)?\s*Administrative[:\s]+[\$]?'),
+        ('g&a', r'G\s*(?:\&|and)\s*A[:\s]+[\$]?'),
+    ],
+}
+
+def _anchor_key(anchor_text):
+    """Map matched anchor text such as "R and D" to its PATTERN_ANCHORS key ("r&d")."""
+    return re.sub(r'\s+', '', anchor_text.lower()).replace('and', '&')
+
+def _compile_financial_matcher():
+    """Compile the anchor scanners and the per-anchor label patterns once at import time."""
+    # No capturing groups here: they disable the regex engine's fast prefix scan
+    anchors = r'\b(?:' + '|'.join(PATTERN_ANCHORS.values()) + ')'
+    # The case-sensitive scanner runs over a lowercased copy of the text, which is much faster
+    # than IGNORECASE; the case-insensitive one is only needed when lowercasing changes the length
+    anchor_regex = re.compile(anchors)
+    anchor_regex_nocase = re.compile(anchors, re.IGNORECASE)
+    patterns_by_anchor = {name: [] for name in PATTERN_ANCHORS}
+    for field, patterns in FINANCIAL_PATTERNS.items():
+        for priority, (anchor, label) in enumerate(patterns):
+            compiled = re.compile(label + VALUE_CAPTURE, re.IGNORECASE)
+            patterns_by_anchor[anchor].append((field, priority, compiled))
+    return anchor_regex, anchor_regex_nocase, patterns_by_anchor
+
+ANCHOR_REGEX, ANCHOR_REGEX_NOCASE, PATTERNS_BY_ANCHOR = _compile_financial_matcher()
+
 def extract_financial_values_with_patterns(text):
-    """Extract financial values using regex patterns targeting common financial statement formats."""
-    results = {}
-    
-    # Define patterns for key financial metrics
-    # Format is: field name -> list of regex patterns
-    financial_patterns = {
-        'Revenue': [
-            r'(?:Total\s+)?Revenue[s]?[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'(?:Total\s+)?Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Revenue[s]?[:\s]*[\$]?([\d,]+(?:\.\d+)?)',
-            r'Total\s+operating\s+revenues?[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'(?:Total\s+)?Net\s+Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'(?:Automotive\s+)?Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Net\s+Revenue[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Net\s+Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Net\s+Operating\s+Revenue[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-        ],
-        'Cost_of_Revenue': [
-            r'Cost\s+of\s+(?:Revenue|Sales)[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Cost\s+of\s+goods\s+sold[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'COGS[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Cost\s+of\s+products\s+sold[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Direct\s+costs?[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
-        ],
-        'Gross_Profit': [
-            r'Gross\s+Profit[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Gross\s+Margin[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Gross\s+Income[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
-        ],
-        'Operating_Expenses': [
-            r'(?:Total\s+)?Operating\s+Expenses[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'(?:Total\s+)?OpEx[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'(?:Total\s+)?Operating\s+Costs(?:\s+and\s+Expenses)?[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Selling,\s+General\s+and\s+Administrative\s+Expenses[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'SG&A\s+Expenses[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
-        ],
-        'Operating_Income': [
-            r'Operating\s+(?:Income|Profit)[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Income\s+[Ff]rom\s+[Oo]perations[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Operating\s+Earnings[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'EBIT[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
-        ],
-        'Net_Income': [
-            r'Net\s+(?:Income|Profit|Earnings)[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Profit\s+for\s+the\s+(?:year|period)[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Net\s+Earnings[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'(?:Net\s+)?Profit[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Bottom\s+Line[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
-        ],
-        'Research_Development': [
-            r'Research\s+(?:and|\&)?\s*Development[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'R\s*(?:\&|and)\s*D[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
-        ],
-        'Sales_Marketing': [
-            r'Sales\s+(?:and|\&)?\s*Marketing[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'Marketing\s+(?:and|\&)?\s*Sales[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
-        ],
-        'General_Administrative': [
-            r'General\s+(?:and|\&)?\s*Administrative[:\s]+[\$]?([\d,]+(?:\.\d+)?)',
-            r'G\s*(?:\&|and)\s*A[:\s]+[\$]?([\d,]+(?:\.\d+)?)'
-        ]
-    }
-    
-    print("Extracting financial values using patterns...")
-    
-    # Apply patterns to extract values
-    for field, patterns in financial_patterns.items():
-        for pattern in patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            if matches:
-                # Take the first match and normalize it
-                value = normalize_number(matches[0])
-                if value is not None:
-                    results[field] = value
-                    print(f"Found {field}: {value} using pattern {pattern}")
-                    break
-    
-    # Look for negative values in parentheses
-    for field in list(results.keys()):
-        if field in results and results[field] is not None:
-            # Already found a good value for this field
-            continue
-            
-        for pattern in financial_patterns[field]:
-            # Modify pattern to look for parentheses
-            paren_pattern = pattern.replace(r'([\d,]+(?:\.\d+)?)', r'\(([\d,]+(?:\.\d+)?)\)')
-            matches = re.findall(paren_pattern, text, re.IGNORECASE)
-            if matches:
-                value = normalize_number(matches[0])
-                if value is not None:
-                    results[field] = -value  # Negative value
-                    print(f"Found {field} (negative): {-value} using pattern {paren_pattern}")
-                    break
+    """
+    Extract financial values using regex patterns targeting common financial statement formats.
+    The text is scanned once for anchor keywords and each label pattern is only tried at those positions.
+    For every field the highest-priority pattern wins, using its first match in the text.
+    Values in parentheses are reported as negative.
+    """
+    # field -> (priority, value, pattern) of the best match seen so far
+    best = {}
+    # Patterns that already produced their first match are not tried again
+    done = set()
+
+    # Positions line up between the two strings unless lowercasing changed the length (rare non-ASCII)
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        anchor_matches = ANCHOR_REGEX.finditer(lowered)
+    else:
+        anchor_matches = ANCHOR_REGEX_NOCASE.finditer(text)
     
+    for anchor_match in anchor_matches:
+        position = anchor_match.start()
+        for field, priority, pattern in PATTERNS_BY_ANCHOR[_anchor_key(anchor_match.group())]:
+            if (field, priority) in done:
+                continue
+            if field in best and best[field][0] <= priority:
+                continue
+            match = pattern.match(text, position)
+            if not match:
+                continue
+            done.add((field, priority))
+            value = normalize_number(match.group(2))
+            if value is None:
+                continue
+            if match.group(1):
+                value = -value
+            best[field] = (priority, value, pattern.pattern)
+
+        # Stop early once every field has matched its top-priority pattern
+        if len(best) == len(FINANCIAL_PATTERNS) and all(entry[0] == 0 for entry in best.values()):
+            break
+
+    results = {}
+    for field in FINANCIAL_PATTERNS:
+        if field in best:
+            _, value, pattern = best[field]
+            results[field] = value
+            logger.debug("Found %s: %s using pattern %s", field, value, pattern)
+
     return results
 
+def _compile_label_matchers():
+    """Label-only versions of FINANCIAL_PATTERNS, matched against whole table row labels."""
+    matchers = []
+    for field, patterns in FINANCIAL_PATTERNS.items():
+        for priority, (_, label) in enumerate(patterns):
+            # Drop the separator that sits between a label and its value in running text
+            core = re.sub(r'\[:\\s\][+*]\[\\\$\]\?$', '', label)
+            matchers.append((field, priority, re.compile(core, re.IGNORECASE)))
+    return matchers
+
+LABEL_MATCHERS = _compile_label_matchers()
+
+def match_table_rows(tables):
+    """
+    Find the table row for each field: {field: (table index, row)}.
+    A row counts only when its whole label matches, so "Cost of revenue" is never taken
+    for revenue, and only rows with a value in the most recent period are considered.
+    For every field the highest-priority label wins, using its first row.
+    """
+    best = {}
+    for table_index, table in enumerate(tables):
+        column = current_period_index(table)
+        for row in table["rows"]:
+            if row["values"][column] is None:
+                continue
+            for field, priority, matcher in LABEL_MATCHERS:
+                if field in best and best[field][0] <= priority:
+                    continue
+                if matcher.fullmatch(row["label"]):
+                    best[field] = (priority, table_index, row)
+    return {field: (table_index, row) for field, (_, table_index, row) in best.items()}
+
+def _relative_scale(table, scale_factor):
+    """How much larger the table's units are than the statement's, when its page states its own scale."""
+    return table.get("scale_factor", scale_factor) / scale_factor
+
+def extract_financial_values_from_tables(tables, scale_factor=1):
+    """
+    Read the most recent period's financial values from the rebuilt statement tables,
+    in units of `scale_factor` even when a table states a different scale.
+    """
+    matched = match_table_rows(tables)
+    results = {}
+    for field in FINANCIAL_PATTERNS:
+        if field in matched:
+            table_index, row = matched[field]
+            table = tables[table_index]
+            results[field] = row["values"][current_period_index(table)] * _relative_scale(table, scale_factor)
+            logger.debug("Found %s in table: %s", field, results[field])
+    return results
+
+def extract_period_values(tables, scale_factor=1):
+    """
+    Every period of the statement, oldest first and scaled by each table's own scale:
+    {"labels": [...], "fields": {field: [...]}, "line_items": {row label: [...]}}.
+    "line_items" holds every row as printed, segments included. The table with the most
+    matched fields sets the periods; other tables only contribute if their columns agree.
+    Returns None when no table was found.
+    """
+    if not tables:
+        return None
+    matched = match_table_rows(tables)
+    primary = max(range(len(tables)), key=lambda index: sum(1 for t, _ in matched.values() if t == index))
+    periods = tables[primary]["periods"]
+    same_periods = {index for index, table in enumerate(tables) if table["periods"] == periods}
+    order = chronological_order(tables[primary])
+
+    def scaled(table, row):
+        factor = table.get("scale_factor", scale_factor)
+        return [None if row["values"][column] is None else format_financial_value(row["values"][column], factor)
+                for column in order]
+
+    fields = {field: scaled(tables[table_index], row)
+              for field, (table_index, row) in matched.items() if table_index in same_periods}
+    line_items = {}
+    for index in sorted(same_periods):
+        for row in tables[index]["rows"]:
+            line_items.setdefault(row["label"], scaled(tables[index], row))
+    return {"labels": [periods[column] for column in order], "fields": fields, "line_items": line_items}
+
+# Terms set apart with spaces for pattern matching and the LLM
+FINANCIAL_TERMS = [
+    "revenue", "total revenue", "sales", "net sales",
+    "cost of revenue", "cost of goods sold", "cogs",
+    "gross profit", "gross margin",
+    "operating expenses", "total operating expenses", "opex",
+    "operating income", "operating profit", "ebit",
+    "net income", "net profit", "net earnings",
+    "research and development", "r&d",
+    "selling, general and administrative", "sg&a"
+]
+
+def _trie_regex(terms):
+    """
+    Build an alternation shaped like a trie ("net\\s+(?:income|profit|...)") so the regex engine
+    tries each character once instead of every term in turn. Spaces match any whitespace run.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [(r'\s+' if char == " " else re.escape(char)) + build(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A term ends here while a longer one may continue
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+def _compile_normaliser():
+    """
+    One pattern for everything clean_text_for_extraction changes: a financial term together
+    with the whitespace around it, or whitespace that needs collapsing (runs of two or more,
+    or any whitespace other than a plain space). Single spaces never match, which keeps the
+    number of matches, and so the Python-level work, small.
+    
+    Terms were once padded one at a time, in list order. Padding a term doubles the spaces around
+    it, so a later term containing it ("net sales" after "sales") could never match as a whole.
+    Those terms are left out, which keeps the tokens the same as the term-by-term version gave:
+    "Selling,net sales" still splits into "Selling,net" and "sales".
+    """
+    terms = []
+    for term in FINANCIAL_TERMS:
+        if not any(re.search(r'\b' + re.escape(earlier) + r'\b', term) for earlier in terms):
+            terms.append(term)
+    pattern = r'\s*\b(' + _trie_regex(terms) + r')\b\s*|\s{2,}|[^\S ]'
+    # As for the anchor scanner, the case-sensitive pattern runs over a lowercased copy of the text
+    return re.compile(pattern), re.compile(pattern, re.IGNORECASE)
+
+NORMALISER, NORMALISER_NOCASE = _compile_normaliser()
+
 def clean_text_for_extraction(text):
-    """Prepare text for better pattern matching and LLM extraction."""
-    # Remove excess whitespace
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Make common financial terms more visible
-    financial_terms = [
-        "revenue", "total revenue", "sales", "net sales",
-        "cost of revenue", "cost of goods sold", "cogs",
-        "gross profit", "gross margin",
-        "operating expenses", "total operating expenses", "opex",
-        "operating income", "operating profit", "ebit",
-        "net income", "net profit", "net earnings",
-        "research and development", "r&d",
-        "selling, general and administrative", "sg&a"
-    ]
-    
-    for term in financial_terms:
-        # Make the term more visible by adding spaces around it
-        text = re.sub(r'(\b' + term + r'\b)', r' \1 ', text, flags=re.IGNORECASE)
-    
-    return text
+    """
+    Prepare text for better pattern matching and LLM extraction: collapse whitespace
+    and make common financial terms more visible by adding spaces around them, in one pass.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        matches = NORMALISER.finditer(lowered)
+    else:
+        matches = NORMALISER_NOCASE.finditer(text)
+    
+    pieces = []
+    position = 0
+    for match in matches:
+        pieces.append(text[position:match.start()])
+        if match.group(1):
+            pieces.append(" " + " ".join(text[match.start(1):match.end(1)].split()) + " ")
+        else:
+            pieces.append(" ")
+        position = match.end()
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+def clean_pages_for_extraction(pages):
+    """Clean the text page by page, so only one page's intermediate copies exist at a time."""
+    return "".join(clean_text_for_extraction(page_text + "\n\n") for page_text in pages)
 
 def format_financial_value(value, scale_factor=1):
     """Format and scale financial values."""
@@ -261,7 +417,7 @@ def format_financial_value(value, scale_factor=1):
             scaled_value = value * scale_factor
             
             # Return as integer if whole number, otherwise round to 2 decimal places
-            return int(scaled_value) if scaled_value.is_integer() else round(scaled_value, 2)
+            return int(scaled_value) if float(scaled_value).is_integer() else round(scaled_value, 2)
             
         # Handle string values
         if isinstance(value, str):
@@ -272,7 +428,7 @@ def format_financial_value(value, scale_factor=1):
         return "Unknown"
         
     except Exception as e:
-        print(f"Error formatting value '{value}': {str(e)}")
+        logger.warning("Error formatting value '%s': %s", value, e)
         return "Unknown"
 
 def validate_financial_data(data):
@@ -284,39 +440,39 @@ def validate_financial_data(data):
     MAX_REASONABLE_VALUE = 1e12  # 1 trillion
     for key, value in validated.items():
         if isinstance(value, (int, float)) and abs(value) > MAX_REASONABLE_VALUE:
-            print(f"Warning: Unreasonably large value detected for {key}: {value}")
+            logger.warning("Unreasonably large value detected for %s: %s", key, value)
             # Scale down the value if it's too large
             scale_down = 1000  # Scale down by 1000
             validated[key] = value / scale_down
-            print(f"Scaled down to: {validated[key]}")
+            logger.warning("Scaled %s down to: %s", key, validated[key])
     
     # Check if values are in expected relationships
     if 'Revenue' in validated and 'Gross_Profit' in validated:
         if validated['Gross_Profit'] > validated['Revenue']:
-            print("Warning: Gross Profit exceeds Revenue, which is unusual")
+            logger.warning("Gross Profit exceeds Revenue, which is unusual")
             # Adjust the values to make them more reasonable
             if validated['Gross_Profit'] > 0 and validated['Revenue'] > 0:
                 # If both are positive, scale Revenue up
                 validated['Revenue'] = validated['Gross_Profit'] * 2
-                print(f"Adjusted Revenue to: {validated['Revenue']}")
+                logger.warning("Adjusted Revenue to: %s", validated['Revenue'])
     
     if 'Gross_Profit' in validated and 'Operating_Income' in validated:
         if validated['Operating_Income'] > validated['Gross_Profit']:
-            print("Warning: Operating Income exceeds Gross Profit, which is unusual")
+            logger.warning("Operating Income exceeds Gross Profit, which is unusual")
             # Adjust the values to make them more reasonable
             if validated['Operating_Income'] > 0 and validated['Gross_Profit'] > 0:
                 # If both are positive, scale Gross Profit up
                 validated['Gross_Profit'] = validated['Operating_Income'] * 1.5
-                print(f"Adjusted Gross Profit to: {validated['Gross_Profit']}")
+                logger.warning("Adjusted Gross Profit to: %s", validated['Gross_Profit'])
     
     if 'Operating_Income' in validated and 'Net_Income' in validated:
         if validated['Net_Income'] > validated['Operating_Income']:
-            print("Warning: Net Income exceeds Operating Income, which is unusual")
+            logger.warning("Net Income exceeds Operating Income, which is unusual")
             # Adjust the values to make them more reasonable
             if validated['Net_Income'] > 0 and validated['Operating_Income'] > 0:
                 # If both are positive, scale Operating Income up
                 validated['Operating_Income'] = validated['Net_Income'] * 1.2
-                print(f"Adjusted Operating Income to: {validated['Operating_Income']}")
+                logger.warning("Adjusted Operating Income to: %s", validated['Operating_Income'])
     
     return validated
 
@@ -327,49 +483,46 @@ def infer_missing_values(data):
     # Infer Cost of Revenue if Revenue and Gross Profit are known
     if 'Revenue' in inferred and 'Gross_Profit' in inferred and 'Cost_of_Revenue' not in inferred:
         inferred['Cost_of_Revenue'] = inferred['Revenue'] - inferred['Gross_Profit']
-        print(f"Inferred Cost of Revenue: {inferred['Cost_of_Revenue']}")
+        logger.debug("Inferred Cost of Revenue: %s", inferred['Cost_of_Revenue'])
     
     # Infer Gross Profit if Revenue and Cost of Revenue are known
     if 'Revenue' in inferred and 'Cost_of_Revenue' in inferred and 'Gross_Profit' not in inferred:
         inferred['Gross_Profit'] = inferred['Revenue'] - inferred['Cost_of_Revenue']
-        print(f"Inferred Gross Profit: {inferred['Gross_Profit']}")
+        logger.debug("Inferred Gross Profit: %s", inferred['Gross_Profit'])
     
     # Infer Operating Expenses if Gross Profit and Operating Income are known
     if 'Gross_Profit' in inferred and 'Operating_Income' in inferred and 'Operating_Expenses' not in inferred:
         inferred['Operating_Expenses'] = inferred['Gross_Profit'] - inferred['Operating_Income']
-        print(f"Inferred Operating Expenses: {inferred['Operating_Expenses']}")
+        logger.debug("Inferred Operating Expenses: %s", inferred['Operating_Expenses'])
     
     # Infer Operating Income if Gross Profit and Operating Expenses are known
     if 'Gross_Profit' in inferred and 'Operating_Expenses' in inferred and 'Operating_Income' not in inferred:
         inferred['Operating_Income'] = inferred['Gross_Profit'] - inferred['Operating_Expenses']
-        print(f"Inferred Operating Income: {inferred['Operating_Income']}")
+        logger.debug("Inferred Operating Income: %s", inferred['Operating_Income'])
     
     # If we have very little data, make some reasonable estimates
     if 'Revenue' in inferred and len(inferred) < 3:
         if 'Cost_of_Revenue' not in inferred:
             inferred['Cost_of_Revenue'] = inferred['Revenue'] * 0.65  # Typical COGS ratio
-            print(f"Estimated Cost of Revenue: {inferred['Cost_of_Revenue']}")
+            logger.debug("Estimated Cost of Revenue: %s", inferred['Cost_of_Revenue'])
         if 'Gross_Profit' not in inferred:
             inferred['Gross_Profit'] = inferred['Revenue'] - inferred['Cost_of_Revenue']
-            print(f"Estimated Gross Profit: {inferred['Gross_Profit']}")
+            logger.debug("Estimated Gross Profit: %s", inferred['Gross_Profit'])
         if 'Operating_Expenses' not in inferred:
             inferred['Operating_Expenses'] = inferred['Gross_Profit'] * 0.7  # Typical OpEx ratio
-            print(f"Estimated Operating Expenses: {inferred['Operating_Expenses']}")
+            logger.debug("Estimated Operating Expenses: %s", inferred['Operating_Expenses'])
         if 'Operating_Income' not in inferred:
             inferred['Operating_Income'] = inferred['Gross_Profit'] - inferred['Operating_Expenses']
-            print(f"Estimated Operating Income: {inferred['Operating_Income']}")
+            logger.debug("Estimated Operating Income: %s", inferred['Operating_Income'])
         if 'Net_Income' not in inferred:
             inferred['Net_Income'] = inferred['Operating_Income'] * 0.75  # Accounting for taxes
-            print(f"Estimated Net Income: {inferred['Net_Income']}")
+            logger.debug("Estimated Net Income: %s", inferred['Net_Income'])
     
     return inferred
 
-def extract_llm_financial_data(text):
-    """Extract financial data using LLM."""
-    print("Attempting to extract financial data using LLM...")
-    
-    # Prepare the prompt for the LLM
-    prompt = f"""
+def build_extraction_prompt(text):
+    """Prepare the income statement extraction prompt for the LLM."""
+    return f"""
     Extract ONLY the income statement data from this financial document text.
     
     FORMAT INSTRUCTIONS (CRITICAL):
@@ -379,7 +532,7 @@ def extract_llm_financial_data(text):
     4. DO NOT multiply values by any scale factor
     5. If a value is negative, represent it as a negative number like -10.5, not with parentheses
     6. If a value is not found, use "Unknown" in quotes
-    7. Ensure all keys are in snake_case (e.g., "net_income", "operating_expenses")
+    7. Use exactly the key names listed below
     
     KEYS TO EXTRACT:
     - "Revenue": The company's total income from sales
@@ -388,19 +541,25 @@ def extract_llm_financial_data(text):
     - "Operating_Expenses": Expenses related to normal business operations
     - "Operating_Income": Gross Profit minus Operating Expenses
     - "Net_Income": Final profit after all expenses, taxes, interest
-    - Any other relevant financial metrics you can identify
+    - "Research_Development", "Sales_Marketing", "General_Administrative": only if shown separately
     
     FINANCIAL DOCUMENT TEXT:
     \"\"\"
-    {text[:12000]}
+    {text[:WINDOW_CHARS]}
     \"\"\"
     
     IMPORTANT: Return ONLY the JSON object, no markdown formatting, no explanations.
     """
     
-    response = query_model(prompt, model="granite3.2-vision")
-    
-    # Try to extract valid JSON from the response
+def parse_llm_response(response):
+    """Turn the model's extraction response into a dict of values."""
+    # Structured output (see extraction_format) is a bare JSON object
+    try:
+        json_data = json.loads(response)
+        if isinstance(json_data, dict):
+            return json_data
+    except json.JSONDecodeError:
+        pass
     json_data = None
     
     # First attempt: Look for JSON block
@@ -408,9 +567,9 @@ def extract_llm_financial_data(text):
     if json_match:
         try:
             json_data = json.loads(json_match.group(1))
-            print("Successfully extracted JSON from code block")
+            logger.debug("Successfully extracted JSON from code block")
         except json.JSONDecodeError:
-            print("Failed to parse JSON from code block")
+            logger.debug("Failed to parse JSON from code block")
     
     # Second attempt: Look for a standalone JSON object
     if not json_data:
@@ -418,13 +577,13 @@ def extract_llm_financial_data(text):
         if json_match:
             try:
                 json_data = json.loads(json_match.group(1))
-                print("Successfully extracted standalone JSON")
+                logger.debug("Successfully extracted standalone JSON")
             except json.JSONDecodeError:
-                print("Failed to parse standalone JSON")
+                logger.debug("Failed to parse standalone JSON")
     
     # Third attempt: Parse line by line as key-value pairs
     if not json_data:
-        print("Attempting line-by-line parsing...")
+        logger.debug("Attempting line-by-line parsing...")
         json_data = {}
         for line in response.strip().split('\n'):
             if ':' in line:
@@ -442,91 +601,383 @@ def extract_llm_financial_data(text):
     
     return json_data if json_data else {}
 
-def extract_income_statement(pdf_bytes):
+def build_vision_prompt():
+    """Prepare the income statement extraction prompt sent along with a rendered page."""
+    return """
+    Extract ONLY the income statement data from the attached image of a financial document page.
+    Read the values from the most recent period column of the table.
+    
+    FORMAT INSTRUCTIONS (CRITICAL):
+    1. Your response must ONLY contain a valid JSON object WITHOUT any markdown formatting
+    2. Each key must be in quotes, each value must be a NUMBER (without any currency symbols) or "Unknown" in quotes
+    3. DO NOT include any scale factors in your numbers - provide raw values exactly as they appear
+    4. If a value is negative or shown in parentheses, represent it as a negative number like -10.5
+    5. If a value is not on the page, use "Unknown" in quotes
+    
+    KEYS TO EXTRACT:
+    - "Revenue", "Cost_of_Revenue", "Gross_Profit", "Operating_Expenses", "Operating_Income", "Net_Income"
+    
+    IMPORTANT: Return ONLY the JSON object, no markdown formatting, no explanations.
+    """
+
+def income_statement_schema(fields):
     """
-    Extract income statement data using a hybrid approach combining pattern matching and LLM.
-    This approach is more robust and less likely to produce wildly inaccurate results.
+    JSON schema of an extraction answer: each field a number or "Unknown", with REQUIRED_FIELDS
+    mandatory. Ollama generates required properties first, in order, so they arrive before the rest.
     """
-    try:
-        # Step 1: Extract text from PDF
-        raw_text = extract_text_from_pdf(pdf_bytes)
-        
-        # Step 2: Detect scale notation (in millions, in billions, etc.)
-        scale_factor = detect_scale_notation(raw_text)
-        print(f"Detected scale factor: {scale_factor}")
-        
-        # Step 3: Clean and prepare text for extraction
-        processed_text = clean_text_for_extraction(raw_text)
-        
-        # Step 4: First attempt - Extract using rule-based pattern matching
+    value = {"anyOf": [{"type": "number"}, {"type": "string", "enum": ["Unknown"]}]}
+    return {
+        "type": "object",
+        "properties": {field: value for field in fields},
+        "required": [field for field in fields if field in REQUIRED_FIELDS],
+        "additionalProperties": False,
+    }
+
+def extraction_format(fields=None):
+    """Ollama `format` for an extraction call over `fields` (every known field by default), or None when off."""
+    if LLM_OUTPUT_FORMAT == "schema":
+        return income_statement_schema(fields or list(FINANCIAL_PATTERNS))
+    if LLM_OUTPUT_FORMAT == "json":
+        return "json"
+    return None
+
+async def async_extract_json(prompt, fields=None, images=None):
+    """
+    Run an extraction prompt with structured output over `fields` (every known field by default),
+    stopping generation once all of them are in or the object closes. Stopping at REQUIRED_FIELDS
+    would cut off the optional fields the prompt also asks for.
+    Falls back to free-form output and parse_llm_response when LLM_OUTPUT_FORMAT is "off".
+    """
+    fields = fields or list(FINANCIAL_PATTERNS)
+    output_format = extraction_format(fields)
+    if output_format is None:
+        return parse_llm_response(await async_query_model(prompt, model=EXTRACTION_MODEL, images=images))
+    return await async_query_json(prompt, model=EXTRACTION_MODEL, response_format=output_format,
+                                  required=fields, images=images)
+
+def extract_window(window_text):
+    """Run the extraction prompt over one window of text."""
+    response = query_model(fit_prompt(build_extraction_prompt, window_text, EXTRACTION_MODEL), model=EXTRACTION_MODEL,
+                           response_format=extraction_format())
+    return parse_llm_response(response)
+
+async def async_extract_window(window_text, semaphore=None):
+    """Async version of extract_window; `semaphore` limits how many windows are in flight."""
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+    async with semaphore:
+        prompt = fit_prompt(build_extraction_prompt, window_text, EXTRACTION_MODEL)
+        return await async_extract_json(prompt)
+
+def extract_llm_financial_data(text):
+    """
+    Extract financial data using LLM.
+    Long text is split into overlapping windows that are extracted in parallel and merged.
+    """
+    windows = plan_windows(text)
+    logger.info("Attempting to extract financial data using LLM (%d windows)...", len(windows))
+    if len(windows) == 1:
+        return merge_fragments(windows, [extract_window(windows[0])], FINANCIAL_PATTERNS)
+    task_id = task_id_var.get()
+    with ThreadPoolExecutor(max_workers=LLM_CHUNK_PARALLELISM, thread_name_prefix="llm-chunk") as pool:
+        fragments = list(pool.map(lambda window: run_with_task_id(task_id, extract_window, window), windows))
+    return merge_fragments(windows, fragments, FINANCIAL_PATTERNS)
+
+async def async_extract_llm_financial_data(text):
+    """Extract financial data using LLM without blocking the event loop, with the windows sent concurrently."""
+    windows = plan_windows(text)
+    logger.info("Attempting to extract financial data using LLM (%d windows)...", len(windows))
+    semaphore = asyncio.Semaphore(LLM_CHUNK_PARALLELISM)
+    fragments = await asyncio.gather(*(async_extract_window(window, semaphore) for window in windows))
+    return merge_fragments(windows, fragments, FINANCIAL_PATTERNS)
+
+def extract_vision_financial_data(vision_pages):
+    """
+    Extract financial data from rendered statement pages with the vision model, one call per page.
+    The page text, when there is any, lets merge_fragments prefer values actually printed on the page.
+    """
+    logger.info("Attempting to extract financial data from %d page images...", len(vision_pages))
+    prompt = build_vision_prompt()
+    output_format = extraction_format(REQUIRED_FIELDS)
+    task_id = task_id_var.get()
+
+    def extract_page(page):
+        return query_model(prompt, model=EXTRACTION_MODEL, images=[page["image"]], response_format=output_format)
+
+    with ThreadPoolExecutor(max_workers=len(vision_pages), thread_name_prefix="llm-vision") as pool:
+        responses = list(pool.map(lambda page: run_with_task_id(task_id, extract_page, page), vision_pages))
+    fragments = [parse_llm_response(response) for response in responses]
+    return merge_fragments([page["text"] for page in vision_pages], fragments, FINANCIAL_PATTERNS)
+
+async def async_extract_vision_financial_data(vision_pages):
+    """Async version of extract_vision_financial_data, with the pages sent concurrently."""
+    logger.info("Attempting to extract financial data from %d page images...", len(vision_pages))
+    prompt = build_vision_prompt()
+    fragments = await asyncio.gather(*(
+        async_extract_json(prompt, REQUIRED_FIELDS, images=[page["image"]]) for page in vision_pages
+    ))
+    return merge_fragments([page["text"] for page in vision_pages], fragments, FINANCIAL_PATTERNS)
+
+# Fields every income statement result must carry, even if only as "Unknown"
+REQUIRED_FIELDS = ['Revenue', 'Cost_of_Revenue', 'Gross_Profit',
+                   'Operating_Expenses', 'Operating_Income', 'Net_Income']
+
+# Minimum number of pattern matches before the LLM fallback is skipped
+MIN_PATTERN_FIELDS = 4
+
+def income_statement_error(e):
+    """Build the error payload returned when extraction fails."""
+    logger.error("Error in extract_income_statement: %s", e)
+    result = {"error": f"Error processing request: {str(e)}"}
+    for field in REQUIRED_FIELDS:
+        result[field] = "Unknown"
+    result["visualization_data"] = None
+    return result
+
+def needs_vision_extraction(pattern_results, mode=VISION_EXTRACTION):
+    """True when the statement pages should be read by the vision model: text extraction missed a required field."""
+    if mode == "off":
+        return False
+    return mode == "always" or any(field not in pattern_results for field in REQUIRED_FIELDS)
+
+def render_vision_pages(doc, doc_hash, scores, texts, page_indices):
+    """Render the candidate statement pages (at most VISION_MAX_PAGES) of the open document for the vision model."""
+    indices = select_vision_pages(scores, page_indices, VISION_MAX_PAGES)
+    logger.info("Rendering pages %s for vision extraction", [index + 1 for index in indices])
+    images = render_statement_pages(doc, indices, doc_hash)
+    return [{"page": index, "image": image, "text": texts[index] if index in texts else doc[index].get_text("text")}
+            for index, image in zip(indices, images)]
+
+def scan_statement_pages(doc, timings, stop_early=PARSE_EARLY_STOP):
+    """
+    Score pages as they are decoded, keeping the text of only the pages that could be part of
+    the statement. With `stop_early`, reading stops at the first page that has a statement
+    heading and whose table yields every REQUIRED_FIELDS value, so the rest of the document
+    is never decoded.
+    Returns (scores, texts, tables): a score for every page read, {index: text} for candidate
+    pages and {index: table or None} for the pages whose table was rebuilt along the way.
+    """
+    scores = []
+    texts = {}
+    tables = {}
+    for index, text in iter_page_text(doc, timings):
+        with stage_timer(timings, "page_location"):
+            score = score_page(text)
+        scores.append(score)
+        # Pages this low can't be located, not even as the follow-on page of a statement
+        if score >= MIN_PAGE_SCORE / 2:
+            texts[index] = text
+        if stop_early and score >= MIN_PAGE_SCORE and STATEMENT_HEADING.search(text):
+            with stage_timer(timings, "table_extraction"):
+                tables[index] = build_table(doc[index].get_text("words"), index)
+                found = extract_financial_values_from_tables([tables[index]]) if tables[index] else {}
+            if all(field in found for field in REQUIRED_FIELDS):
+                logger.info("Income statement complete on page %d, skipping the remaining %d pages",
+                            index + 1, doc.page_count - index - 1)
+                break
+    return scores, texts, tables
+
+def parse_income_statement(pdf_source, doc_hash: str = None):
+    """
+    CPU-bound half of the extraction: PDF text, table reconstruction, scale detection,
+    cleaning and pattern matching, plus rendering the statement pages when the vision model has to read them.
+    It makes no network calls, so it can run in a process pool.
+    `doc_hash` is the SHA-256 of the PDF (StoredUpload.sha256); page renders are cached only when it is given.
+    Returns a plain dict that is cheap to pickle back to the caller, including the
+    seconds spent in each step under "timings".
+    """
+    timings = {}
+    with stage_timer(timings, "pdf_open"):
+        doc = open_pdf(pdf_source)
+    with doc:
+        return _parse_document(doc, doc_hash, timings)
+
+def _parse_document(doc, doc_hash, timings):
+    # Step 1: Stream the pages, keeping only the ones that hold the income statement
+    scores, texts, built_tables = scan_statement_pages(doc, timings)
+    with stage_timer(timings, "page_location"):
+        page_indices = select_statement_page_indices(scores)
+    if page_indices:
+        logger.info("Located income statement on pages %s of %d", [index + 1 for index in page_indices], doc.page_count)
+        statement_pages = [texts[index] for index in page_indices]
+    else:
+        # Only candidate pages were kept, so the full text is read again for this rare case
+        logger.info("No income statement pages located, using full document text")
+        statement_pages = [text for _, text in iter_page_text(doc, timings)]
+    raw_text = "".join(page_text + "\n\n" for page_text in statement_pages)
+    
+    # Step 1b: Rebuild the statement tables from word positions
+    with stage_timer(timings, "table_extraction"):
+        tables = extract_tables(doc, page_indices, built_tables)
+    
+    # Step 2: Detect scale notation (in millions, in billions, etc.) for each statement page
+    with stage_timer(timings, "scale_detection"):
+        page_scales = detect_page_scales(texts, page_indices)
+        scale_factor = statement_scale(page_scales, raw_text)
+        for table in tables:
+            table["scale_factor"] = page_scales.get(table["page"]) or scale_factor
+    logger.info("Detected scale factor: %s", scale_factor)
+    
+    # Step 2b: Read the current period from the tables
+    with stage_timer(timings, "table_extraction"):
+        table_results = extract_financial_values_from_tables(tables, scale_factor)
+    logger.info("Table extraction found %d values in %d tables", len(table_results), len(tables))
+    
+    # Step 3: Clean and prepare text for extraction
+    with stage_timer(timings, "text_cleaning"):
+        processed_text = clean_pages_for_extraction(statement_pages)
+    
+    # Step 4: First attempt - Extract using rule-based pattern matching
+    with stage_timer(timings, "pattern_extraction"):
         pattern_results = extract_financial_values_with_patterns(processed_text)
-        print(f"Pattern-based extraction found {len(pattern_results)} values")
-        
-        # Step 5: If pattern matching is insufficient, try LLM extraction
-        if len(pattern_results) < 4:  # Not enough values found with patterns
-            print("Insufficient data from pattern matching, using LLM as backup")
-            llm_results = extract_llm_financial_data(processed_text)
-            
-            # Merge the results, giving priority to pattern-based extraction
-            for key, value in llm_results.items():
-                if key not in pattern_results or pattern_results[key] == "Unknown":
-                    pattern_results[key] = value
-            
-            print(f"After LLM extraction, we have {len(pattern_results)} values")
-        
-        # Step 6: Apply the scale factor to all values
-        formatted_data = {}
-        for key, value in pattern_results.items():
-            formatted_data[key] = format_financial_value(value, scale_factor)
-        
-        # Step 7: Validate the data for reasonableness
-        validated_data = validate_financial_data(formatted_data)
-        
-        # Step 8: Infer missing values based on financial relationships
-        final_data = infer_missing_values(validated_data)
-        
-        # Step 9: Ensure we have all required fields
-        required_fields = ['Revenue', 'Cost_of_Revenue', 'Gross_Profit', 
-                        'Operating_Expenses', 'Operating_Income', 'Net_Income']
-        
-        for field in required_fields:
-            if field not in final_data or final_data[field] == "Unknown":
-                final_data[field] = "Unknown"
-        
-        # Step 10: Process the data for visualization
-        visualization_data = process_financial_data_for_visualization(final_data)
-        
-        # Add visualization data to the response
-        final_data["visualization_data"] = visualization_data
+    logger.info("Pattern-based extraction found %d values", len(pattern_results))
+    
+    # Table values win: they come from the right row and period column. Patterns fill the gaps.
+    pattern_results = {
+        field: table_results.get(field, pattern_results.get(field))
+        for field in FINANCIAL_PATTERNS if field in table_results or field in pattern_results
+    }
+    
+    # Step 4b: Render the statement pages if the text was missing required fields
+    vision_pages = None
+    if needs_vision_extraction(pattern_results):
+        with stage_timer(timings, "page_render"):
+            vision_pages = render_vision_pages(doc, doc_hash, scores, texts, page_indices)
+    
+    return {
+        "scale_factor": scale_factor,
+        # Scale note found on each statement page (None when the page has none)
+        "page_scales": page_scales,
+        "pattern_results": pattern_results,
+        # Only needed when the LLM fallback has to run
+        "processed_text": processed_text if len(pattern_results) < MIN_PATTERN_FIELDS else None,
+        "vision_pages": vision_pages,
+        # Every period of the statement, label by label
+        "tables": tables,
+        "pages_read": len(scores),
+        "timings": timings,
+    }
+
+def needs_llm_fallback(parsed):
+    """True when pattern matching found too few values and the LLM has to fill the gaps."""
+    return len(parsed["pattern_results"]) < MIN_PATTERN_FIELDS
+
+def complete_income_statement(parsed, llm_results=None, vision_results=None):
+    """
+    Second half of the extraction: vision and LLM fallbacks (network-bound), scaling, validation,
+    inference and visualization data, starting from the output of parse_income_statement.
+    Async callers can run the model calls themselves and pass their output as `llm_results`
+    and `vision_results`. Stage timings are added to parsed["timings"].
+    """
+    pattern_results = dict(parsed["pattern_results"])
+    scale_factor = parsed["scale_factor"]
+    timings = parsed.setdefault("timings", {})
+    
+    # Step 4c: Fill the fields the text was missing from the rendered statement pages
+    if parsed.get("vision_pages"):
+        if vision_results is None:
+            with stage_timer(timings, "vision_extraction"):
+                vision_results = extract_vision_financial_data(parsed["vision_pages"])
+        for key, value in vision_results.items():
+            if key not in pattern_results or pattern_results[key] == "Unknown":
+                pattern_results[key] = value
+        logger.info("After vision extraction, we have %d values", len(pattern_results))
+    
+    # Step 5: If pattern matching is insufficient, try LLM extraction
+    if needs_llm_fallback(parsed):  # Not enough values found with patterns
+        logger.info("Insufficient data from pattern matching, using LLM as backup")
+        if llm_results is None:
+            with stage_timer(timings, "llm_extraction"):
+                llm_results = extract_llm_financial_data(parsed["processed_text"])
         
-        # Log the final values
-        print("\nFinal processed values:")
-        for key, value in final_data.items():
-            if key != "visualization_data":
-                if isinstance(value, (int, float)):
-                    print(f"{key}: {value:,}")
-                else:
-                    print(f"{key}: {value}")
+        # Merge the results, giving priority to pattern-based extraction
+        for key, value in llm_results.items():
+            if key not in pattern_results or pattern_results[key] == "Unknown":
+                pattern_results[key] = value
         
-        return final_data
-            
+        logger.info("After LLM extraction, we have %d values", len(pattern_results))
+    
+    # Step 6: Apply the scale factor to all values
+    formatted_data = {}
+    for key, value in pattern_results.items():
+        formatted_data[key] = format_financial_value(value, scale_factor)
+    
+    # Step 7: Validate the data for reasonableness
+    validated_data = validate_financial_data(formatted_data)
+    
+    # Step 8: Infer missing values based on financial relationships
+    final_data = infer_missing_values(validated_data)
+    
+    # Step 9: Ensure we have all required fields
+    for field in REQUIRED_FIELDS:
+        if field not in final_data or final_data[field] == "Unknown":
+            final_data[field] = "Unknown"
+    
+    # Step 10: Process the data for visualization, over every period the tables hold
+    with stage_timer(timings, "visualization"):
+        periods = extract_period_values(parsed.get("tables"), scale_factor)
+        visualization_data = process_financial_data_for_visualization(final_data, periods)
+    
+    # Add visualization data to the response
+    final_data["visualization_data"] = visualization_data
+    
+    # Log the final values (built only when debug logging is on)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Final processed values: %s", ", ".join(
+            f"{key}: {value:,}" if isinstance(value, (int, float)) else f"{key}: {value}"
+            for key, value in final_data.items() if key != "visualization_data"
+        ))
+    
+    return final_data
+
+def extract_income_statement(pdf_source):
+    """
+    Extract income statement data using a hybrid approach combining pattern matching and LLM.
+    This approach is more robust and less likely to produce wildly inaccurate results.
+    `pdf_source` can be the raw PDF bytes or a path to a PDF file on disk.
+    """
+    try:
+        parsed = parse_income_statement(pdf_source)
+        result = complete_income_statement(parsed)
+        observe_stages(parsed["timings"])
+        return result
     except Exception as e:
-        print(f"Error in extract_income_statement: {str(e)}")
-        return {
-            "error": f"Error processing request: {str(e)}",
-            "Revenue": "Unknown",
-            "Cost_of_Revenue": "Unknown",
-            "Gross_Profit": "Unknown",
-            "Operating_Expenses": "Unknown",
-            "Operating_Income": "Unknown",
-            "Net_Income": "Unknown",
-            "visualization_data": None
-        }
+        return income_statement_error(e)
+
+# Sign of each statement line in the revenue-to-net-income waterfall, in REQUIRED_FIELDS order
+WATERFALL_SIGNS = np.array([1, -1, 1, -1, 1, 1])
+WATERFALL_NAMES = ["Revenue", "Cost of Revenue", "Gross Profit", "Operating Expenses", "Operating Income", "Net Income"]
+# Rows of the statement matrix that margins are computed for, against revenue (row 0)
+MARGIN_ROWS = {"gross_margin": 2, "operating_margin": 4, "net_margin": 5}
 
-def process_financial_data_for_visualization(income_statement_data: dict) -> dict:
+def _as_number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+
+def _to_list(array):
+    """Array to a JSON-safe list, with None for NaN and infinities."""
+    return [float(value) if np.isfinite(value) else None for value in array]
+
+def build_statement_matrix(income_statement_data: dict, periods: dict = None):
+    """
+    Stack the statement lines into a (len(REQUIRED_FIELDS), periods) array, oldest period first,
+    with NaN for unknown values. The last column always holds the final current-period values,
+    so the series agree with the validated and inferred figures.
+    """
+    labels = periods["labels"] if periods else ["current"]
+    matrix = np.full((len(REQUIRED_FIELDS), len(labels)), np.nan)
+    if periods:
+        for index, field in enumerate(REQUIRED_FIELDS):
+            if field in periods["fields"]:
+                matrix[index] = [_as_number(value) for value in periods["fields"][field]]
+    matrix[:, -1] = [_as_number(income_statement_data.get(field)) for field in REQUIRED_FIELDS]
+    return labels, matrix
+
+def process_financial_data_for_visualization(income_statement_data: dict, periods: dict = None) -> dict:
     """
     Process income statement data into a structured format for visualization.
     Returns a dictionary containing different views of the data.
+    `periods` (from extract_period_values) adds every period to the time series; margins,
+    growth and waterfalls are computed for all periods at once on a NumPy matrix.
     """
     try:
         # Convert all values to numeric, handling "Unknown" values
@@ -537,41 +988,53 @@ def process_financial_data_for_visualization(income_statement_data: dict) -> dic
             else:
                 numeric_data[key] = 0
 
-        # Create time series format (even though we have one period)
+        labels, matrix = build_statement_matrix(income_statement_data, periods)
+        # Unknown values count as zero in margins and waterfalls, as they always have
+        filled = np.nan_to_num(matrix)
+        revenue = filled[0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            margins = np.where(revenue != 0, filled[list(MARGIN_ROWS.values())] / revenue * 100, 0.0)
+            # Period-over-period change; unknown where either period is unknown or the base is zero
+            growth = np.diff(matrix, axis=1) / np.abs(matrix[:, :-1]) * 100
+        growth = np.hstack([np.full((len(REQUIRED_FIELDS), 1), np.nan), growth])
+        # + 0.0 turns the -0.0 of negated zeros into 0.0
+        waterfalls = WATERFALL_SIGNS[:, None] * filled + 0.0
+
+        percentages = {name: float(margins[row, -1]) for row, name in enumerate(MARGIN_ROWS)}
+
+        # Create time series format: the current period's values plus every period found
         time_series = {
             "categories": list(numeric_data.keys()),
             "values": list(numeric_data.values()),
-            "percentages": {
-                "gross_margin": (numeric_data.get("Gross_Profit", 0) / numeric_data.get("Revenue", 1)) * 100 if numeric_data.get("Revenue", 0) != 0 else 0,
-                "operating_margin": (numeric_data.get("Operating_Income", 0) / numeric_data.get("Revenue", 1)) * 100 if numeric_data.get("Revenue", 0) != 0 else 0,
-                "net_margin": (numeric_data.get("Net_Income", 0) / numeric_data.get("Revenue", 1)) * 100 if numeric_data.get("Revenue", 0) != 0 else 0
-            }
+            "percentages": percentages,
+            "periods": labels,
+            "series": {field: _to_list(matrix[row]) for row, field in enumerate(REQUIRED_FIELDS)},
+            "margins": {name: _to_list(margins[row]) for row, name in enumerate(MARGIN_ROWS)},
+            "growth": {field: _to_list(growth[row]) for row, field in enumerate(REQUIRED_FIELDS)},
+            "line_items": periods["line_items"] if periods else {},
         }
 
         # Create waterfall data for showing how we get from revenue to net income
-        waterfall_data = [
-            {"name": "Revenue", "value": numeric_data.get("Revenue", 0)},
-            {"name": "Cost of Revenue", "value": -numeric_data.get("Cost_of_Revenue", 0)},
-            {"name": "Gross Profit", "value": numeric_data.get("Gross_Profit", 0)},
-            {"name": "Operating Expenses", "value": -numeric_data.get("Operating_Expenses", 0)},
-            {"name": "Operating Income", "value": numeric_data.get("Operating_Income", 0)},
-            {"name": "Net Income", "value": numeric_data.get("Net_Income", 0)}
-        ]
+        waterfall_by_period = {
+            label: [{"name": name, "value": float(value)} for name, value in zip(WATERFALL_NAMES, waterfalls[:, column])]
+            for column, label in enumerate(labels)
+        }
 
         return {
             "raw_data": numeric_data,
             "time_series": time_series,
-            "waterfall": waterfall_data,
+            "waterfall": waterfall_by_period[labels[-1]],
+            "waterfall_by_period": waterfall_by_period,
             "metrics": {
                 "total_revenue": numeric_data.get("Revenue", 0),
                 "total_costs": numeric_data.get("Cost_of_Revenue", 0) + numeric_data.get("Operating_Expenses", 0),
                 "final_profit": numeric_data.get("Net_Income", 0),
-                "margins": time_series["percentages"]
+                "margins": percentages
             }
         }
     except Exception as e:
-        print(f"Error processing financial data for visualization: {str(e)}")
+        logger.error("Error processing financial data for visualization: %s", e)
         return {
             "raw_data": income_statement_data,
             "error": f"Failed to process data for visualization: {str(e)}"
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+from services.parse_pdf import (
+    parse_income_statement, complete_income_statement, income_statement_error,
+    needs_llm_fallback, async_extract_llm_financial_data, async_extract_vision_financial_data,
+    EXTRACTION_MODEL, EXTRACTION_PROMPT_VERSION
+)
+from services.generate_story import async_stream_story_from_json, STORY_MODEL, STORY_PROMPT_VERSION
+from services.result_cache import get_result_cache, make_cache_key, data_hash
+from services.executors import get_parse_executor, get_llm_executor
+from services.metrics import stage_timer, observe_stages, DOCUMENTS_TOTAL, DOCUMENTS_IN_PROGRESS
+from services.logging_config import task_id_var, run_with_task_id
+from services.token_usage import track_usage
+
+# How often streamed story text is reported back to the caller
+STORY_FLUSH_INTERVAL = 0.1  # seconds
+
+def _ignore_progress(fields: dict) -> None:
+    pass
+
+async def _timed(timings: dict, stage: str, coro):
+    with stage_timer(timings, stage):
+        return await coro
+
+async def run_extraction(pdf_path: str, doc_hash: str = None, timings: dict = None):
+    """
+    Run the income statement extraction with the CPU-bound parsing in the parse pool.
+    `doc_hash` is the upload's SHA-256, passed on so page renders can be cached without hashing the file again.
+    The text and vision fallbacks, if needed, are awaited concurrently on the async Ollama
+    client instead of holding threads.
+    Seconds spent in each extraction stage are added to `timings` when given.
+    """
+    timings = {} if timings is None else timings
+    loop = asyncio.get_event_loop()
+    try:
+        # Includes any wait for a free parse worker, unlike the parse steps reported by the worker
+        with stage_timer(timings, "parse"):
+            parsed = await loop.run_in_executor(
+                get_parse_executor(), run_with_task_id, task_id_var.get(), parse_income_statement, pdf_path, doc_hash
+            )
+        fallbacks = {}
+        if needs_llm_fallback(parsed):
+            fallbacks["llm_extraction"] = async_extract_llm_financial_data(parsed["processed_text"])
+        if parsed.get("vision_pages"):
+            fallbacks["vision_extraction"] = async_extract_vision_financial_data(parsed["vision_pages"])
+        results = await asyncio.gather(*(_timed(timings, stage, coro) for stage, coro in fallbacks.items()))
+        results = dict(zip(fallbacks, results))
+        result = complete_income_statement(parsed, results.get("llm_extraction"), results.get("vision_extraction"))
+        timings.update(parsed["timings"])
+        return result
+    except Exception as e:
+        return income_statement_error(e)
+
+async def analyze_document(pdf_path: str, doc_hash: str, report=None, include_story: bool = True) -> dict:
+    """
+    Extract the income statement from a stored PDF and write the financial story for it.
+
+    Cached results are used for either stage when available. `report` is called with
+    progress fields ("progress", "message", "cache", "story_partial") as the work advances,
+    so callers can forward them to a task store or a terminal.
+
+    Several documents can be analysed concurrently: parsing runs in the parse pool and the
+    model calls are awaited, so one document's parsing overlaps another's LLM calls.
+    The result includes the seconds spent in each stage under "stages", and the tokens
+    and model time its Ollama calls used under "tokens" (see token_usage.TokenUsage);
+    calls beyond TASK_TOKEN_BUDGET are not sent.
+    """
+    DOCUMENTS_IN_PROGRESS.inc()
+    try:
+        with track_usage() as usage:
+            result = await _analyze_document(pdf_path, doc_hash, report or _ignore_progress, include_story)
+        result["tokens"] = usage.as_dict()
+    except Exception:
+        DOCUMENTS_TOTAL.inc(status="error")
+        raise
+    finally:
+        DOCUMENTS_IN_PROGRESS.dec()
+    DOCUMENTS_TOTAL.inc(status="error" if "error" in result["income_statement"] else "completed")
+    return result
+
+async def _analyze_document(pdf_path: str, doc_hash: str, report, include_story: bool) -> dict:
+    start_time = time.time()
+    timings = {}
+    loop = asyncio.get_event_loop()
+    executor = get_llm_executor()
+    cache = get_result_cache()
+    income_key = make_cache_key(doc_hash, EXTRACTION_MODEL, EXTRACTION_PROMPT_VERSION)
+    cache_status = {"income_statement": False, "story": False}
+
+    # Check the cache before doing any parsing
+    json_data = None
+    if cache is not None:
+        with stage_timer(timings, "cache_lookup"):
+            json_data = await loop.run_in_executor(executor, cache.get, "income_statement", income_key)
+
+    if json_data is not None:
+        cache_status["income_statement"] = True
+        report({
+            "progress": 30,
+            "message": "Loaded income statement from cache",
+            "cache": dict(cache_status)
+        })
+    else:
+        # Update progress for text extraction
+        report({
+            "progress": 30,
+            "message": "Extracting text from PDF"
+        })
+        # Extract structured data
+        json_data = await run_extraction(pdf_path, doc_hash, timings)
+        # Don't cache failed extractions
+        if cache is not None and "error" not in json_data:
+            await loop.run_in_executor(executor, cache.set, "income_statement", income_key, json_data)
+
+    # Keyed by the statement the story is written from, so a re-extraction never gets an old story
+    story_key = make_cache_key(data_hash(json_data), STORY_MODEL, STORY_PROMPT_VERSION)
+    story = None
+    if include_story and cache is not None:
+        with stage_timer(timings, "cache_lookup"):
+            story = await loop.run_in_executor(executor, cache.get, "story", story_key)
+
+    if story is not None:
+        cache_status["story"] = True
+        report({
+            "progress": 70,
+            "message": "Loaded financial story from cache",
+            "cache": dict(cache_status)
+        })
+    elif include_story:
+        # Update progress for story generation
+        story_chunks = []
+        report({
+            "progress": 70,
+            "message": "Generating financial story",
+            "story_partial": ""
+        })
+        # Generate story, reporting the text so far as it arrives
+        last_flush = time.time()
+        with stage_timer(timings, "story_generation"):
+            async for chunk in async_stream_story_from_json(json_data):
+                story_chunks.append(chunk)
+                if time.time() - last_flush >= STORY_FLUSH_INTERVAL:
+                    report({"story_partial": "".join(story_chunks)})
+                    last_flush = time.time()
+        story = "".join(story_chunks).strip()
+        # Model failures come back as "Error: ..." strings and shouldn't be cached
+        if cache is not None and "error" not in json_data and not story.startswith("Error:"):
+            await loop.run_in_executor(executor, cache.set, "story", story_key, story)
+
+    observe_stages(timings)
+    return {
+        "income_statement": json_data,
+        "story": story,
+        "processing_time": f"{time.time() - start_time:.2f} seconds",
+        "stages": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        "cache": cache_status
+    }
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+class Subscription:
+    """
+    One listener's view of a task's progress.
+    `wait` returns as soon as the task changes, so listeners never poll an idle task.
+    """
+
+    def __init__(self, broker, task_id: str):
+        self.broker = broker
+        self.task_id = task_id
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def notify(self) -> None:
+        """Wake the listener; safe to call from executor threads."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, timeout=None) -> bool:
+        """Wait for the next change. Returns False if `timeout` seconds passed without one."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # Cleared before the caller reads the new state, so a change made while
+            # the caller is busy is picked up by the next wait instead of being lost
+            self._event.clear()
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ProgressBroker:
+    """Per-task publish/subscribe for progress updates within one process."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, task_id: str) -> Subscription:
+        """Register a listener for a task. Must be called from the event loop."""
+        subscription = Subscription(self, task_id)
+        with self._lock:
+            self._subscribers[task_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            listeners = self._subscribers.get(subscription.task_id)
+            if listeners is not None:
+                listeners.discard(subscription)
+                if not listeners:
+                    del self._subscribers[subscription.task_id]
+
+    def publish(self, task_id: str) -> None:
+        """Wake every listener of a task."""
+        with self._lock:
+            listeners = list(self._subscribers.get(task_id, ()))
+        for subscription in listeners:
+            subscription.notify()
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(listeners) for listeners in self._subscribers.values())
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from services.metrics import CACHE_LOOKUPS
+
+# Configuration with fallbacks
+CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+CACHE_PATH = os.environ.get(
+    "RESULT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "results.sqlite3")
+)
+CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", 7 * 24 * 60 * 60))  # seconds
+CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Page renders for the vision model are far bigger than results, so they get their own database and budget
+RENDER_CACHE_PATH = os.environ.get(
+    "RENDER_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "renders.sqlite3")
+)
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+def data_hash(value) -> str:
+    """SHA-256 of a JSON-serialisable value, independent of dict key order."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+def make_cache_key(doc_hash: str, model: str, prompt_version: str) -> str:
+    """Build a cache key from the document hash, the model name and the prompt version."""
+    return f"{doc_hash}:{model.lower()}:{prompt_version}"
+
+class ResultCache:
+    """
+    Content-addressed, on-disk cache for pipeline results.
+
+    Entries live in a small SQLite database so they survive restarts. Each entry
+    belongs to a namespace ("income_statement", "story", ...) and expires after
+    `ttl` seconds. When the total payload size goes over `max_bytes` the least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl: int = CACHE_TTL, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)")
+
+    def _connect(self):
+        # A fresh connection per operation keeps the cache safe to use from executor threads
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, namespace: str, key: str):
+        """Return the cached value, or None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM results WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if row is None:
+                CACHE_LOOKUPS.inc(namespace=namespace, result="miss")
+                return None
+            value, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                conn.execute("DELETE FROM results WHERE namespace = ? AND key = ?", (namespace, key))
+                CACHE_LOOKUPS.inc(namespace=namespace, result="miss")
+                return None
+            conn.execute(
+                "UPDATE results SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key)
+            )
+        CACHE_LOOKUPS.inc(namespace=namespace, result="hit")
+        return json.loads(value)
+
+    def set(self, namespace: str, key: str, value) -> None:
+        """Store a JSON-serialisable value and evict old entries if needed."""
+        payload = json.dumps(value)
+        size = len(payload.encode("utf-8"))
+        if self.max_bytes and size > self.max_bytes:
+            # Never let a single oversized entry flush the whole cache
+            return
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (namespace, key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, payload, size, now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now: float) -> None:
+        """Drop expired entries, then LRU entries until the cache fits in max_bytes."""
+        if self.ttl:
+            conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,))
+        if not self.max_bytes:
+            return
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for namespace, key, size in conn.execute(
+            "SELECT namespace, key, size FROM results ORDER BY accessed_at ASC"
+        ):
+            if total <= self.max_bytes:
+                break
+            victims.append((namespace, key))
+            total -= size
+        conn.executemany("DELETE FROM results WHERE namespace = ? AND key = ?", victims)
+
+    def clear(self) -> None:
+        """Remove every cached entry."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM results")
+
+_cache = None
+_render_cache = None
+
+def get_result_cache():
+    """Return the shared cache instance, or None when caching is disabled."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
+
+def get_render_cache():
+    """Return the page render cache, kept apart so renders never evict results, or None when caching is disabled."""
+    global _render_cache
+    if not CACHE_ENABLED:
+        return None
+    if _render_cache is None:
+        _render_cache = ResultCache(RENDER_CACHE_PATH, CACHE_TTL, RENDER_CACHE_MAX_BYTES)
+    return _render_cache
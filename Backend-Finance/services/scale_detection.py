@@ -0,0 +1,91 @@
+import itertools
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Configuration with fallbacks
+# Scale notes sit in a statement's heading or its footnotes; only this much of each end is searched
+SCALE_HEADER_CHARS = int(os.environ.get("SCALE_HEADER_CHARS", 2000))
+SCALE_FOOTER_CHARS = int(os.environ.get("SCALE_FOOTER_CHARS", 2000))
+# Dollar amounts averaged by the magnitude heuristic when no scale note is found
+SCALE_SAMPLE_VALUES = int(os.environ.get("SCALE_SAMPLE_VALUES", 200))
+
+UNIT_FACTORS = {
+    "billions": 1000000000, "bb": 1000000000,
+    "millions": 1000000, "mm": 1000000,
+    "thousands": 1000, "k": 1000, "000": 1000,
+}
+
+# Every scale note in one pass. Each alternative captures the unit; quantifiers are either
+# bounded or over characters the next token can't start with, so nothing backtracks far.
+SCALE_NOTE = re.compile(r"""
+      \bin\s+(billions|millions|thousands)\b                     # (in millions, except per share data), amounts in millions
+    | \b(billions|millions|thousands)\s+of\s+(?:dollars|usd|\$)   # millions of dollars
+    | \((billions|millions|thousands|bb|mm|k)\)                   # (millions), (mm)
+    | \(in\s+(bb|mm|k)\)                                          # (in mm)
+    | \(\s*(?:in\s+)?\$?\s*(000)'?s?\s*\)                         # (in 000s), ($000)
+    | \$\s?\d[\d,.]{0,20}\s?(bb|mm|k)\b                           # $5.2mm
+""", re.IGNORECASE | re.VERBOSE)
+
+DOLLAR_AMOUNT = re.compile(r'\$\s*(\d[\d,]*(?:\.\d+)?)')
+
+def _note_regions(text: str) -> str:
+    if len(text) <= SCALE_HEADER_CHARS + SCALE_FOOTER_CHARS:
+        return text
+    return text[:SCALE_HEADER_CHARS] + "\n" + text[-SCALE_FOOTER_CHARS:]
+
+def find_scale_note(text: str):
+    """
+    Scale factor stated in the header or footnote region of the text, or None.
+    When several units are stated the largest wins, so a "millions" note in a
+    document reported in billions is not taken for the statement's scale.
+    """
+    factors = [UNIT_FACTORS[next(unit for unit in match.groups() if unit).lower()]
+               for match in SCALE_NOTE.finditer(_note_regions(text))]
+    return max(factors) if factors else None
+
+def infer_scale_from_values(text: str) -> int:
+    """Guess the scale from the average size of the first SCALE_SAMPLE_VALUES dollar amounts."""
+    values = []
+    for match in itertools.islice(DOLLAR_AMOUNT.finditer(text), SCALE_SAMPLE_VALUES):
+        try:
+            values.append(float(match.group(1).replace(',', '')))
+        except ValueError:
+            continue
+    if not values:
+        return 1
+
+    avg_value = sum(values) / len(values)
+    logger.debug("Average of %d sampled values: %s", len(values), avg_value)
+    if avg_value > 100000000:  # Hundreds of millions and up: raw values
+        return 1
+    elif avg_value > 10000 and avg_value < 100000:  # Likely in thousands
+        return 1000
+    elif avg_value > 10 and avg_value < 10000:  # Likely in millions
+        return 1000000
+    elif avg_value < 10:  # Likely in billions
+        return 1000000000
+    return 1
+
+def detect_scale_notation(text: str) -> int:
+    """Scale of the amounts in the text: its scale note if it has one, else inferred from the values."""
+    factor = find_scale_note(text)
+    if factor is not None:
+        logger.debug("Detected scale note: %s", factor)
+        return factor
+    factor = infer_scale_from_values(text)
+    logger.debug("Inferred scale from values: %s", factor)
+    return factor
+
+def detect_page_scales(pages, page_indices) -> dict:
+    """The scale note of each candidate page, {page index: factor or None}; filings can mix units between tables."""
+    return {index: find_scale_note(pages[index]) for index in page_indices}
+
+def statement_scale(page_scales: dict, text: str) -> int:
+    """The statement's scale: the first candidate page with a scale note, else detected from the text."""
+    for index in sorted(page_scales):
+        if page_scales[index] is not None:
+            return page_scales[index]
+    return detect_scale_notation(text)
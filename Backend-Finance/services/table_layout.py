@@ -0,0 +1,185 @@
+import re
+
+# Words whose vertical centres are within this fraction of the word height share a row
+ROW_TOLERANCE = 0.5
+# Horizontal slack in points when merging the extents of numeric cells into columns
+COLUMN_SLACK = 2.0
+# A column must hold a value in at least this share of the table's rows; drops footnote markers and stray numbers
+MIN_COLUMN_SUPPORT = 1 / 3
+# Fewest rows with values for a page to count as holding a table
+MIN_TABLE_ROWS = 3
+
+# Numeric cells: 1,234 / (1,234) / -1,234.5 / $1,234. Ungrouped digits must not end in a comma ("31,").
+NUMBER_CELL = re.compile(r'^\(?-?\$?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?\)?$')
+# Dashes stand for zero and take up a column like any other figure
+NIL_CELL = re.compile(r'^[—–-]+$')
+YEAR_CELL = re.compile(r'^(?:19|20)\d{2}$')
+CURRENCY_SYMBOLS = {"$", "€", "£"}
+WORD = re.compile(r'[A-Za-z]')
+
+def parse_cell(text: str):
+    """Value of a numeric cell, negative when in parentheses; zero for a dash."""
+    if NIL_CELL.match(text):
+        return 0.0
+    negative = text.startswith("(") or text.startswith("-")
+    value = float(re.sub(r'[^\d.]', '', text))
+    return -value if negative else value
+
+def group_rows(words):
+    """
+    Group PyMuPDF words (x0, y0, x1, y1, text, ...) into rows by their vertical centre,
+    each row sorted left to right. Works across text blocks, which split table columns apart.
+    """
+    rows = []
+    row_centre = row_height = None
+    for word in sorted(words, key=lambda word: ((word[1] + word[3]) / 2, word[0])):
+        centre = (word[1] + word[3]) / 2
+        if rows and abs(centre - row_centre) <= ROW_TOLERANCE * row_height:
+            rows[-1].append(word)
+        else:
+            rows.append([word])
+            row_centre, row_height = centre, max(word[3] - word[1], 1.0)
+    return [sorted(row, key=lambda word: word[0]) for row in rows]
+
+def normalize_label(label: str) -> str:
+    """Drop dot leaders, trailing colons and currency symbols from a row label."""
+    label = re.sub(r'\.{2,}', ' ', label)
+    return re.sub(r'\s+', ' ', label).strip(" .:$")
+
+def split_row(row):
+    """
+    Split a row into its label and its cells as (x0, x1, text). The cells are the run of
+    figures at the end of the row; numbers or dashes followed by more words ("Note 3 - Leases",
+    "Revenue (1) from contracts") belong to the label. Footnote marks after a figure are ignored.
+    """
+    label_words = []
+    cells = []
+    for x0, _, x1, _, text, *_ in row:
+        if text in CURRENCY_SYMBOLS:
+            continue
+        if NUMBER_CELL.match(text) or NIL_CELL.match(text):
+            cells.append((x0, x1, text))
+        elif not cells:
+            label_words.append(text)
+        elif len(WORD.findall(text)) >= 2:
+            label_words.extend(cell[2] for cell in cells)
+            label_words.append(text)
+            cells = []
+    return normalize_label(" ".join(label_words)), cells
+
+def find_columns(cell_rows):
+    """
+    Cluster cells into columns by merging overlapping horizontal extents. Overlap works
+    whether the figures are right-aligned, left-aligned or centred. Columns used by too
+    few rows are dropped. Returns [(x0, x1)] left to right.
+    """
+    extents = sorted((x0, x1) for cells in cell_rows for x0, x1, _ in cells)
+    merged = []
+    for x0, x1 in extents:
+        if merged and x0 <= merged[-1][1] + COLUMN_SLACK:
+            merged[-1][1] = max(merged[-1][1], x1)
+        else:
+            merged.append([x0, x1])
+
+    minimum = max(1, MIN_COLUMN_SUPPORT * len(cell_rows))
+    columns = []
+    for x0, x1 in merged:
+        support = sum(1 for cells in cell_rows if any(x0 <= (a + b) / 2 <= x1 for a, b, _ in cells))
+        if support >= minimum:
+            columns.append((x0, x1))
+    return columns
+
+def _column_of(cell, columns):
+    centre = (cell[0] + cell[1]) / 2
+    for index, (x0, x1) in enumerate(columns):
+        if x0 <= centre <= x1:
+            return index
+    return None
+
+def _nearest_column(cell, columns):
+    centre = (cell[0] + cell[1]) / 2
+    return min(range(len(columns)), key=lambda index: abs((columns[index][0] + columns[index][1]) / 2 - centre))
+
+def _header_years(cells):
+    """The trailing run of year cells of a header row such as "Year ended December 31, 2024 2023"."""
+    years = []
+    for cell in reversed(cells):
+        if not YEAR_CELL.match(cell[2]):
+            break
+        years.insert(0, cell)
+    return years
+
+def build_table(words, page_index: int):
+    """
+    Rebuild the table on a page from its word positions.
+
+    Returns {"page", "periods", "rows": [{"label", "values"}]} with one value per period
+    column (None where the cell is empty), or None when the page has no table.
+    Periods are the years from the column headers, or "column_N" when there are none.
+    """
+    header = None
+    data = []
+    for row in group_rows(words):
+        label, cells = split_row(row)
+        if not cells:
+            continue
+        years = _header_years(cells)
+        if header is None and not data and years and len(cells) - len(years) <= 1:
+            header = years
+        elif label:
+            data.append((label, cells))
+    if len(data) < MIN_TABLE_ROWS:
+        return None
+
+    columns = find_columns([cells for _, cells in data])
+    if not columns:
+        return None
+
+    periods = [f"column_{index + 1}" for index in range(len(columns))]
+    if header:
+        if len(header) == len(columns):
+            periods = [cell[2] for cell in header]
+        else:
+            for cell in header:
+                periods[_nearest_column(cell, columns)] = cell[2]
+
+    rows = []
+    for label, cells in data:
+        values = [None] * len(columns)
+        for cell in cells:
+            index = _column_of(cell, columns)
+            if index is not None and values[index] is None:
+                values[index] = parse_cell(cell[2])
+        if any(value is not None for value in values):
+            rows.append({"label": label, "values": values})
+    if len(rows) < MIN_TABLE_ROWS:
+        return None
+    return {"page": page_index, "periods": periods, "rows": rows}
+
+def extract_tables(doc, page_indices, built=None):
+    """
+    Rebuild the tables on the given pages of an open document; pages without one are skipped.
+    `built` maps page indices to tables (or None) that were already rebuilt.
+    """
+    built = built or {}
+    tables = []
+    for index in page_indices:
+        table = built[index] if index in built else build_table(doc[index].get_text("words"), index)
+        if table is not None:
+            tables.append(table)
+    return tables
+
+def current_period_index(table) -> int:
+    """Column of the most recent period: the latest year when the headers are years, else the first column."""
+    years = [int(period) if YEAR_CELL.match(period) else -1 for period in table["periods"]]
+    return years.index(max(years)) if max(years) > 0 else 0
+
+def chronological_order(table):
+    """
+    Column indices from the oldest period to the newest. Year headers are sorted; without
+    them the columns are assumed newest first, the way filings print them.
+    """
+    periods = table["periods"]
+    if all(YEAR_CELL.match(period) for period in periods):
+        return sorted(range(len(periods)), key=lambda index: int(periods[index]))
+    return list(reversed(range(len(periods))))
@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from services.progress_events import ProgressBroker
+
+logger = logging.getLogger(__name__)
+
+# Configuration with fallbacks
+TASK_STORE_BACKEND = os.environ.get("TASK_STORE_BACKEND", "memory").lower()  # "memory" or "sqlite"
+TASK_STORE_PATH = os.environ.get(
+    "TASK_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "tasks.sqlite3")
+)
+TASK_TTL = int(os.environ.get("TASK_TTL", 60 * 60))  # seconds since the last update
+TASK_MAX_ENTRIES = int(os.environ.get("TASK_MAX_ENTRIES", 1000))
+TASK_MAX_BYTES = int(os.environ.get("TASK_MAX_BYTES", 256 * 1024 * 1024))
+# Other workers sharing the SQLite store can't notify this process, so listeners also re-check this often
+TASK_STORE_POLL_INTERVAL = float(os.environ.get("TASK_STORE_POLL_INTERVAL", 1.0))  # seconds
+
+def estimate_size(value) -> int:
+    """Approximate memory footprint of a task as the size of its JSON encoding."""
+    return len(json.dumps(value, default=str).encode("utf-8"))
+
+def is_pinned(value: dict) -> bool:
+    """
+    Tasks still being worked on and batch job records are never evicted to make room, only when their
+    TTL runs out; otherwise a large batch could push out the tasks its own workers are updating, or
+    the job record a client is following it with.
+    """
+    return value.get("status") == "processing" or value.get("type") == "batch"
+
+class MemoryTaskBackend:
+    """
+    In-process task storage with per-entry TTL, a maximum entry count and a byte budget.
+    Entries are kept in LRU order; the least recently used ones are evicted first,
+    skipping pinned ones (see is_pinned).
+    """
+
+    # Every update happens in this process, so change notifications are complete
+    poll_interval = None
+
+    def __init__(self, ttl: int = TASK_TTL, max_entries: int = TASK_MAX_ENTRIES, max_bytes: int = TASK_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # task_id -> (value, size, expires_at, pinned)
+        self._total_bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, task_id: str):
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return None
+            value, size, expires_at, _ = entry
+            if expires_at is not None and expires_at < time.time():
+                self._remove(task_id)
+                return None
+            self._entries.move_to_end(task_id)
+            return value
+
+    def set(self, task_id: str, value: dict, ttl=None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        size = estimate_size(value)
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            if task_id in self._entries:
+                self._remove(task_id)
+            self._entries[task_id] = (value, size, expires_at, is_pinned(value))
+            self._total_bytes += size
+            self._evict()
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            if task_id in self._entries:
+                self._remove(task_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "evictions": self._evictions,
+            }
+
+    def _remove(self, task_id: str) -> None:
+        _, size, _, _ = self._entries.pop(task_id)
+        self._total_bytes -= size
+
+    def _evict(self) -> None:
+        now = time.time()
+        expired = [task_id for task_id, (_, _, expires_at, _) in self._entries.items()
+                   if expires_at is not None and expires_at < now]
+        for task_id in expired:
+            self._remove(task_id)
+        if not self._over_budget():
+            return
+        # The newest entry is never evicted, even if it alone is over the byte budget
+        newest = next(reversed(self._entries))
+        candidates = [task_id for task_id, (_, _, _, pinned) in self._entries.items()
+                      if not pinned and task_id != newest]
+        for task_id in candidates:
+            if not self._over_budget():
+                break
+            self._remove(task_id)
+            self._evictions += 1
+
+    def _over_budget(self) -> bool:
+        return bool((self.max_entries and len(self._entries) > self.max_entries)
+                    or (self.max_bytes and self._total_bytes > self.max_bytes))
+
+class SQLiteTaskBackend:
+    """
+    SQLite-backed task storage, so task state survives restarts and can be shared
+    by several uvicorn workers on the same host. Same TTL, LRU and pinning rules as the memory backend.
+    """
+
+    def __init__(self, path: str = TASK_STORE_PATH, ttl: int = TASK_TTL,
+                 max_entries: int = TASK_MAX_ENTRIES, max_bytes: int = TASK_MAX_BYTES,
+                 poll_interval: float = TASK_STORE_POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_accessed ON tasks (accessed_at)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+            if "pinned" not in columns:
+                # Stores created before pinning was added
+                conn.execute("ALTER TABLE tasks ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, task_id: str):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < now:
+                conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+                return None
+            conn.execute("UPDATE tasks SET accessed_at = ? WHERE task_id = ?", (now, task_id))
+        return json.loads(value)
+
+    def set(self, task_id: str, value: dict, ttl=None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        payload = json.dumps(value, default=str)
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, value, size, expires_at, accessed_at, pinned) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (task_id, payload, len(payload.encode("utf-8")), expires_at, now, is_pinned(value))
+            )
+            self._evict(conn, now, task_id)
+
+    def delete(self, task_id: str) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def stats(self) -> dict:
+        with self._lock, self._connect() as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tasks").fetchone()
+        return {
+            "backend": "sqlite",
+            "entries": entries,
+            "bytes": total,
+            "evictions": self._evictions,
+        }
+
+    def _evict(self, conn, now: float, keep_task_id: str) -> None:
+        conn.execute("DELETE FROM tasks WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tasks").fetchone()
+        victims = []
+        for task_id, size in conn.execute(
+            "SELECT task_id, size FROM tasks WHERE task_id != ? AND pinned = 0 ORDER BY accessed_at ASC",
+            (keep_task_id,)
+        ):
+            over_entries = self.max_entries and entries > self.max_entries
+            over_bytes = self.max_bytes and total > self.max_bytes
+            if not (over_entries or over_bytes):
+                break
+            victims.append((task_id,))
+            entries -= 1
+            total -= size
+        conn.executemany("DELETE FROM tasks WHERE task_id = ?", victims)
+        self._evictions += len(victims)
+
+class TaskStore:
+    """
+    Storage for background task state (progress, results and errors).
+    Each task is a plain JSON-serialisable dict; the backend decides where it lives.
+    Every write is published to the broker so progress listeners wake up immediately.
+    """
+
+    def __init__(self, backend=None, broker=None):
+        self.backend = backend if backend is not None else MemoryTaskBackend()
+        self.broker = broker if broker is not None else ProgressBroker()
+
+    @property
+    def poll_interval(self):
+        """Fallback re-check interval for listeners, or None when notifications are enough."""
+        return self.backend.poll_interval
+
+    def subscribe(self, task_id: str):
+        """Listen for changes to a task; use as a context manager so the listener is removed."""
+        return self.broker.subscribe(task_id)
+
+    def get(self, task_id: str):
+        """Return the task dict, or None if it is unknown or expired."""
+        return self.backend.get(task_id)
+
+    def set(self, task_id: str, value: dict, ttl=None) -> None:
+        """Replace the task state, restarting its TTL."""
+        self.backend.set(task_id, value, ttl)
+        self.broker.publish(task_id)
+
+    def update(self, task_id: str, fields: dict) -> None:
+        """Merge fields into the task state. Unknown or expired tasks are recreated from `fields`."""
+        value = self.backend.get(task_id) or {}
+        value.update(fields)
+        self.backend.set(task_id, value)
+        self.broker.publish(task_id)
+
+    def pop(self, task_id: str):
+        """Return the task dict and remove it from the store."""
+        value = self.backend.get(task_id)
+        if value is not None:
+            self.backend.delete(task_id)
+            self.broker.publish(task_id)
+        return value
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.backend.get(task_id) is not None
+
+    def stats(self) -> dict:
+        """Entry count, approximate bytes held, evictions so far and connected listeners."""
+        stats = self.backend.stats()
+        stats["subscribers"] = self.broker.subscriber_count()
+        return stats
+
+def create_task_store(backend: str = TASK_STORE_BACKEND) -> TaskStore:
+    """Build the task store selected by TASK_STORE_BACKEND."""
+    if backend == "sqlite":
+        return TaskStore(SQLiteTaskBackend())
+    if backend != "memory":
+        logger.warning("Unknown task store backend '%s', using memory", backend)
+    return TaskStore(MemoryTaskBackend())
@@ -0,0 +1,138 @@
+import contextvars
+import logging
+import math
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Configuration with fallbacks
+# Context window requested from Ollama (num_ctx); a prompt and its completion must fit in it together
+OLLAMA_CONTEXT_TOKENS = int(os.environ.get("OLLAMA_CONTEXT_TOKENS", 8192))
+# Prompt plus completion tokens one task may spend over all its model calls; 0 for no limit
+TASK_TOKEN_BUDGET = int(os.environ.get("TASK_TOKEN_BUDGET", 100000))
+# Image tokens allowed per page sent to the vision model; the render DPI is chosen so the page fits
+VISION_PAGE_TOKENS = int(os.environ.get("VISION_PAGE_TOKENS", 3000))
+
+# Completion room below which a call isn't worth sending
+MIN_COMPLETION_TOKENS = 128
+# Starting guess for English financial text, refined per model from the prompt_eval_count Ollama reports
+DEFAULT_CHARS_PER_TOKEN = 4.0
+# Bounds on the learned ratio; Ollama counts only the uncached part of a prompt, which would inflate it
+MIN_CHARS_PER_TOKEN = 2.0
+MAX_CHARS_PER_TOKEN = 6.0
+# Weight of the latest call in the moving average of characters per token
+RATIO_SMOOTHING = 0.2
+
+# Ollama reports durations in nanoseconds; these are the ones kept, under their short names
+DURATION_FIELDS = {"total_duration": "total", "load_duration": "load",
+                   "prompt_eval_duration": "prompt_eval", "eval_duration": "eval"}
+
+class TokenEstimator:
+    """Estimates prompt tokens from text length, using the characters-per-token ratio seen for each model."""
+
+    def __init__(self):
+        self._ratios = {}
+        self._lock = threading.Lock()
+
+    def chars_per_token(self, model_name: str) -> float:
+        with self._lock:
+            return self._ratios.get(model_name, DEFAULT_CHARS_PER_TOKEN)
+
+    def estimate(self, text: str, model_name: str, images: int = 0) -> int:
+        """Tokens for `text` plus `images` page images (VISION_PAGE_TOKENS each)."""
+        return math.ceil(len(text) / self.chars_per_token(model_name)) + images * VISION_PAGE_TOKENS
+
+    def observe(self, model_name: str, text_chars: int, text_tokens: int) -> None:
+        """Refine the ratio from a prompt of `text_chars` characters that Ollama counted as `text_tokens` tokens."""
+        if text_chars <= 0 or text_tokens <= 0:
+            return
+        ratio = min(MAX_CHARS_PER_TOKEN, max(MIN_CHARS_PER_TOKEN, text_chars / text_tokens))
+        with self._lock:
+            previous = self._ratios.get(model_name, DEFAULT_CHARS_PER_TOKEN)
+            self._ratios[model_name] = previous + RATIO_SMOOTHING * (ratio - previous)
+
+ESTIMATOR = TokenEstimator()
+
+class TokenUsage:
+    """
+    Tokens and model time spent by one task, and what is left of its budget.
+    Shared by every coroutine and thread working on the task, so updates are locked.
+    """
+
+    def __init__(self, budget: int = TASK_TOKEN_BUDGET):
+        self.budget = budget
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.trimmed_calls = 0
+        self.refused_calls = 0
+        self.seconds = dict.fromkeys(DURATION_FIELDS.values(), 0.0)
+        self.models = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        self._lock = threading.Lock()
+
+    def spent(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def remaining(self):
+        """Tokens left in the budget, or None when the task has no budget."""
+        if not self.budget:
+            return None
+        return max(0, self.budget - self.spent())
+
+    def record(self, model_name: str, body: dict) -> None:
+        """Add the token counts and durations of one Ollama response."""
+        prompt_tokens = body.get("prompt_eval_count", 0)
+        completion_tokens = body.get("eval_count", 0)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            for field, name in DURATION_FIELDS.items():
+                self.seconds[name] += body.get(field, 0) / 1e9
+            model = self.models[model_name]
+            model["calls"] += 1
+            model["prompt_tokens"] += prompt_tokens
+            model["completion_tokens"] += completion_tokens
+
+    def count(self, outcome: str) -> None:
+        """Count a call whose prompt was trimmed ("trimmed") or that was not sent ("refused")."""
+        with self._lock:
+            if outcome == "trimmed":
+                self.trimmed_calls += 1
+            else:
+                self.refused_calls += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.spent(),
+                "budget": self.budget or None,
+                "trimmed_calls": self.trimmed_calls,
+                "refused_calls": self.refused_calls,
+                "seconds": {name: round(seconds, 4) for name, seconds in self.seconds.items()},
+                "completion_tokens_per_s": round(self.completion_tokens / self.seconds["eval"], 2)
+                if self.seconds["eval"] else None,
+                "models": {name: dict(model) for name, model in self.models.items()},
+            }
+
+# Usage of the task being processed by the current coroutine or thread; None outside of any task
+usage_var = contextvars.ContextVar("token_usage", default=None)
+
+@contextmanager
+def track_usage(budget: int = TASK_TOKEN_BUDGET):
+    """Count the model calls made inside the block (and in tasks started from it) against one budget."""
+    usage = TokenUsage(budget)
+    token = usage_var.set(usage)
+    try:
+        yield usage
+    finally:
+        usage_var.reset(token)
+
+def current_usage():
+    return usage_var.get()
@@ -0,0 +1,310 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+from dataclasses import dataclass
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Configuration with fallbacks
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", 10)) * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+UPLOAD_TMP_DIR = os.environ.get("UPLOAD_TMP_DIR") or None  # None uses the system temp dir
+# Batch uploads: total request size and number of PDFs per job (ZIP members included)
+MAX_BATCH_UPLOAD_BYTES = int(float(os.environ.get("MAX_BATCH_UPLOAD_MB", 500)) * 1024 * 1024)
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", 500))
+
+# The PDF header must start within the first 1024 bytes of the file
+PDF_MAGIC = b"%PDF-"
+PDF_HEADER_WINDOW = 1024
+ZIP_MAGIC = b"PK\x03\x04"
+# Allowance for multipart boundaries and form headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+@dataclass
+class StoredUpload:
+    """An uploaded PDF that has been spilled to a temporary file on disk."""
+    path: str
+    size: int
+    sha256: str
+
+    def cleanup(self) -> None:
+        """Delete the temporary file, ignoring files that are already gone."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def too_large_detail(max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    return f"File too large (max {max_bytes // (1024 * 1024)}MB)"
+
+class _Spool:
+    """Writes an upload to a temporary file chunk by chunk, hashing it and enforcing the size limit."""
+
+    def __init__(self, max_bytes: int, suffix: str = ".pdf"):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.tmp = tempfile.NamedTemporaryFile(prefix="upload-", suffix=suffix, dir=UPLOAD_TMP_DIR, delete=False)
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=too_large_detail(self.max_bytes))
+        self.digest.update(chunk)
+        self.tmp.write(chunk)
+
+    def finish(self) -> StoredUpload:
+        self.tmp.close()
+        return StoredUpload(path=self.tmp.name, size=self.size, sha256=self.digest.hexdigest())
+
+    def abort(self) -> None:
+        self.tmp.close()
+        os.remove(self.tmp.name)
+
+async def _spool_upload(file: UploadFile, header: bytes, max_bytes: int, suffix: str) -> StoredUpload:
+    spool = _Spool(max_bytes, suffix)
+    try:
+        chunk = header
+        while chunk:
+            spool.write(chunk)
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        spool.abort()
+        raise
+    return spool.finish()
+
+class _PdfPartReceiver:
+    """
+    Multipart callbacks that spool the PDF sent in form field `field` and skip every other part.
+    The filename and the PDF magic bytes are checked as soon as the part's first kilobyte is in.
+    """
+
+    def __init__(self, field: str, max_bytes: int):
+        self.field = field
+        self.max_bytes = max_bytes
+        self.upload = None
+        self._spool = None
+        self._in_file = False
+        self._head = b""
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        }
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        # Only the first file in the field is kept
+        self._in_file = options.get(b"name") == self.field.encode() and self.upload is None
+        if not self._in_file:
+            return
+        filename = options.get(b"filename", b"").decode("utf-8", "replace")
+        if not filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="Only PDF files are accepted")
+        self._head = b""
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if not self._in_file:
+            return
+        if self._spool is not None:
+            self._spool.write(data[start:end])
+            return
+        self._head += data[start:end]
+        if len(self._head) >= PDF_HEADER_WINDOW:
+            self._start_spool()
+
+    def _on_part_end(self) -> None:
+        if not self._in_file:
+            return
+        if self._spool is None:
+            self._start_spool()
+        self.upload = self._spool.finish()
+        self._spool = None
+        self._in_file = False
+
+    def _start_spool(self) -> None:
+        if PDF_MAGIC not in self._head[:PDF_HEADER_WINDOW]:
+            raise HTTPException(status_code=400, detail="File is not a valid PDF")
+        self._spool = _Spool(self.max_bytes)
+        self._spool.write(self._head)
+        self._head = b""
+
+    def abort(self) -> None:
+        if self._spool is not None:
+            self._spool.abort()
+        if self.upload is not None:
+            self.upload.cleanup()
+
+async def receive_pdf_upload(request, field: str = "file", max_bytes: int = MAX_UPLOAD_BYTES) -> StoredUpload:
+    """
+    Stream the PDF in form field `field` of a multipart/form-data request to a temporary file.
+
+    An UploadFile parameter is only handed over once Starlette has spooled the whole body,
+    so this parses the body as it arrives instead. The extension and PDF magic bytes are
+    checked on the first kilobyte, the upload is rejected as soon as it grows past
+    `max_bytes` (with or without a declared Content-Length), and the file is written to
+    disk once, hashed on the way through.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    receiver = _PdfPartReceiver(field, max_bytes)
+    parser = MultipartParser(params[b"boundary"], receiver.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException:
+        receiver.abort()
+        raise
+    if receiver.upload is None:
+        raise HTTPException(status_code=400, detail="No PDF file in the upload")
+    return receiver.upload
+
+def upload_limit(path: str) -> int:
+    """Largest file accepted by the upload endpoint at `path`."""
+    return MAX_BATCH_UPLOAD_BYTES if path == "/api/batch" else MAX_UPLOAD_BYTES
+
+class UploadSizeLimit:
+    """
+    ASGI middleware capping the request body of POSTs to /api/ endpoints.
+    A declared Content-Length over the limit is rejected before anything is read. Bodies
+    sent without one (chunked transfer encoding) are counted as they are received and cut
+    off with 413 once past the limit, before the endpoint has seen all of them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        limit = upload_limit(scope["path"])
+        max_body = limit + MULTIPART_OVERHEAD
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_body:
+            response = JSONResponse(status_code=413, content={"detail": too_large_detail(limit)})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    raise HTTPException(status_code=413, detail=too_large_detail(limit))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def is_zip_upload(file: UploadFile) -> bool:
+    return bool(file.filename) and file.filename.lower().endswith(".zip")
+
+async def store_pdf_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredUpload:
+    """
+    Stream an uploaded PDF to a temporary file in fixed-size chunks.
+
+    The extension and the PDF magic bytes are checked before the body is read,
+    and the upload is rejected as soon as it grows past `max_bytes`, so a huge
+    upload is never held in memory. The SHA-256 of the content is computed on
+    the way through so callers don't need to read the file again.
+    """
+    # Check file type before touching the body
+    if not file.filename or not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are accepted")
+
+    header = await file.read(PDF_HEADER_WINDOW)
+    if PDF_MAGIC not in header:
+        raise HTTPException(status_code=400, detail="File is not a valid PDF")
+
+    return await _spool_upload(file, header, max_bytes, ".pdf")
+
+async def store_zip_upload(file: UploadFile, max_bytes: int = MAX_BATCH_UPLOAD_BYTES) -> StoredUpload:
+    """Stream an uploaded ZIP archive to a temporary file; see `extract_pdfs_from_zip`."""
+    header = await file.read(len(ZIP_MAGIC))
+    if header != ZIP_MAGIC:
+        raise HTTPException(status_code=400, detail="File is not a valid ZIP archive")
+    return await _spool_upload(file, header, max_bytes, ".zip")
+
+def extract_pdfs_from_zip(zip_path: str, max_bytes: int = MAX_UPLOAD_BYTES, max_files: int = MAX_BATCH_FILES):
+    """
+    Copy every PDF in a ZIP archive to its own temporary file.
+
+    Returns a list of (member name, StoredUpload or error detail) pairs. Members are
+    streamed out with the same per-file size limit as single uploads, so a
+    compressed bomb is cut off at `max_bytes` instead of being inflated in full.
+    Directories, macOS resource forks and non-PDF members are skipped.
+    """
+    entries = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or not name.lower().endswith(".pdf") or "__MACOSX/" in name:
+                    continue
+                if len(entries) >= max_files:
+                    raise HTTPException(status_code=413, detail=f"Too many files in batch (max {max_files})")
+                if info.file_size > max_bytes:
+                    entries.append((name, too_large_detail(max_bytes)))
+                    continue
+                with archive.open(info) as member:
+                    header = member.read(PDF_HEADER_WINDOW)
+                    if PDF_MAGIC not in header:
+                        entries.append((name, "File is not a valid PDF"))
+                        continue
+                    spool = _Spool(max_bytes)
+                    try:
+                        chunk = header
+                        while chunk:
+                            spool.write(chunk)
+                            chunk = member.read(UPLOAD_CHUNK_SIZE)
+                    except HTTPException as e:
+                        spool.abort()
+                        entries.append((name, e.detail))
+                        continue
+                    except BaseException:
+                        spool.abort()
+                        raise
+                    entries.append((name, spool.finish()))
+    except BaseException:
+        # Don't leave the members copied so far behind when the archive is rejected
+        for _, stored in entries:
+            if isinstance(stored, StoredUpload):
+                stored.cleanup()
+        raise
+    return entries
@@ -0,0 +1,82 @@
+import base64
+import logging
+import math
+import os
+
+import fitz  # PyMuPDF
+
+from services.result_cache import get_render_cache
+from services.token_usage import VISION_PAGE_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Configuration with fallbacks
+# "auto" renders pages only when text extraction misses required fields, "always" for every document, "off" never
+VISION_EXTRACTION = os.environ.get("VISION_EXTRACTION", "auto").lower()
+# Pages sent to the vision model per document; each one is a separate, concurrent model call
+VISION_MAX_PAGES = int(os.environ.get("VISION_MAX_PAGES", 2))
+VISION_MIN_DPI = int(os.environ.get("VISION_MIN_DPI", 72))
+VISION_MAX_DPI = int(os.environ.get("VISION_MAX_DPI", 150))
+# Encoded size above which a page is downsampled further
+VISION_MAX_IMAGE_BYTES = int(os.environ.get("VISION_MAX_IMAGE_KB", 400)) * 1024
+VISION_JPEG_QUALITY = int(os.environ.get("VISION_JPEG_QUALITY", 80))
+
+# One image token covers a 14x14 pixel patch in the vision encoder
+PIXELS_PER_TOKEN = 14 * 14
+# Each downsampling step lowers the DPI by this factor
+DOWNSAMPLE_STEP = 0.8
+
+def choose_dpi(page_rect, token_budget: int = VISION_PAGE_TOKENS) -> int:
+    """Highest DPI, within VISION_MIN_DPI..VISION_MAX_DPI, at which the page fits in `token_budget` image tokens."""
+    # PDF page sizes are in points, 72 to the inch
+    square_inches = (page_rect.width / 72) * (page_rect.height / 72)
+    if square_inches <= 0:
+        return VISION_MIN_DPI
+    dpi = math.sqrt(token_budget * PIXELS_PER_TOKEN / square_inches)
+    return int(max(VISION_MIN_DPI, min(VISION_MAX_DPI, dpi)))
+
+def render_page(page, dpi: int) -> bytes:
+    """
+    Render a page as a grayscale JPEG, lowering the DPI until it fits in VISION_MAX_IMAGE_BYTES.
+    Statements are black text on white, so colour adds bytes without adding information.
+    """
+    while True:
+        pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        image = pixmap.tobytes("jpeg", jpg_quality=VISION_JPEG_QUALITY)
+        if len(image) <= VISION_MAX_IMAGE_BYTES or dpi <= VISION_MIN_DPI:
+            return image
+        dpi = max(VISION_MIN_DPI, int(dpi * DOWNSAMPLE_STEP))
+
+def select_vision_pages(scores, located, max_pages: int = VISION_MAX_PAGES):
+    """
+    Pick the pages to render from the page scores (see page_locator.score_page): the located
+    statement pages, else the best-scoring pages. Scanned documents have no text to score,
+    so their first pages are used.
+    """
+    if located:
+        return located[:max_pages]
+    best = sorted(range(len(scores)), key=lambda index: scores[index], reverse=True)[:max_pages]
+    best = sorted(index for index in best if scores[index] > 0)
+    return best or list(range(min(max_pages, len(scores))))
+
+def render_statement_pages(doc, page_indices, doc_hash: str = None):
+    """
+    Return the base64-encoded images of the given pages of an open document.
+    Renders are kept in the render cache under the document's SHA-256 `doc_hash`, so
+    reprocessing a document (e.g. after a prompt change) does not render it again.
+    Without a hash nothing is cached.
+    """
+    cache = get_render_cache() if doc_hash else None
+    images = []
+    for index in page_indices:
+        page = doc[index]
+        dpi = choose_dpi(page.rect)
+        key = f"{doc_hash}:{index}:{dpi}:{VISION_JPEG_QUALITY}:{VISION_MAX_IMAGE_BYTES}"
+        image = cache.get("page_image", key) if cache is not None else None
+        if image is None:
+            image = base64.b64encode(render_page(page, dpi)).decode("ascii")
+            if cache is not None:
+                cache.set("page_image", key, image)
+        logger.debug("Page %d image is %d KB", index + 1, len(image) * 3 // 4 // 1024)
+        images.append(image)
+    return images
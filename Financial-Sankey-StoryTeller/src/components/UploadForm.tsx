@@ -12,6 +12,7 @@ export default function UploadForm() {
   const [error, setError] = useState<string | null>(null)
   const [progress, setProgress] = useState(0)
   const [progressMessage, setProgressMessage] = useState('')
+  const [streamingStory, setStreamingStory] = useState('')
   const [taskId, setTaskId] = useState<string | null>(null)
   const [graphType, setGraphType] = useState('sankey');
   const [shouldSaveToArchive, setShouldSaveToArchive] = useState(true);
@@ -41,6 +42,12 @@ export default function UploadForm() {
           setProgress(data.progress || 0);
           setProgressMessage(data.message || "Processing...");
 
+          // Append story text as the model streams it; story_offset is where the chunk starts,
+      // 0 again after the browser reconnects
+          if (data.story_chunk) {
+            setStreamingStory(prev => prev.slice(0, data.story_offset ?? prev.length) + data.story_chunk);
+          }
+
           // Handle completion
           if (data.status === "completed") {
             console.log("Processing completed:", data);
@@ -115,6 +122,7 @@ export default function UploadForm() {
     setError(null)
     setProgress(0)
     setProgressMessage('Starting upload...')
+    setStreamingStory('')
 
     const formData = new FormData()
     formData.append('file', file)
@@ -262,6 +270,17 @@ export default function UploadForm() {
             </div>
           </div>
 
+          {loading && streamingStory && (
+            <div className="mt-4 bg-gray-900 bg-opacity-50 rounded-lg p-4 border border-purple-500 border-opacity-20">
+              <h2 className="text-xl font-semibold mb-2 text-purple-200">Financial Analysis (writing...)</h2>
+              <div className="bg-blue-800 p-4 rounded overflow-y-auto max-h-80 text-gray-200 text-left">
+                <ReactMarkdown>
+                  {streamingStory}
+                </ReactMarkdown>
+              </div>
+            </div>
+          )}
+
           {error && (
             <div className="mt-4 p-3 bg-red-900 bg-opacity-30 text-red-200 rounded-md border border-red-500 border-opacity-30">
               {error}
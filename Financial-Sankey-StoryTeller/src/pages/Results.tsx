@@ -13,6 +13,7 @@ const Results = () => {
   const navigate = useNavigate();
   const [data, setData] = useState<any>(null);
   const [error, setError] = useState<string | null>(null);
+  const [streamingStory, setStreamingStory] = useState('');
   const [graphType, setGraphType] = useState('sankey');
   
   useEffect(() => {
@@ -27,6 +28,12 @@ const Results = () => {
     eventSource.onmessage = (event) => {
       const data = JSON.parse(event.data);
       
+      // Append story text as the model streams it; story_offset is where the chunk starts,
+      // 0 again after the browser reconnects
+      if (data.story_chunk) {
+        setStreamingStory(prev => prev.slice(0, data.story_offset ?? prev.length) + data.story_chunk);
+      }
+
       if (data.status === 'completed') {
         setData({
           income_statement: data.income_statement,
@@ -65,6 +72,11 @@ const Results = () => {
         <div className="flex items-center justify-center">
           <div className="animate-spin rounded-full h-32 w-32 border-b-2 border-purple-500"></div>
         </div>
+        {streamingStory && (
+          <div className="mt-6">
+            <FinancialStory story={streamingStory} />
+          </div>
+        )}
       </div>
     );
   }